@@ -0,0 +1,137 @@
+"""
+Benchmark of the decoding of survey pages.
+
+Compares the decoding paths of a /survey/sync/timestamp/ page followed by the FormResponse mapping:
+    json: the whole body decoded with the standard library, as response.json() does.
+    orjson: the whole body decoded with orjson, the default path of the clients.
+    incremental: the body fed in chunks to ItemsDecoder, mapping each batch of items as it is decoded (stream_items).
+
+The pages are read from a response cache recorded with API_CACHE_MODE=record (only the survey pages are used), or
+generated when no cache directory is given. Run from src with:
+
+    python -m benchmarks.bench_decoding --cache_dir .cache/involves
+"""
+
+from pathlib import Path
+from typing import List, Dict, Callable
+import gzip
+import json
+import random
+import time
+import orjson
+import click
+from involves_api.decoding import decode_json, ItemsDecoder, DEFAULT_CHUNK_SIZE
+from models.orm_model import FormResponse
+
+
+def load_recorded_pages(cache_dir : Path) -> List[bytes]:
+    """Returns the bodies of the recorded survey pages, the pages whose items carry surveyData."""
+
+    bodies = []
+    for path in sorted(cache_dir.glob('*/*.json.gz')):
+        with gzip.open(path, 'rb') as f:
+            data = orjson.loads(f.read())
+        if isinstance(data, dict) and data.get('items') and 'surveyData' in data['items'][0]:
+            bodies.append(orjson.dumps(data))
+    return bodies
+
+
+def generate_pages(pages : int, items_per_page : int, answers : int) -> List[bytes]:
+    """Returns synthetic survey pages shaped like the API responses."""
+
+    rng = random.Random(0)
+    bodies = []
+    for page in range(pages):
+        items = [
+            {
+                'id' : page * items_per_page + i,
+                'repliedAt' : f'2024-05-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00',
+                'timeSpent' : rng.randint(10, 3600),
+                'deleted' : False,
+                'updatedAtMillis' : 1714500000000 + page * items_per_page + i,
+                'form' : {'id' : rng.randint(1, 50), 'name' : 'Formulario de auditoria'},
+                'assignedTo' : {'id' : rng.randint(1, 500), 'name' : 'Promotor'},
+                'pointOfSale' : {'id' : rng.randint(1, 5000), 'name' : 'Punto de venta', 'code' : 'PDV-0001'},
+                'surveyData' : [
+                    {
+                        'id' : (page * items_per_page + i) * answers + j,
+                        'formField' : {'id' : j, 'label' : f'Pregunta {j}'},
+                        'sku' : {'id' : rng.randint(1, 2000)} if j % 3 else None,
+                        'value' : rng.choice(['SI', 'NO', '', str(rng.randint(0, 100)), 'Sin observaciones'])
+                    }
+                    for j in range(answers)
+                    ]
+            }
+            for i in range(items_per_page)
+            ]
+        bodies.append(orjson.dumps({'items' : items, 'timestampLastItem' : items[-1]['updatedAtMillis']}))
+    return bodies
+
+
+def run_full(bodies : List[bytes], decode : Callable[[bytes], Dict], page_func : Callable) -> Dict[str,float]:
+
+    rows = 0
+    first_rows = []
+    started_at = time.perf_counter()
+    for body in bodies:
+        page_started_at = time.perf_counter()
+        mapped = page_func(decode(body)['items'])
+        first_rows.append(time.perf_counter() - page_started_at)
+        rows += len(mapped)
+    return {'seconds' : time.perf_counter() - started_at, 'rows' : rows, 'first_rows_ms' : 1000 * sum(first_rows) / len(first_rows)}
+
+
+def run_incremental(bodies : List[bytes], page_func : Callable, chunk_size : int) -> Dict[str,float]:
+
+    rows = 0
+    first_rows = []
+    started_at = time.perf_counter()
+    for body in bodies:
+        page_started_at = time.perf_counter()
+        first = None
+        decoder = ItemsDecoder()
+        for offset in range(0, len(body), chunk_size):
+            items = decoder.feed(body[offset:offset + chunk_size])
+            if items:
+                rows += len(page_func(items))
+                first = first or time.perf_counter() - page_started_at
+        items, _ = decoder.close()
+        rows += len(page_func(items))
+        first_rows.append(first or time.perf_counter() - page_started_at)
+    return {'seconds' : time.perf_counter() - started_at, 'rows' : rows, 'first_rows_ms' : 1000 * sum(first_rows) / len(first_rows)}
+
+
+@click.command('bench_decoding')
+@click.option('--cache_dir', type=click.Path(exists=True, file_okay=False, path_type=Path), default=None, help='Response cache with recorded survey pages.')
+@click.option('--pages', default=20, help='Generated pages when no cache is given.')
+@click.option('--items_per_page', default=100, help='Surveys per generated page.')
+@click.option('--answers', default=40, help='Answers per generated survey.')
+@click.option('--chunk_size', default=DEFAULT_CHUNK_SIZE, help='Bytes fed to the incremental decoder at a time.')
+@click.option('--repeat', default=3, help='Runs of each path, the best one is reported.')
+def main(cache_dir : Path, pages : int, items_per_page : int, answers : int, chunk_size : int, repeat : int):
+
+    bodies = load_recorded_pages(cache_dir) if cache_dir else generate_pages(pages, items_per_page, answers)
+    if not bodies:
+        raise click.ClickException(f'no survey pages recorded in {cache_dir}')
+
+    megabytes = sum(len(body) for body in bodies) / 1024**2
+    page_func = FormResponse.get_page_mapper()
+
+    click.echo(f'{len(bodies)} pages, {megabytes:.1f} MB')
+
+    paths = {
+        'json' : lambda: run_full(bodies, json.loads, page_func),
+        'orjson' : lambda: run_full(bodies, decode_json, page_func),
+        'incremental' : lambda: run_incremental(bodies, page_func, chunk_size)
+    }
+
+    for name, run in paths.items():
+        result = min((run() for _ in range(repeat)), key=lambda r: r['seconds'])
+        click.echo(
+            f"{name:<12} {result['seconds']:8.3f} s  {megabytes / result['seconds']:8.1f} MB/s  "
+            f"{result['rows'] / result['seconds']:10.0f} rows/s  first rows after {result['first_rows_ms']:7.2f} ms per page"
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+"""
+Offline benchmark of the table syncs.
+
+Serves synthetic data from a local FakeInvolvesServer and syncs every table into a local database, SQLite by default,
+measuring the phases of each table:
+    extract: the records of the table are requested and mapped without writing them.
+    initial_load: the table is synced into the empty database, every record is inserted.
+    incremental: a share of the items is touched at the source (--update_ratio) and the table is synced again.
+
+For each phase it reports the records per second, the peak RSS of the process and the requests served, followed by
+the breakdown of its time over the phases timed by utils.metrics (extract, mapping, classify, insert, update, merge,
+commit...), so a regression can be traced to the step of the sync that got slower. The results
+are compared with the records per second saved on the baselines file and the command fails when a phase is slower
+than its baseline by more than --tolerance. Run from src with:
+
+    python -m benchmarks.bench_sync --records 20000 --latency 0.02
+    python -m benchmarks.bench_sync --records 20000 --latency 0.02 --save_baselines
+
+The sync tuning parameters are read from the SYNC_* environment variables as in the flow.
+"""
+
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Iterator
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import click
+import orjson
+from prefect import flow
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from config.settings import SyncConfig
+from involves_api.client import InvolvesAPIClient
+from involves_api.async_client import SyncInvolvesAPIClient
+from models.base import Base
+from models.tasks import get_models_to_sync, sort_models_by_dependencies
+from utils.metrics import TableMetrics, track
+from benchmarks.fake_server import FakeDataset, FakeInvolvesServer
+from main import _sync_table
+
+DEFAULT_BASELINES = Path(__file__).with_name('baselines.json')
+
+
+def get_rss() -> int:
+    """Returns the resident set size of the process in bytes, its working set on Windows, or its peak when /proc is not available."""
+
+    if sys.platform == 'win32':
+        import win32api
+        import win32process
+        return win32process.GetProcessMemoryInfo(win32api.GetCurrentProcess())['WorkingSetSize']
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        # ru_maxrss is in bytes on macOS and in kilobytes on the other platforms
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+class PeakMemorySampler:
+    """Samples the RSS of the process on a background thread, keeping the highest value seen."""
+
+    def __init__(self, interval : float = 0.01):
+
+        self.interval = interval
+        self.peak = get_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, get_rss())
+
+    def __enter__(self) -> 'PeakMemorySampler':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, get_rss())
+
+
+class BenchmarkResults:
+
+    def __init__(self, server : FakeInvolvesServer):
+
+        self.server = server
+        self.results : List[Dict[str,Any]] = []
+
+    @contextmanager
+    def measure(self, table : str, phase : str) -> Iterator[Dict[str,Any]]:
+        """Measures a phase, the block stores the number of records it processed on the yielded dict."""
+
+        result = {'table' : table, 'phase' : phase, 'records' : 0}
+        metrics = TableMetrics(table)
+        requests = self.server.get_request_count()
+        started_at = time.perf_counter()
+
+        with PeakMemorySampler() as sampler, track(metrics):
+            yield result
+
+        result['seconds'] = round(time.perf_counter() - started_at, 3)
+        result['records_per_sec'] = round(result['records'] / result['seconds'], 1) if result['seconds'] else 0.0
+        result['peak_rss_mb'] = round(sampler.peak / 1024**2, 1)
+        result['requests'] = self.server.get_request_count() - requests
+        result['phases'] = metrics.summary()['phases']
+        self.results.append(result)
+
+        click.echo(f"{table:<18} {phase:<13} {result['records']:>9} records {result['seconds']:>8.2f} s {result['records_per_sec']:>10.0f} rec/s {result['peak_rss_mb']:>8.1f} MB {result['requests']:>6} requests")
+        for name, timing in result['phases'].items():
+            click.echo(f"{'':<18}   {name:<11} {timing['rows']:>9} rows    {timing['seconds']:>8.2f} s {timing['rows_per_sec']:>10.0f} rows/s")
+
+    def check(self, baselines : Dict[str,float], tolerance : float) -> List[str]:
+        """Returns the phases slower than their baseline by more than tolerance."""
+
+        regressions = []
+        for result in self.results:
+            key = f"{result['table']}:{result['phase']}"
+            baseline = baselines.get(key)
+            if baseline and result['records_per_sec'] < baseline * (1 - tolerance):
+                regressions.append(f"{key} : {result['records_per_sec']:.0f} rec/s, baseline {baseline:.0f} rec/s")
+        return regressions
+
+    def get_baselines(self) -> Dict[str,float]:
+        return {f"{result['table']}:{result['phase']}" : result['records_per_sec'] for result in self.results}
+
+
+@flow(name='benchmark_sync', validate_parameters=False)
+def run_benchmark(server : FakeInvolvesServer, api_client : InvolvesAPIClient, database_url : str, sync_config : SyncConfig, update_ratio : float) -> BenchmarkResults:
+
+    engine = create_engine(database_url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(engine)
+
+    results = BenchmarkResults(server)
+    models = sort_models_by_dependencies(get_models_to_sync(api_client.environment))
+
+    for model in models:
+        with session_factory() as db:
+            with results.measure(model.__tablename__, 'extract') as result:
+                result['records'] = sum(1 for _ in model.get_tagged_records_to_sync(api_client, db, stream=True))
+            with results.measure(model.__tablename__, 'initial_load') as result:
+                totals = _sync_table(api_client, model, db, sync_config)
+                result['records'] = sum(total['obtenidos'] for total in totals.values())
+
+    server.dataset.touch(update_ratio)
+
+    for model in models:
+        with session_factory() as db:
+            with results.measure(model.__tablename__, 'incremental') as result:
+                totals = _sync_table(api_client, model, db, sync_config)
+                result['records'] = sum(total['obtenidos'] for total in totals.values())
+
+    engine.dispose()
+
+    return results
+
+
+@click.command('bench_sync')
+@click.option('--records', default=5000, help='Items of each endpoint.')
+@click.option('--children', default=5, help='Form fields of each form and answers of each survey.')
+@click.option('--latency', default=0.0, help='Seconds added by the server to every request.')
+@click.option('--page_size', default=None, type=int, help='Maximum items per page served.')
+@click.option('--update_ratio', default=0.1, help='Share of the items touched before the incremental phase.')
+@click.option('--http_client', type=click.Choice(['requests', 'httpx']), default='requests')
+@click.option('--max_in_flight', default=1)
+@click.option('--timestamp_shards', default=1)
+@click.option('--stream_items', is_flag=True, help='Decode the timestamp pages incrementally.')
+@click.option('--database_url', default=None, help='SQLAlchemy URL of the target database, a temporary SQLite file when not provided.')
+@click.option('--baselines', 'baselines_path', type=click.Path(dir_okay=False, path_type=Path), default=DEFAULT_BASELINES, help='Records per second of each phase to compare with.')
+@click.option('--save_baselines', is_flag=True, help='Save the results as the new baselines instead of comparing with them.')
+@click.option('--tolerance', default=0.2, help='Allowed slowdown over the baseline before failing.')
+@click.option('--output', type=click.Path(dir_okay=False, path_type=Path), default=None, help='Write the results to this JSON file.')
+@click.option('--verbose', is_flag=True, help='Keep the request logs of the API client.')
+def main(records : int, children : int, latency : float, page_size : Optional[int], update_ratio : float, http_client : str, max_in_flight : int, timestamp_shards : int, stream_items : bool, database_url : Optional[str], baselines_path : Path, save_baselines : bool, tolerance : float, output : Optional[Path], verbose : bool):
+
+    if not verbose:
+        for name in ('involves_api.client', 'involves_api.async_client', 'involves_api.transport'):
+            logging.getLogger(name).setLevel(logging.WARNING)
+
+    click.echo(f'generating {records} items per endpoint...')
+    dataset = FakeDataset(records, children)
+
+    with tempfile.TemporaryDirectory() as directory, FakeInvolvesServer(dataset, latency, page_size) as server:
+
+        api_client_cls = SyncInvolvesAPIClient if http_client == 'httpx' else InvolvesAPIClient
+        api_client = api_client_cls(1, 'benchmark', 'user', 'password', max_in_flight=max_in_flight, timestamp_shards=timestamp_shards, stream_items=stream_items, base_url=server.url)
+
+        results = run_benchmark(server, api_client, database_url or f'sqlite:///{directory}/benchmark.db', SyncConfig.load_from_env(), update_ratio)
+
+    if output:
+        output.write_bytes(orjson.dumps(results.results, option=orjson.OPT_INDENT_2))
+
+    if save_baselines:
+        baselines_path.write_bytes(orjson.dumps(results.get_baselines(), option=orjson.OPT_INDENT_2))
+        click.echo(f'baselines saved at {baselines_path}')
+        return
+
+    if not baselines_path.exists():
+        click.echo(f'no baselines found at {baselines_path}, run with --save_baselines to create them.')
+        return
+
+    regressions = results.check(orjson.loads(baselines_path.read_bytes()), tolerance)
+    if regressions:
+        raise click.ClickException('throughput below the baselines :\n' + '\n'.join(regressions))
+
+    click.echo('throughput within the baselines.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,302 @@
+"""
+Local stand-in for the Involves Stage API used by the benchmarks.
+
+FakeDataset generates the items of every endpoint from the field specs of the models (each source path of __fields__
+gets a value of the column type), so the stub follows the mappings as they change. FakeInvolvesServer serves them on
+the /sync/timestamp/ and page-numbered endpoints with a configurable latency and maximum page size.
+
+The server can also be run alone and the flow pointed at it with API_BASE_URL:
+
+    python -m benchmarks.fake_server --port 8080 --records 100000 --latency 0.05
+"""
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+from typing import Dict, Any, List, Optional, Type, Tuple
+import itertools
+import math
+import random
+import threading
+import time
+import click
+import orjson
+from sqlalchemy.types import Integer, BigInteger, Boolean, Float, Date, DateTime
+from involves_api.fields import Field, PARENT_PREFIX
+from models.base import Base
+from models.orm_model import Visit, PointOfSale, Employee, Product, Form, FormField, FormResponse, EmployeeAbsence
+
+START_MILLIS = 1700000000000
+
+# endpoint : (pagination, models filled from its items, the first one owns the items and the second its child list)
+ENDPOINTS : Dict[str, Tuple[str, Tuple[Type[Base],...]]] = {
+    'visit' : ('timestamp', (Visit,)),
+    'pointofsale' : ('timestamp', (PointOfSale,)),
+    'sku' : ('timestamp', (Product,)),
+    'form' : ('timestamp', (Form, FormField)),
+    'survey' : ('timestamp', (FormResponse,)),
+    'employeeenvironment' : ('page', (Employee,)),
+    'employeeabsence' : ('page', (EmployeeAbsence,))
+}
+
+
+def _set_path(target : Dict[str,Any], path : str, value : Any) -> None:
+
+    *parents, key = path.split('.')
+    for parent in parents:
+        target = target.setdefault(parent, {})
+    target[key] = value
+
+
+def _get_timestamp_path(models : Tuple[Type[Base],...]) -> str:
+    """Returns the source path of updated_at_millis on the items of the endpoint."""
+
+    spec = models[-1].__fields__['updated_at_millis']
+    path = spec.path if isinstance(spec, Field) else spec
+
+    return path[len(PARENT_PREFIX):] if path.startswith(PARENT_PREFIX) else path
+
+
+class FakeDataset:
+    """Synthetic items of every endpoint, kept sorted by their update timestamp."""
+
+    def __init__(self, records : int = 1000, children : int = 5, seed : int = 0):
+
+        self.records = records
+        self.children = children
+        self.rng = random.Random(seed)
+        self.items : Dict[str, List[Dict[str,Any]]] = {}
+        self.timestamps : Dict[str, List[int]] = {}
+        self.timestamp_paths : Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+        for endpoint, (_, models) in ENDPOINTS.items():
+            self.timestamp_paths[endpoint] = _get_timestamp_path(models)
+            self.items[endpoint] = [self._generate_item(models, i + 1, START_MILLIS + i) for i in range(records)]
+            self._sort(endpoint)
+
+    def _get_value(self, model : Type[Base], column : str, spec : Field, item_id : int, child_id : Optional[int], millis : int) -> Any:
+
+        path = spec.path[len(PARENT_PREFIX):] if spec.path.startswith(PARENT_PREFIX) else spec.path
+
+        if column == 'updated_at_millis':
+            return millis
+        if path == 'id':
+            return child_id if child_id is not None and not spec.path.startswith(PARENT_PREFIX) else item_id
+
+        column_type = model.__table__.c[column].type
+        rng = self.rng
+
+        if isinstance(column_type, DateTime):
+            return (datetime(2024, 1, 1) + timedelta(minutes=rng.randint(0, 525600))).isoformat()
+        if isinstance(column_type, Date):
+            return (date(2024, 1, 1) + timedelta(days=rng.randint(0, 365))).isoformat()
+        if isinstance(column_type, Boolean):
+            return rng.random() < 0.5
+        if isinstance(column_type, Float):
+            return round(rng.uniform(-60, 60), 6)
+        if isinstance(column_type, (Integer, BigInteger)):
+            return rng.randint(1, 10000)
+
+        return rng.choice(('', 'SI', 'NO', f'{column} {rng.randint(1, 1000)}', 'Sin observaciones del punto de venta'))
+
+    def _generate_item(self, models : Tuple[Type[Base],...], item_id : int, millis : int) -> Dict[str,Any]:
+
+        item = {}
+
+        for model in models:
+            specs = {column : spec if isinstance(spec, Field) else Field(spec) for column, spec in model.__fields__.items()}
+            children = [{} for _ in range(self.children)] if model.__explode__ else []
+
+            for column, spec in specs.items():
+                if spec.path.startswith(PARENT_PREFIX):
+                    _set_path(item, spec.path[len(PARENT_PREFIX):], self._get_value(model, column, spec, item_id, None, millis))
+                elif model.__explode__:
+                    for position, child in enumerate(children):
+                        _set_path(child, spec.path, self._get_value(model, column, spec, item_id, item_id * self.children + position, millis))
+                else:
+                    _set_path(item, spec.path, self._get_value(model, column, spec, item_id, None, millis))
+
+            if model.__explode__:
+                item[model.__explode__] = children
+
+        return item
+
+    def _get_timestamp(self, endpoint : str, item : Dict[str,Any]) -> int:
+        return item[self.timestamp_paths[endpoint]]
+
+    def _sort(self, endpoint : str) -> None:
+
+        self.items[endpoint].sort(key=lambda item: self._get_timestamp(endpoint, item))
+        self.timestamps[endpoint] = [self._get_timestamp(endpoint, item) for item in self.items[endpoint]]
+
+    def touch(self, ratio : float) -> int:
+        """
+        Edits a share of the items of every endpoint as if they were changed at the source.
+
+        The touched items get new values on their content fields, so their row hash changes and they are written as
+        updates, and an update timestamp past the current last one, so the next incremental extraction returns them.
+        """
+
+        touched = 0
+        with self._lock:
+            for endpoint, items in self.items.items():
+                touched += len(self._update(endpoint, self.rng.sample(range(len(items)), int(len(items) * ratio))))
+        return touched
+
+    def update_items(self, endpoint : str, item_ids : List[int]) -> List[int]:
+        """Edits the given items of an endpoint the same way as touch, returns their new update timestamps."""
+
+        with self._lock:
+            positions = [position for position, item in enumerate(self.items[endpoint]) if item['id'] in item_ids]
+            return self._update(endpoint, positions)
+
+    def _update(self, endpoint : str, positions : List[int]) -> List[int]:
+
+        items = self.items[endpoint]
+        models = ENDPOINTS[endpoint][1]
+        millis = self.timestamps[endpoint][-1] if items else START_MILLIS
+        updated = []
+
+        for position in positions:
+            millis += 1
+            items[position] = self._generate_item(models, items[position]['id'], millis)
+            updated.append(millis)
+
+        self._sort(endpoint)
+
+        return updated
+
+    def get_timestamp_page(self, endpoint : str, millis : int, size : int, form_id : Optional[int] = None) -> Dict[str,Any]:
+        """Returns the page after millis, with form_id only the items of that form (the formId filter of the survey endpoint)."""
+
+        with self._lock:
+            start = bisect_right(self.timestamps[endpoint], millis)
+            if form_id is None:
+                items = self.items[endpoint][start:start + size]
+            else:
+                matching = (item for item in itertools.islice(self.items[endpoint], start, None) if (item.get('form') or {}).get('id') == form_id)
+                items = list(itertools.islice(matching, size))
+
+        return {'items' : items, 'timestampLastItem' : self._get_timestamp(endpoint, items[-1]) if items else None}
+
+    def get_numbered_page(self, endpoint : str, millis : int, page : int, size : int) -> Dict[str,Any]:
+
+        with self._lock:
+            start = bisect_right(self.timestamps[endpoint], millis)
+            total_pages = math.ceil((len(self.items[endpoint]) - start) / size)
+            offset = start + (page - 1) * size
+            items = self.items[endpoint][offset:offset + size]
+
+        return {'items' : items, 'totalPages' : total_pages, 'page' : page}
+
+
+class FakeInvolvesServer:
+    """Threaded HTTP server answering the requests of the API clients from a FakeDataset."""
+
+    def __init__(self, dataset : FakeDataset, latency : float = 0.0, page_size : Optional[int] = None, host : str = '127.0.0.1', port : int = 0):
+
+        self.dataset = dataset
+        self.latency = latency
+        self.page_size = page_size
+        self.request_counts : Dict[str,int] = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._get_handler())
+        self._server.daemon_threads = True
+        self._thread : Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def __enter__(self) -> 'FakeInvolvesServer':
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-involves', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def get_request_count(self) -> int:
+        with self._lock:
+            return sum(self.request_counts.values())
+
+    def answer(self, path : str, query : Dict[str,List[str]]) -> Tuple[int, Any]:
+        """Returns the status code and body of a GET request."""
+
+        parts = [part for part in path.split('/') if part]
+        size = int(query.get('size', ['100'])[0])
+        size = min(size, self.page_size) if self.page_size else size
+
+        # /v1/{environment}/{endpoint}/sync/timestamp/{millis}
+        if len(parts) >= 4 and parts[-3:-1] == ['sync', 'timestamp'] and parts[-4] in ENDPOINTS:
+            form_id = int(query['formId'][0]) if 'formId' in query else None
+            return 200, self.dataset.get_timestamp_page(parts[-4], int(parts[-1]), size, form_id)
+
+        # /v1/{environment}/{endpoint}/
+        if parts and parts[-1] in ENDPOINTS and ENDPOINTS[parts[-1]][0] == 'page':
+            millis = int(query.get('updatedAtMillis', ['0'])[0])
+            page = int(query.get('page', ['1'])[0])
+            return 200, self.dataset.get_numbered_page(parts[-1], millis, page, size)
+
+        return 404, {'message' : f'unknown endpoint {path}'}
+
+    def _get_handler(self) -> Type[BaseHTTPRequestHandler]:
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def do_GET(self) -> None:
+
+                url = urlparse(self.path)
+                endpoint = next((part for part in url.path.split('/') if part in ENDPOINTS), url.path)
+
+                with server._lock:
+                    server.request_counts[endpoint] = server.request_counts.get(endpoint, 0) + 1
+
+                if server.latency:
+                    time.sleep(server.latency)
+
+                status, data = server.answer(url.path, parse_qs(url.query))
+                body = orjson.dumps(data)
+
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+@click.command('fake_server')
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', default=8080)
+@click.option('--records', default=10000, help='Items of each endpoint.')
+@click.option('--children', default=5, help='Form fields of each form and answers of each survey.')
+@click.option('--latency', default=0.0, help='Seconds added to every request.')
+@click.option('--page_size', default=None, type=int, help='Maximum items per page, the size requested by the client when not provided.')
+def main(host : str, port : int, records : int, children : int, latency : float, page_size : Optional[int]):
+
+    server = FakeInvolvesServer(FakeDataset(records, children), latency, page_size, host, port)
+    click.echo(f'serving {records} items per endpoint at {server.url}/v1/1/ (API_BASE_URL={server.url})')
+    server._server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
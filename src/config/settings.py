@@ -1,9 +1,34 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Optional
 from pathlib import Path
 import os
 from dotenv import load_dotenv
 from config.config_block import IntegracionInvolves
+from involves_api.cache import CACHE_MODES
+
+HTTP_CLIENTS = ('requests', 'httpx')
+WRITE_MODES = ('classify', 'merge')
+INDEX_MODES = ('query', 'memory')
+
+
+def get_env_flag(name : str, default : bool = False) -> bool:
+    """Reads a boolean environment variable, accepting 1/true/yes/si as true."""
+
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'si')
+
+
+def check_choice(name : str, value : str, choices : tuple) -> None:
+    if value not in choices:
+        raise ValueError(f'{name} must be one of {choices}, got {value!r}')
+
+
+def check_minimum(name : str, value : float, minimum : float) -> None:
+    if value < minimum:
+        raise ValueError(f'{name} must be at least {minimum}, got {value}')
+
 
 @dataclass
 class APIConfig:
@@ -12,6 +37,60 @@ class APIConfig:
     domain : str
     app_user : str
     app_password : str
+    max_in_flight : int = 1
+    timestamp_shards : int = 1
+    http_client : str = 'requests'
+    rate_limit : float = 0
+    max_retries : int = 5
+    cache_mode : str = 'off'
+    cache_dir : str = '.cache/involves'
+    cache_ttl : float = 3600
+    cache_max_mb : int = 1024
+    stream_items : bool = False
+    base_url : Optional[str] = None
+    connect_timeout : float = 10.0
+    read_timeout : float = 60.0
+
+    def __post_init__(self):
+        """Rejects invalid tuning values when the configuration is loaded instead of failing in the middle of a sync."""
+
+        check_choice('http_client', self.http_client, HTTP_CLIENTS)
+        check_choice('cache_mode', self.cache_mode, CACHE_MODES)
+        check_minimum('max_in_flight', self.max_in_flight, 1)
+        check_minimum('timestamp_shards', self.timestamp_shards, 1)
+        check_minimum('rate_limit', self.rate_limit, 0)
+        check_minimum('max_retries', self.max_retries, 0)
+        check_minimum('cache_ttl', self.cache_ttl, 0)
+        check_minimum('cache_max_mb', self.cache_max_mb, 0)
+        if self.connect_timeout <= 0 or self.read_timeout <= 0:
+            raise ValueError(f'connect_timeout and read_timeout must be positive, got {self.connect_timeout} and {self.read_timeout}')
+
+    @classmethod
+    def load_from_env(cls, environment : str, domain : str, app_user : str, app_password : str) -> 'APIConfig':
+        """Returns the API config of the given credentials with the tuning parameters read from environment variables, missing values keep their defaults."""
+
+        defaults = cls(environment, domain, app_user, app_password)
+
+        return cls(
+            environment = environment,
+            domain = domain,
+            app_user = app_user,
+            app_password = app_password,
+            max_in_flight = int(os.getenv('API_MAX_IN_FLIGHT', defaults.max_in_flight)),
+            timestamp_shards = int(os.getenv('API_TIMESTAMP_SHARDS', defaults.timestamp_shards)),
+            http_client = os.getenv('API_HTTP_CLIENT', defaults.http_client),
+            rate_limit = float(os.getenv('API_RATE_LIMIT', defaults.rate_limit)),
+            max_retries = int(os.getenv('API_MAX_RETRIES', defaults.max_retries)),
+            cache_mode = os.getenv('API_CACHE_MODE', defaults.cache_mode),
+            cache_dir = os.getenv('API_CACHE_DIR', defaults.cache_dir),
+            cache_ttl = float(os.getenv('API_CACHE_TTL', defaults.cache_ttl)),
+            cache_max_mb = int(os.getenv('API_CACHE_MAX_MB', defaults.cache_max_mb)),
+            stream_items = get_env_flag('API_STREAM_ITEMS', defaults.stream_items),
+            base_url = os.getenv('API_BASE_URL', defaults.base_url),
+            connect_timeout = float(os.getenv('API_CONNECT_TIMEOUT', defaults.connect_timeout)),
+            read_timeout = float(os.getenv('API_READ_TIMEOUT', defaults.read_timeout)),
+        )
+
 
 @dataclass
 class DatabaseConfig:
@@ -20,6 +99,60 @@ class DatabaseConfig:
     password : str
     server : str
     database : str
+    fast_executemany : bool = False
+
+
+@dataclass
+class SyncConfig:
+
+    chunk_size : int = 5000
+    max_concurrent_tables : int = 4
+    write_mode : str = 'classify'
+    write_batch_size : int = 1000
+    index_mode : str = 'query'
+    index_dir : Optional[str] = None
+    landing_dir : Optional[str] = None
+    replay_run_id : Optional[str] = None
+    metrics_path : Optional[str] = None
+    artifact_sample_size : int = 20
+    commit_rows : int = 0
+    commit_seconds : float = 0
+    columnstore_chunk_size : int = 102400
+
+    def __post_init__(self):
+        """Rejects invalid tuning values when the configuration is loaded, e.g. max_concurrent_tables 0 would never start a table."""
+
+        check_choice('write_mode', self.write_mode, WRITE_MODES)
+        check_choice('index_mode', self.index_mode, INDEX_MODES)
+        check_minimum('chunk_size', self.chunk_size, 1)
+        check_minimum('max_concurrent_tables', self.max_concurrent_tables, 1)
+        check_minimum('write_batch_size', self.write_batch_size, 1)
+        check_minimum('artifact_sample_size', self.artifact_sample_size, 0)
+        check_minimum('commit_rows', self.commit_rows, 0)
+        check_minimum('commit_seconds', self.commit_seconds, 0)
+        check_minimum('columnstore_chunk_size', self.columnstore_chunk_size, 1)
+
+    @classmethod
+    def load_from_env(cls) -> 'SyncConfig':
+        """Reads the sync tuning parameters from environment variables, missing values keep their defaults."""
+
+        defaults = cls()
+
+        return cls(
+            chunk_size = int(os.getenv('SYNC_CHUNK_SIZE', defaults.chunk_size)),
+            max_concurrent_tables = int(os.getenv('SYNC_MAX_CONCURRENT_TABLES', defaults.max_concurrent_tables)),
+            write_mode = os.getenv('SYNC_WRITE_MODE', defaults.write_mode),
+            write_batch_size = int(os.getenv('SYNC_WRITE_BATCH_SIZE', defaults.write_batch_size)),
+            index_mode = os.getenv('SYNC_INDEX_MODE', defaults.index_mode),
+            index_dir = os.getenv('SYNC_INDEX_DIR', defaults.index_dir),
+            landing_dir = os.getenv('SYNC_LANDING_DIR', defaults.landing_dir),
+            replay_run_id = os.getenv('SYNC_REPLAY_RUN_ID', defaults.replay_run_id),
+            metrics_path = os.getenv('SYNC_METRICS_PATH', defaults.metrics_path),
+            artifact_sample_size = int(os.getenv('SYNC_ARTIFACT_SAMPLE_SIZE', defaults.artifact_sample_size)),
+            commit_rows = int(os.getenv('SYNC_COMMIT_ROWS', defaults.commit_rows)),
+            commit_seconds = float(os.getenv('SYNC_COMMIT_SECONDS', defaults.commit_seconds)),
+            columnstore_chunk_size = int(os.getenv('SYNC_COLUMNSTORE_CHUNK_SIZE', defaults.columnstore_chunk_size)),
+        )
 
 
 @dataclass
@@ -27,6 +160,7 @@ class Config:
 
     api : APIConfig
     db : DatabaseConfig
+    sync : SyncConfig = field(default_factory=SyncConfig)
 
     @classmethod
     def load_from_env(cls,env_path: Optional[Path] = None, override : bool = False) -> 'Config':
@@ -37,13 +171,11 @@ class Config:
         else:
             load_dotenv(override=override)
         
-        api_config = APIConfig(
-
+        api_config = APIConfig.load_from_env(
             environment = int(os.getenv('ENVIRONMENT')),
             domain = os.getenv('DOMAIN'),
             app_user = os.getenv('APP_USER'),
             app_password = os.getenv('APP_PASSWORD'),
-
         )
 
         db_config = DatabaseConfig(
@@ -51,10 +183,11 @@ class Config:
             username = os.getenv('SQL_USER'),
             password = os.getenv('SQL_PASSWORD'),
             server = os.getenv('SERVER'),
-            database = os.getenv('DATABASE')
+            database = os.getenv('DATABASE'),
+            fast_executemany = get_env_flag('DB_FAST_EXECUTEMANY'),
         )
 
-        return cls(api=api_config, db=db_config)
+        return cls(api=api_config, db=db_config, sync=SyncConfig.load_from_env())
     
     @classmethod
     def load_from_block(cls, block_name : str, env_path: Optional[Path] = None) -> 'Config':
@@ -66,13 +199,11 @@ class Config:
             cls.create_block_from_env(block_name,env_path)
             block = IntegracionInvolves.load(f'{block_name}')
 
-        api_config = APIConfig(
-
+        api_config = APIConfig.load_from_env(
             environment = int(block.environment),
             domain = block.domain,
             app_user = block.app_user.get_secret_value(),
-            app_password = block.app_password.get_secret_value()
-
+            app_password = block.app_password.get_secret_value(),
         )
 
         db_config = DatabaseConfig(
@@ -80,10 +211,11 @@ class Config:
             username = block.username.get_secret_value(),
             password = block.password.get_secret_value(),
             server = block.server,
-            database = block.database
+            database = block.database,
+            fast_executemany = get_env_flag('DB_FAST_EXECUTEMANY'),
         )
 
-        return cls(api=api_config, db=db_config)
+        return cls(api=api_config, db=db_config, sync=SyncConfig.load_from_env())
     
     @classmethod
     def create_block_from_env(cls, block_name : str, env_path : Optional[Path] = None, overwrite_block : bool = False, override_env_vars : bool = False):
@@ -0,0 +1,642 @@
+import httpx
+import asyncio
+import contextvars
+import itertools
+from functools import partial
+import threading
+import time
+import logging
+from . import mappers
+from .checkpoint import PageCheckpoint
+from .transport import Transport, RetryPolicy, DEFAULT_MAX_RETRIES, DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT
+from .cache import ResponseCache
+from .decoding import decode_json, ItemsDecoder
+from .sharding import WindowMerger, get_windows
+from utils.metrics import record_download
+from typing import Optional, List, Dict, Any, Callable, Union, TypeVar, AsyncIterator, Iterator, Iterable, Awaitable, Tuple
+T = TypeVar('T')
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+DEFAULT_MAX_CONNECTIONS = 20
+
+class AsyncInvolvesAPIClient:
+    """An asyncio client for the Involves Stage API built on httpx, every request shares one HTTP/2 connection pool."""
+
+    def __init__(self, environment, domain, username, password, max_in_flight : int = 1, timestamp_shards : int = 1, max_connections : int = DEFAULT_MAX_CONNECTIONS, connect_timeout : float = DEFAULT_CONNECT_TIMEOUT, read_timeout : float = DEFAULT_READ_TIMEOUT, rate_limit : float = 0, max_retries : int = DEFAULT_MAX_RETRIES, cache : Optional[ResponseCache] = None, stream_items : bool = False, base_url : Optional[str] = None, http_client : Optional[httpx.AsyncClient] = None):
+        """
+        Initializes the API client with basic authentication.
+
+        Parameters:
+            max_in_flight (int): Maximum number of concurrent requests used to fetch the pages of page-numbered endpoints. 1 fetches them sequentially.
+            timestamp_shards (int): Number of time windows walked concurrently by the visit, product and form response extractions. 1 walks a single timestamp chain.
+            max_connections (int): Size of the connection pool shared by all the requests of the client.
+            connect_timeout (float): Seconds to wait for a connection to the API, a request timing out is retried.
+            read_timeout (float): Seconds to wait for each read of the response, a request timing out is retried.
+            rate_limit (float): Maximum requests per second shared by all the tasks using the client. 0 disables the limit.
+            max_retries (int): Number of times a throttled (429), failed (5xx) or disconnected GET request is retried.
+            cache (Optional[ResponseCache]): On-disk cache the responses are served from and stored to, see ResponseCache for its modes.
+            stream_items (bool): Decodes the items of the /sync/timestamp/ pages while the body is received, so they are mapped before the whole page arrived. Not used when the client has a response cache.
+            base_url (Optional[str]): Root URL of the API, defaults to the Involves Stage API of the domain. Used to point the client at another server, e.g. the benchmark stub.
+            http_client (Optional[httpx.AsyncClient]): Connection pool of another client to send the requests through, see create_http_client. It is left open by aclose.
+        """
+
+        self.environment = environment
+        self.username = username
+        self.password = password
+        self.domain = domain
+        self.base_url = base_url.rstrip('/') if base_url else f"https://{self.domain}.involves.com/webservices/api"
+        self.max_in_flight = max(1, max_in_flight)
+        self.timestamp_shards = max(1, timestamp_shards)
+        self.transport = Transport(rate_limit, retry_policy=RetryPolicy(max_retries=max_retries), retry_exceptions=(httpx.TransportError,))
+        self.cache = cache
+        self.stream_items = stream_items
+
+        self.auth = httpx.BasicAuth(self.username,self.password)
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.client = http_client or self.create_http_client(max_connections, self.timeout)
+        self._owns_client = http_client is None
+
+        logger.info(f'initialized async involves_api_client at: \n env : {self.environment}. \n domain : {self.domain}.')
+
+    async def __aenter__(self) -> 'AsyncInvolvesAPIClient':
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        """Closes the connections of the pool, unless the pool was given by another client."""
+        if self._owns_client:
+            await self.client.aclose()
+
+    def for_environment(self, environment, domain, username, password, **kwargs) -> 'AsyncInvolvesAPIClient':
+        """Returns a client of another Involves environment or account that sends its requests through the connection pool of this client, kwargs are passed to AsyncInvolvesAPIClient."""
+
+        return AsyncInvolvesAPIClient(environment, domain, username, password, http_client=self.client, **kwargs)
+
+    @staticmethod
+    def create_http_client(max_connections : int = DEFAULT_MAX_CONNECTIONS, timeout : Union[float, httpx.Timeout] = DEFAULT_READ_TIMEOUT) -> httpx.AsyncClient:
+        """Returns the HTTP/2 connection pool of the client, the credentials are sent on each request so clients of several accounts can share it."""
+
+        return httpx.AsyncClient(
+            headers = {
+                'X-AGILE-CLIENT' : 'EXTERNAL_APP',
+                'Accept-Version' : '2020-02-26',
+                'Accept-Encoding' : 'gzip'
+            },
+            http2 = True,
+            limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout = timeout
+        )
+
+
+    async def _get_json(self, url : str, params : Optional[Dict[str,Any]] = None) -> Any:
+        """
+        Sends a GET request through the transport and returns the decoded JSON body, raising for HTTP error status codes once the retries run out.
+
+        When the client has a response cache the body is served from it if possible and stored on it otherwise, the disk
+        access runs on a worker thread to keep the event loop free.
+        """
+
+        if self.cache:
+            data = await asyncio.to_thread(self.cache.get, url, params)
+            if data is not None:
+                return data
+
+        response = await self.transport.send_async(partial(self.client.get, url, params=params, auth=self.auth, timeout=self.timeout))
+        logger.info(f'GET request at URL : \n {url}. \n params = {params} \n status_code = {response.status_code} \n http_version = {response.http_version}')
+
+        response.raise_for_status()
+
+        record_download(len(response.content))
+        data = decode_json(response.content)
+
+        if self.cache:
+            await asyncio.to_thread(self.cache.put, url, params, data)
+
+        return data
+
+    async def _paginated_request_with_timestamp(self, url : str, start_millis : Optional[int] = None, end_millis : Optional[int] = None, params : Dict[str,Any] = None, page_func : Optional[Callable[[List[Dict[str,Any]]], List[T]]] = None, stream : bool = False, shards : int = 1, checkpoint : Optional[PageCheckpoint] = None) -> Union[List[T],AsyncIterator[T]]:
+        """
+        Get records modified or created on a specific interval in milliseconds from the provided API URL.
+
+        Parameters:
+            url (str): The base URL for the API endpoint.
+            start_millis (Optional[int]): The starting timestamp in milliseconds to use as a parameter. If not provided defaults to 0.
+            end_millis (Optional[int]): The ending timestamp in milliseconds to use as a parameter. If not provided the method returns all records modified after start_millis.
+            params (Dict[str, Any], optional): Additional parameters to include in the request.
+            page_func (Callable[[List[Dict[str, Any]]], List[T]], optional): A function to transform the items of each page of the API response data into the desired format. If not provided the items are returned as they are.
+            stream (bool): If True returns an async generator that yields records page by page instead of collecting them into a list.
+            shards (int): Number of time windows walked concurrently. Only used when start_millis is provided, otherwise the request is sequential.
+            checkpoint (Optional[PageCheckpoint]): Tracks the timestampLastItem of the emitted pages. A sequential request resumes after its cursor when it is set, sharded requests ignore it.
+
+        Returns:
+            Union[List[T], AsyncIterator[T]]: The records created or modified after start_millis and before end_millis.
+        """
+        if shards > 1 and start_millis and not (checkpoint and checkpoint.cursor):
+            records = self._iter_sharded_request_with_timestamp(url, start_millis, end_millis, params, page_func, shards)
+        else:
+            records = self._iter_request_with_timestamp(url, start_millis, end_millis, params, page_func, checkpoint)
+
+        return records if stream else [record async for record in records]
+
+    async def _iter_request_with_timestamp(self, url : str, start_millis : Optional[int] = None, end_millis : Optional[int] = None, params : Dict[str,Any] = None, page_func : Optional[Callable[[List[Dict[str,Any]]], List[T]]] = None, checkpoint : Optional[PageCheckpoint] = None) -> AsyncIterator[T]:
+        """Async generator version of _paginated_request_with_timestamp, only one page of records is held in memory at a time."""
+
+        if not page_func:
+            page_func = list
+
+        if checkpoint and checkpoint.cursor:
+            logger.info(f'resuming timestamp chain from checkpoint : {checkpoint.cursor}')
+            start_millis = checkpoint.cursor
+
+        total_records = 0
+
+        async for items, next_millis in self._iter_timestamp_pages(url, start_millis, end_millis, params):
+            rows = page_func(items)
+            for record in rows:
+                yield record
+
+            total_records += len(rows)
+            if checkpoint:
+                checkpoint.page_done(len(rows), next_millis)
+
+        logger.info(f'paginated request finished with a total of {total_records} items.')
+
+    async def _iter_timestamp_pages(self, url : str, start_millis : Optional[int] = None, end_millis : Optional[int] = None, params : Dict[str,Any] = None) -> AsyncIterator[Tuple[List[Dict[str,Any]],Optional[int]]]:
+        """
+        Walks the timestampLastItem chain of a /sync/timestamp/ endpoint yielding the raw items of each page with the timestampLastItem that follows it.
+
+        With stream_items a page is yielded in several batches, every batch but the last one with a None timestamp.
+        """
+
+        default_params = {
+            'size' : 100
+        }
+
+        if params:
+            default_params.update(params)
+
+        millis = start_millis
+
+        while True:
+
+            request_url = f'{url}{millis if millis else 0}'
+            page_items = 0
+
+            async for items, response_data in self._iter_page_items(request_url, default_params):
+                page_items += len(items)
+
+                if response_data is None:
+                    yield items, None
+                    continue
+
+                millis = response_data.get('timestampLastItem')
+                logger.info(f'timestamp of next request : {millis}')
+
+                if page_items:
+                    logger.info(f'request response includes {page_items} items.')
+                    yield items, millis
+
+            if not millis or (end_millis is not None and millis >= end_millis):
+                logger.info('timestampLastItem not found in response or end millis reached, timestamp chain finished.')
+                break
+
+    async def _iter_page_items(self, url : str, params : Optional[Dict[str,Any]] = None) -> AsyncIterator[Tuple[List[Dict[str,Any]],Optional[Dict[str,Any]]]]:
+        """Async version of InvolvesAPIClient._iter_page_items, yields the batches of items decoded while the body is received and finally the rest of the response."""
+
+        if not self.stream_items or self.cache:
+            response_data = await self._get_json(url, params)
+            yield response_data.get('items') or [], response_data
+            return
+
+        response = await self.transport.send_async(partial(self._send_streamed_request, url, params))
+        logger.info(f'GET request at URL : \n {url}. \n params = {params} \n status_code = {response.status_code} \n http_version = {response.http_version}')
+
+        try:
+            response.raise_for_status()
+
+            decoder = ItemsDecoder()
+            async for chunk in response.aiter_bytes():
+                record_download(len(chunk))
+                items = decoder.feed(chunk)
+                if items:
+                    yield items, None
+        finally:
+            await response.aclose()
+
+        items, response_data = decoder.close()
+        yield items, response_data
+
+    async def _send_streamed_request(self, url : str, params : Optional[Dict[str,Any]] = None) -> httpx.Response:
+        """Sends a GET request without reading its body, the stream of a response that will be retried is closed right away."""
+
+        response = await self.client.send(self.client.build_request('GET', url, params=params, timeout=self.timeout), stream=True, auth=self.auth)
+        if response.status_code in self.transport.retry_policy.retry_status_codes:
+            await response.aclose()
+
+        return response
+
+    async def _iter_sharded_request_with_timestamp(self, url : str, start_millis : int, end_millis : Optional[int] = None, params : Dict[str,Any] = None, page_func : Optional[Callable[[List[Dict[str,Any]]], List[T]]] = None, shards : int = 2, timestamp_key : str = 'updatedAtMillis') -> AsyncIterator[T]:
+        """
+        Splits (start_millis, end_millis] into shards time windows and walks the timestamp chain of each window as its own task.
+
+        Follows the same rules as InvolvesAPIClient._iter_sharded_request_with_timestamp: each chain stops at its window end,
+        items past the window end are dropped, the windows are merged with a WindowMerger, and the last window stays open
+        when end_millis is not provided.
+        """
+
+        if not page_func:
+            page_func = list
+
+        upper_bound = end_millis if end_millis is not None else round(time.time()*1000)
+        if upper_bound <= start_millis:
+            async for record in self._iter_request_with_timestamp(url, start_millis, end_millis, params, page_func):
+                yield record
+            return
+
+        windows = get_windows(start_millis, upper_bound, end_millis, shards)
+        logger.info(f'walking {len(windows)} timestamp windows concurrently from {start_millis} to {end_millis or "now"}.')
+
+        pages = asyncio.Queue(maxsize=2*len(windows))
+        finished = object()
+
+        async def walk_window(window : int, low : int, high : Optional[int]) -> None:
+            try:
+                async for items, _ in self._iter_timestamp_pages(url, low, high, params):
+                    await pages.put((window, [
+                        item for item in items
+                        if item.get(timestamp_key) is None or (item[timestamp_key] > low and (high is None or item[timestamp_key] <= high))
+                        ]))
+                await pages.put((window, finished))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await pages.put((window, e))
+
+        tasks = [asyncio.create_task(walk_window(window, low, high)) for window, (low, high) in enumerate(windows)]
+
+        total_records = 0
+        merger = WindowMerger(len(windows), timestamp_key)
+
+        try:
+            while merger.pending:
+                window, page = await pages.get()
+
+                if page is finished:
+                    merger.finish(window)
+                    continue
+
+                if isinstance(page, Exception):
+                    raise page
+
+                rows = page_func(merger.merge(window, page))
+                total_records += len(rows)
+                for record in rows:
+                    yield record
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        logger.info(f'sharded request finished with a total of {total_records} items.')
+
+    async def _paginated_request_with_page(self, url : str, params : Dict[str,Any] = None, page_func : Optional[Callable[[List[Dict[str,Any]]], List[T]]] = None, stream : bool = False, checkpoint : Optional[PageCheckpoint] = None) -> Union[List[T],AsyncIterator[T]]:
+        """
+        Get records from the provided API URL with pagination.
+
+        Parameters:
+            url (str): The base URL for the API endpoint.
+            params (Dict[str, Any], optional): Additional parameters to include in the request.
+            page_func (Callable[[List[Dict[str, Any]]], List[T]], optional): A function to transform the items of each page of the API response data into the desired format. If not provided the items are returned as they are.
+            stream (bool): If True returns an async generator that yields records page by page instead of collecting them into a list.
+            checkpoint (Optional[PageCheckpoint]): Tracks the number of the emitted pages. When its cursor is set the request resumes on the following page.
+
+        Returns:
+            Union[List[T], AsyncIterator[T]]: The records obtained from the URL.
+        """
+        records = self._iter_request_with_page(url, params, page_func, checkpoint)
+
+        return records if stream else [record async for record in records]
+
+    async def _iter_request_with_page(self, url : str, params : Dict[str,Any] = None, page_func : Optional[Callable[[List[Dict[str,Any]]], List[T]]] = None, checkpoint : Optional[PageCheckpoint] = None) -> AsyncIterator[T]:
+        """
+        Async generator version of _paginated_request_with_page.
+
+        The first page is requested alone to learn totalPages, the remaining pages are requested with at most max_in_flight
+        requests running and yielded in page order. With a checkpoint the request starts on the page that follows its cursor.
+        """
+
+        total_records = 0
+        if not page_func:
+            page_func = list
+
+        page = checkpoint.cursor + 1 if checkpoint and checkpoint.cursor else 1
+        if page > 1:
+            logger.info(f'resuming paginated request from checkpoint at page : {page}')
+
+        default_params = {
+            'size' : 200,
+            'page' : page
+        }
+
+        if params:
+            default_params.update(params)
+
+        response_data = await self._get_json(url, default_params)
+        total_pages = response_data.get('totalPages') if isinstance(response_data,dict) else 1
+
+        remaining_pages = self._fetch_pages(url, default_params, range(page + 1, total_pages + 1)) if total_pages and total_pages > page else None
+
+        while True:
+
+            items = response_data.get('items') if 'items' in response_data else response_data
+
+            logger.info(f'request response includes {len(items)} items.')
+
+            rows = page_func(items) if items else []
+            for record in rows:
+                yield record
+
+            total_records += len(rows)
+            if checkpoint:
+                checkpoint.page_done(len(rows), page)
+
+            logger.info(f'page progress : {page}/{total_pages}')
+
+            if remaining_pages is None:
+                break
+
+            try:
+                response_data = await remaining_pages.__anext__()
+            except StopAsyncIteration:
+                break
+            page += 1
+
+        logger.info(f'Paginated request finished with a total of {total_records} items.')
+
+    async def _fetch_pages(self, url : str, params : Dict[str,Any], pages : Iterable[int]) -> AsyncIterator[Any]:
+        """Requests the given pages keeping at most max_in_flight requests running, yields the decoded responses in page order."""
+
+        pages = iter(pages)
+        in_flight = [
+            asyncio.create_task(self._get_json(url, {**params, 'page' : page}))
+            for page in itertools.islice(pages, self.max_in_flight)
+            ]
+
+        try:
+            while in_flight:
+                response_data = await in_flight.pop(0)
+                next_page = next(pages, None)
+                if next_page is not None:
+                    in_flight.append(asyncio.create_task(self._get_json(url, {**params, 'page' : next_page})))
+                yield response_data
+        finally:
+            for task in in_flight:
+                task.cancel()
+            await asyncio.gather(*in_flight, return_exceptions=True)
+
+
+    async def get_updated_visits(self, start_millis : Optional[int] = None, end_millis : Optional[int] = None, stream : bool = False, checkpoint : Optional[PageCheckpoint] = None, page_func : Optional[Callable[[List[Dict[str,Any]]], List[Dict[str,Any]]]] = None) -> Union[List[Dict[str,Any]],AsyncIterator[Dict[str,Any]]]:
+        """Get visits updated after start_millis and before end_millis, see InvolvesAPIClient.get_updated_visits."""
+
+        request_url = f'{self.base_url}/v1/{self.environment}/visit/sync/timestamp/'
+        return await self._paginated_request_with_timestamp(
+                url = request_url,
+                start_millis = start_millis,
+                end_millis = end_millis,
+                page_func = page_func,
+                stream = stream,
+                checkpoint = checkpoint,
+                shards = self.timestamp_shards
+            )
+
+    async def get_updated_points_of_sale(self, start_millis : Optional[int] = None, end_millis : Optional[int] = None, stream : bool = False, checkpoint : Optional[PageCheckpoint] = None, page_func : Optional[Callable[[List[Dict[str,Any]]], List[Dict[str,Any]]]] = None) -> Union[List[Dict[str,Any]],AsyncIterator[Dict[str,Any]]]:
+        """Get points of sale updated after start_millis and before end_millis, see InvolvesAPIClient.get_updated_points_of_sale."""
+
+        request_url = f'{self.base_url}/v1/{self.environment}/pointofsale/sync/timestamp/'
+        return await self._paginated_request_with_timestamp(
+                url = request_url,
+                start_millis = start_millis,
+                end_millis = end_millis,
+                page_func = page_func,
+                stream = stream,
+                checkpoint = checkpoint
+            )
+
+    async def get_updated_employees(self, millis : Optional[int] = None, stream : bool = False, checkpoint : Optional[PageCheckpoint] = None, page_func : Optional[Callable[[List[Dict[str,Any]]], List[Dict[str,Any]]]] = None) -> Union[List[Dict[str,Any]],AsyncIterator[Dict[str,Any]]]:
+        """Get employees updated after millis, see InvolvesAPIClient.get_updated_employees."""
+
+        request_url = f'{self.base_url}/v1/{self.environment}/employeeenvironment/'
+        params = {'updatedAtMillis' : millis} if millis else None
+
+        return await self._paginated_request_with_page(
+                url = request_url,
+                params = params,
+                page_func = page_func,
+                stream = stream,
+                checkpoint = checkpoint
+            )
+
+    async def get_updated_products(self, start_millis : Optional[int] = None, end_millis : Optional[int] = None, stream : bool = False, checkpoint : Optional[PageCheckpoint] = None, page_func : Optional[Callable[[List[Dict[str,Any]]], List[Dict[str,Any]]]] = None) -> Union[List[Dict[str,Any]],AsyncIterator[Dict[str,Any]]]:
+        """Get products updated after start_millis and before end_millis, see InvolvesAPIClient.get_updated_products."""
+
+        request_url = f'{self.base_url}/v1/{self.environment}/sku/sync/timestamp/'
+        return await self._paginated_request_with_timestamp(
+                url = request_url,
+                start_millis = start_millis,
+                end_millis = end_millis,
+                page_func = page_func,
+                stream = stream,
+                checkpoint = checkpoint,
+                shards = self.timestamp_shards
+            )
+
+    async def get_updated_forms(self, millis : Optional[int] = None, stream : bool = False, checkpoint : Optional[PageCheckpoint] = None, page_func : Optional[Callable[[List[Dict[str,Any]]], List[Dict[str,Any]]]] = None) -> Union[List[Dict[str,Any]],AsyncIterator[Dict[str,Any]]]:
+        """Get forms updated after millis, see InvolvesAPIClient.get_updated_forms."""
+
+        request_url = f'{self.base_url}/v1/{self.environment}/form/sync/timestamp/'
+        return await self._paginated_request_with_timestamp(
+                url = request_url,
+                start_millis = millis,
+                page_func = page_func,
+                stream = stream,
+                checkpoint = checkpoint
+            )
+
+    async def get_updated_form_fields(self, millis : Optional[int] = None, stream : bool = False, checkpoint : Optional[PageCheckpoint] = None, page_func : Optional[Callable[[List[Dict[str,Any]]], List[Dict[str,Any]]]] = None) -> Union[List[Dict[str,Any]],AsyncIterator[Dict[str,Any]]]:
+        """Get form fields updated after millis, see InvolvesAPIClient.get_updated_form_fields."""
+
+        request_url = f'{self.base_url}/v1/{self.environment}/form/sync/timestamp/'
+        return await self._paginated_request_with_timestamp(
+                url = request_url,
+                start_millis = millis,
+                page_func = page_func,
+                stream = stream,
+                checkpoint = checkpoint
+            )
+
+    async def get_updated_forms_with_fields(self, millis : Optional[int] = None, stream : bool = False, checkpoint : Optional[PageCheckpoint] = None, page_funcs : Optional[Dict[str, Callable[[List[Dict[str,Any]]], List[Dict[str,Any]]]]] = None) -> Union[List[Tuple[str,Dict[str,Any]]],AsyncIterator[Tuple[str,Dict[str,Any]]]]:
+        """Get forms and their fields updated after millis with a single pass, see InvolvesAPIClient.get_updated_forms_with_fields."""
+
+        request_url = f'{self.base_url}/v1/{self.environment}/form/sync/timestamp/'
+        return await self._paginated_request_with_timestamp(
+                url = request_url,
+                start_millis = millis,
+                page_func = mappers.fan_out(page_funcs or {'form' : list}),
+                stream = stream,
+                checkpoint = checkpoint
+            )
+
+    async def get_updated_form_responses(self, start_millis : Optional[int] = None, end_millis : Optional[int] = None, stream : bool = False, checkpoint : Optional[PageCheckpoint] = None, page_func : Optional[Callable[[List[Dict[str,Any]]], List[Dict[str,Any]]]] = None, form_id : Optional[int] = None) -> Union[List[Dict[str,Any]],AsyncIterator[Dict[str,Any]]]:
+        """Get form responses updated after start_millis and before end_millis, of a single form when form_id is given, see InvolvesAPIClient.get_updated_form_responses."""
+
+        request_url = f'{self.base_url}/v1/{self.environment}/survey/sync/timestamp/'
+        return await self._paginated_request_with_timestamp(
+                url = request_url,
+                params = {'formId' : form_id} if form_id is not None else None,
+                start_millis = start_millis,
+                end_millis = end_millis,
+                page_func = page_func,
+                stream = stream,
+                checkpoint = checkpoint,
+                shards = self.timestamp_shards
+            )
+
+    async def get_employee_absences(self, millis : Optional[int] = None, start_date : Optional[str] = None, stream : bool = False, checkpoint : Optional[PageCheckpoint] = None, page_func : Optional[Callable[[List[Dict[str,Any]]], List[Dict[str,Any]]]] = None) -> Union[List[Dict[str,Any]],AsyncIterator[Dict[str,Any]]]:
+        """Get employee absences updated after millis and valid from start_date, see InvolvesAPIClient.get_employee_absences."""
+
+        request_url = f'{self.base_url}/v1/{self.environment}/employeeabsence/'
+        params = {}
+        if millis:
+            params['updatedAtMillis'] = millis
+        if start_date:
+            params['startDate'] = start_date
+
+        return await self._paginated_request_with_page(
+                url = request_url,
+                params = params or None,
+                page_func = page_func,
+                stream = stream,
+                checkpoint = checkpoint
+            )
+
+    async def get_all_regions(self) -> List[Dict[str,Any]]:
+        """Get a list of all regions defined on the specific environment."""
+
+        request_url = f'{self.base_url}/v3/environments/{self.environment}/regionals/'
+        return await self._paginated_request_with_page(
+                url = request_url,
+                page_func = mappers.map_regions
+            )
+
+    async def get_all_macroregions(self) -> List[Dict[str,Any]]:
+        """Get a list of all macroregions defined on the specific environment."""
+
+        request_url = f'{self.base_url}/v1/{self.environment}/macroregion/find'
+        return await self._paginated_request_with_page(
+                url = request_url
+            )
+
+
+
+class SyncInvolvesAPIClient:
+    """
+    Blocking wrapper of AsyncInvolvesAPIClient with the same interface as InvolvesAPIClient.
+
+    The async client runs on an event loop owned by a background thread, so the calls of every thread (e.g. concurrent
+    prefect tasks) are multiplexed over the same connection pool. Streams are moved between threads in batches of
+    stream_batch_size records. The clients returned by for_environment share the event loop and the connection pool of
+    the client they come from, which has to be closed after them.
+    """
+
+    def __init__(self, environment, domain, username, password, stream_batch_size : int = 500, parent : Optional['SyncInvolvesAPIClient'] = None, **kwargs):
+
+        self.stream_batch_size = stream_batch_size
+        self._owns_loop = parent is None
+
+        if parent is None:
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._loop.run_forever, name='involves-async-client', daemon=True)
+            self._thread.start()
+            self._client = self._run(self._create_client(environment, domain, username, password, **kwargs))
+        else:
+            self._loop = parent._loop
+            self._thread = parent._thread
+            self._client = self._run(self._create_client(environment, domain, username, password, http_client=parent._client.client, **kwargs))
+
+    def __getattr__(self, name : str) -> Any:
+        """Exposes the attributes of the async client, the get_* methods are wrapped to block until their result is ready."""
+
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        attribute = getattr(self._client, name)
+
+        if not name.startswith('get_') or not callable(attribute):
+            return attribute
+
+        def call(*args, stream : bool = False, **kwargs) -> Union[List[Dict[str,Any]],Iterator[Dict[str,Any]]]:
+            if stream:
+                return self._iterate(self._run(attribute(*args, stream=True, **kwargs)))
+            return self._run(attribute(*args, **kwargs))
+
+        return call
+
+    def __enter__(self) -> 'SyncInvolvesAPIClient':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def for_environment(self, environment, domain, username, password, **kwargs) -> 'SyncInvolvesAPIClient':
+        """Returns a client of another Involves environment or account running on the event loop and connection pool of this client, kwargs are passed to AsyncInvolvesAPIClient."""
+
+        return SyncInvolvesAPIClient(environment, domain, username, password, stream_batch_size=self.stream_batch_size, parent=self, **kwargs)
+
+    def close(self) -> None:
+        """Closes the async client and stops the event loop thread, a client sharing the loop of another one leaves both open."""
+
+        self._run(self._client.aclose())
+        if not self._owns_loop:
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    @staticmethod
+    async def _create_client(*args, **kwargs) -> AsyncInvolvesAPIClient:
+        return AsyncInvolvesAPIClient(*args, **kwargs)
+
+    def _run(self, coroutine : Awaitable[T]) -> T:
+        return asyncio.run_coroutine_threadsafe(self._run_in_context(coroutine, contextvars.copy_context()), self._loop).result()
+
+    @staticmethod
+    async def _run_in_context(coroutine : Awaitable[T], context : contextvars.Context) -> T:
+        """Runs the coroutine with the context variables of the calling thread (e.g. the sync metrics of its table), the task gets its own copy of them."""
+
+        for var, value in context.items():
+            var.set(value)
+        return await coroutine
+
+    def _iterate(self, records : AsyncIterator[T]) -> Iterator[T]:
+        try:
+            while True:
+                batch = self._run(self._next_batch(records, self.stream_batch_size))
+                if not batch:
+                    return
+                yield from batch
+        finally:
+            self._run(records.aclose())
+
+    @staticmethod
+    async def _next_batch(records : AsyncIterator[T], size : int) -> List[T]:
+        batch = []
+        try:
+            while len(batch) < size:
+                batch.append(await records.__anext__())
+        except StopAsyncIteration:
+            pass
+        return batch
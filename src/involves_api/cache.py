@@ -0,0 +1,135 @@
+"""On-disk cache of decoded API responses, keyed by URL and query parameters."""
+
+from pathlib import Path
+from urllib.parse import urlencode
+from typing import Optional, Dict, Any
+import gzip
+import hashlib
+import orjson
+import os
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+CACHE_MODES = ('off', 'readwrite', 'record', 'replay')
+
+
+class ResponseCacheMiss(Exception):
+    """Raised in replay mode when a request was not recorded."""
+
+
+class ResponseCache:
+    """
+    Stores the JSON body of each GET response as a gzip file named after the sha256 of its URL and sorted parameters.
+
+    Modes:
+        off: the cache is not used.
+        readwrite: responses younger than ttl_seconds are served from disk, the rest are requested and stored.
+        record: every response is requested and stored, overwriting the previous recording.
+        replay: every response is served from disk regardless of its age, a request that was not recorded raises
+            ResponseCacheMiss so a replayed run never touches the network.
+
+    When the files exceed max_bytes the least recently written ones are deleted. Note that in readwrite mode the last
+    page of a timestamp chain is also cached, so records changed at the source within ttl_seconds are only seen once
+    the entry expires.
+    """
+
+    def __init__(self, directory : str, mode : str = 'readwrite', ttl_seconds : float = 3600, max_bytes : int = 1024**3):
+
+        if mode not in CACHE_MODES:
+            raise ValueError(f'cache mode must be one of {CACHE_MODES}, got {mode}')
+
+        self.directory = Path(directory)
+        self.mode = mode
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._size = sum(path.stat().st_size for path in self.directory.glob('*/*.json.gz'))
+
+        logger.info(f'response cache at {self.directory} in {self.mode} mode ({self._size} bytes stored).')
+
+    @staticmethod
+    def get_key(url : str, params : Optional[Dict[str,Any]] = None) -> str:
+        query = urlencode(sorted((str(k), str(v)) for k, v in (params or {}).items()))
+        return hashlib.sha256(f'{url}?{query}'.encode()).hexdigest()
+
+    def _get_path(self, key : str) -> Path:
+        return self.directory / key[:2] / f'{key}.json.gz'
+
+    def get(self, url : str, params : Optional[Dict[str,Any]] = None) -> Optional[Any]:
+        """Returns the stored response of the request, None when it has to be requested."""
+
+        if self.mode in ('off', 'record'):
+            return None
+
+        path = self._get_path(self.get_key(url, params))
+
+        try:
+            if self.mode == 'readwrite' and time.time() - path.stat().st_mtime > self.ttl_seconds:
+                raise FileNotFoundError(path)
+            with gzip.open(path, 'rb') as f:
+                data = orjson.loads(f.read())
+
+        except (FileNotFoundError, EOFError, gzip.BadGzipFile, orjson.JSONDecodeError):
+            with self._lock:
+                self.misses += 1
+            if self.mode == 'replay':
+                raise ResponseCacheMiss(f'response not recorded for GET {url} params = {params}')
+            return None
+
+        with self._lock:
+            self.hits += 1
+        logger.info(f'response served from cache : {url} params = {params}')
+
+        return data
+
+    def put(self, url : str, params : Optional[Dict[str,Any]], data : Any) -> None:
+        """Stores the response of the request, evicting the oldest entries when the cache grows over max_bytes."""
+
+        if self.mode not in ('readwrite', 'record'):
+            return
+
+        path = self._get_path(self.get_key(url, params))
+        path.parent.mkdir(exist_ok=True)
+        temp_path = path.with_name(f'{path.name}.{threading.get_ident()}.tmp')
+
+        with gzip.open(temp_path, 'wb', compresslevel=1) as f:
+            f.write(orjson.dumps(data))
+
+        previous_size = path.stat().st_size if path.exists() else 0
+        os.replace(temp_path, path)
+
+        with self._lock:
+            self._size += path.stat().st_size - previous_size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        """Deletes the oldest entries until the cache is under 90% of max_bytes, called holding the lock."""
+
+        entries = []
+        for path in self.directory.glob('*/*.json.gz'):
+            try:
+                stat = path.stat()
+                entries.append((stat.st_mtime, stat.st_size, path))
+            except FileNotFoundError:
+                continue
+
+        self._size = sum(size for _, size, _ in entries)
+
+        for _, size, path in sorted(entries):
+            if self._size <= self.max_bytes * 0.9:
+                break
+            path.unlink(missing_ok=True)
+            self._size -= size
+
+    def get_stats(self) -> Dict[str,Any]:
+        with self._lock:
+            return {'mode' : self.mode, 'hits' : self.hits, 'misses' : self.misses, 'bytes' : self._size}
@@ -0,0 +1,38 @@
+from collections import deque
+from typing import Optional, Tuple, Deque
+import threading
+
+
+class PageCheckpoint:
+    """
+    Tracks the pagination cursor of a streamed request so an interrupted extraction can be resumed.
+
+    The cursor is the timestampLastItem of the last page for /sync/timestamp/ endpoints and the number of the last page
+    for page-numbered endpoints. A paginator starts after the cursor it was given and calls page_done once the records
+    of each page were emitted. Since the records may be prefetched before being written, the consumer asks for the
+    cursor matching the number of records it has written with committed().
+    """
+
+    def __init__(self, cursor : Optional[int] = None):
+
+        self.cursor = cursor
+        self._emitted = 0
+        self._pages : Deque[Tuple[int,int]] = deque()
+        self._lock = threading.Lock()
+
+    def page_done(self, records : int, cursor : Optional[int]) -> None:
+        """Registers that a page with records emitted records ended, and that the request continues after cursor."""
+
+        with self._lock:
+            self._emitted += records
+            if cursor is not None:
+                self._pages.append((self._emitted, cursor))
+
+    def committed(self, records : int) -> Optional[int]:
+        """Returns the cursor to resume from once the first records emitted records are written, None if no page was completed."""
+
+        with self._lock:
+            while self._pages and self._pages[0][0] <= records:
+                _, self.cursor = self._pages.popleft()
+
+            return self.cursor
@@ -1,26 +1,68 @@
 import requests
 from requests.auth import HTTPBasicAuth
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import contextvars
+import itertools
+from functools import partial
+import queue
+import threading
 import time
 import logging
-from typing import Optional, List, Dict, Any, Callable, Union, TypeVar
+from . import mappers
+from .checkpoint import PageCheckpoint
+from .transport import Transport, RetryPolicy, DEFAULT_MAX_RETRIES, DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT
+from .cache import ResponseCache
+from .decoding import decode_json, ItemsDecoder, DEFAULT_CHUNK_SIZE
+from .sharding import WindowMerger, get_windows
+from utils.metrics import record_download
+from typing import Optional, List, Dict, Any, Callable, Union, TypeVar, Iterator, Iterable, Tuple
 T = TypeVar('T')
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+DEFAULT_POOL_SIZE = 10
+
 class InvolvesAPIClient(requests.Session):
     """A client for interacting with the Involves Stage API."""
 
-    def __init__(self,environment,domain,username,password):
-        """Initializes the API client with basic authentication."""
+    def __init__(self,environment,domain,username,password, max_in_flight : int = 1, timestamp_shards : int = 1, rate_limit : float = 0, max_retries : int = DEFAULT_MAX_RETRIES, cache : Optional[ResponseCache] = None, stream_items : bool = False, base_url : Optional[str] = None, pool_size : Optional[int] = None, adapter : Optional[HTTPAdapter] = None, connect_timeout : float = DEFAULT_CONNECT_TIMEOUT, read_timeout : float = DEFAULT_READ_TIMEOUT):
+        """
+        Initializes the API client with basic authentication.
+
+        Parameters:
+            max_in_flight (int): Maximum number of concurrent requests used to fetch the pages of page-numbered endpoints. 1 fetches them sequentially.
+            timestamp_shards (int): Number of time windows walked in parallel by the visit, product and form response extractions. 1 walks a single timestamp chain.
+            rate_limit (float): Maximum requests per second shared by all the threads using the client. 0 disables the limit.
+            max_retries (int): Number of times a throttled (429), failed (5xx) or disconnected GET request is retried.
+            cache (Optional[ResponseCache]): On-disk cache the responses are served from and stored to, see ResponseCache for its modes.
+            stream_items (bool): Decodes the items of the /sync/timestamp/ pages while the body is received, so they are mapped before the whole page arrived. Not used when the client has a response cache.
+            base_url (Optional[str]): Root URL of the API, defaults to the Involves Stage API of the domain. Used to point the client at another server, e.g. the benchmark stub.
+            pool_size (Optional[int]): Connections kept open per host, defaults to enough connections for max_in_flight and timestamp_shards.
+            adapter (Optional[HTTPAdapter]): Connection pool of another client to send the requests through, see for_environment. pool_size is ignored when given.
+            connect_timeout (float): Seconds to wait for a connection to the API, a request timing out is retried.
+            read_timeout (float): Seconds to wait for each read of the response, a request timing out is retried.
+        """
         super().__init__()
 
         self.environment = environment
         self.username = username
         self.password = password
         self.domain = domain
-        self.base_url = f"https://{self.domain}.involves.com/webservices/api"
+        self.base_url = base_url.rstrip('/') if base_url else f"https://{self.domain}.involves.com/webservices/api"
         self.auth = HTTPBasicAuth(self.username,self.password)
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_in_flight = max(1, max_in_flight)
+        self.timestamp_shards = max(1, timestamp_shards)
+        self.transport = Transport(rate_limit, retry_policy=RetryPolicy(max_retries=max_retries), retry_exceptions=(requests.ConnectionError, requests.Timeout))
+        self.cache = cache
+        self.stream_items = stream_items
+
+        self.adapter = adapter or HTTPAdapter(pool_maxsize=pool_size or max(DEFAULT_POOL_SIZE, self.max_in_flight, self.timestamp_shards))
+        self.mount('https://', self.adapter)
+        self.mount('http://', self.adapter)
 
         self.headers.update({
             'X-AGILE-CLIENT' : 'EXTERNAL_APP',
@@ -29,8 +71,20 @@ class InvolvesAPIClient(requests.Session):
 
         logger.info(f'initialized involves_api_client at: \n env : {self.environment}. \n domain : {self.domain}.')
 
+    def for_environment(self, environment, domain, username, password, **kwargs) -> 'InvolvesAPIClient':
+        """
+        Returns a client of another Involves environment or account that sends its requests through the connection pool of this client.
 
-    def _paginated_request_with_timestamp(self, url : str, start_millis : Optional[int] = None, end_millis : Optional[int] = None, params : Dict[str,Any] = None, fetch_func : Callable[[Dict[str,Any]], Union[T,List[T]]] = None) -> List[T]:
+        Parameters:
+            kwargs: Keyword arguments of InvolvesAPIClient for the new client, e.g. its max_in_flight or its cache.
+        Returns:
+            InvolvesAPIClient: A client sharing the HTTPAdapter of this client, each domain keeps its own pool of pool_size connections.
+        """
+
+        return InvolvesAPIClient(environment, domain, username, password, adapter=self.adapter, **kwargs)
+
+
+    def _paginated_request_with_timestamp(self, url : str, start_millis : Optional[int] = None, end_millis : Optional[int] = None, params : Dict[str,Any] = None, page_func : Optional[Callable[[List[Dict[str,Any]]], List[T]]] = None, stream : bool = False, shards : int = 1, checkpoint : Optional[PageCheckpoint] = None) -> Union[List[T],Iterator[T]]:
         """
         Get records modified or created on a specific interval in milliseconds from the provided API URL.
 
@@ -39,15 +93,49 @@ class InvolvesAPIClient(requests.Session):
             start_millis (Optional[int]): The starting timestamp in milliseconds to use as a parameter. If not provided defaults to 0.
             end_millis (Optional[int]): The ending timestamp in milliseconds to use as a parameter. If not provided the method returns all records modified after start_millis.
             params (Dict[str, Any], optional): Additional parameters to include in the request.
-            fetch_func (Callable[[Dict[str, Any]], Union[T, List[T]]], optional): A function to transform each dict from the API response data into the desired format.
+            page_func (Callable[[List[Dict[str, Any]]], List[T]], optional): A function to transform the items of each page of the API response data into the desired format. If not provided the items are returned as they are.
+            stream (bool): If True returns a generator that yields records page by page instead of collecting them into a list.
+            shards (int): Number of time windows walked in parallel. Only used when start_millis is provided, otherwise the request is sequential.
+            checkpoint (Optional[PageCheckpoint]): Tracks the timestampLastItem of the emitted pages. A sequential request resumes after its cursor when it is set, sharded requests ignore it.
 
         Returns:
-            List[T]: A list of records created or modified after start_millis and before end_millis.
+            Union[List[T], Iterator[T]]: The records created or modified after start_millis and before end_millis.
+        """
+        if shards > 1 and start_millis and not (checkpoint and checkpoint.cursor):
+            records = self._iter_sharded_request_with_timestamp(url, start_millis, end_millis, params, page_func, shards)
+        else:
+            records = self._iter_request_with_timestamp(url, start_millis, end_millis, params, page_func, checkpoint)
+
+        return records if stream else list(records)
+
+    def _iter_request_with_timestamp(self, url : str, start_millis : Optional[int] = None, end_millis : Optional[int] = None, params : Dict[str,Any] = None, page_func : Optional[Callable[[List[Dict[str,Any]]], List[T]]] = None, checkpoint : Optional[PageCheckpoint] = None) -> Iterator[T]:
+        """Generator version of _paginated_request_with_timestamp, only one page of records is held in memory at a time."""
+
+        if not page_func:
+            page_func = list
+
+        if checkpoint and checkpoint.cursor:
+            logger.info(f'resuming timestamp chain from checkpoint : {checkpoint.cursor}')
+            start_millis = checkpoint.cursor
+
+        total_records = 0
+
+        for items, next_millis in self._iter_timestamp_pages(url, start_millis, end_millis, params):
+            rows = page_func(items)
+            yield from rows
+
+            total_records += len(rows)
+            if checkpoint:
+                checkpoint.page_done(len(rows), next_millis)
+
+        logger.info(f'paginated request finished with a total of {total_records} items.')
+
+    def _iter_timestamp_pages(self, url : str, start_millis : Optional[int] = None, end_millis : Optional[int] = None, params : Dict[str,Any] = None) -> Iterator[Tuple[List[Dict[str,Any]],Optional[int]]]:
         """
-        records = []
+        Walks the timestampLastItem chain of a /sync/timestamp/ endpoint yielding the raw items of each page with the timestampLastItem that follows it.
 
-        if not fetch_func:
-            fetch_func = lambda x : x
+        With stream_items a page is yielded in several batches, every batch but the last one with a None timestamp.
+        """
 
         default_params = {
             'size' : 100
@@ -61,110 +149,268 @@ class InvolvesAPIClient(requests.Session):
         while True:
 
             request_url = f'{url}{millis if millis else 0}'
-            response = super().request(method='GET',url=request_url,headers=self.headers,auth=self.auth, params=default_params)
-            logger.info(f'GET request at URL : \n {request_url}. \n status_code = {response.status_code}')
+            page_items = 0
 
-            response.raise_for_status()
+            for items, response_data in self._iter_page_items(request_url, default_params):
+                page_items += len(items)
 
-            response_data : Dict = response.json()
-            
-            items = response_data.get('items')
-            millis = response_data.get('timestampLastItem')
-            logger.info(f'timestamp of next request : {millis}')
+                if response_data is None:
+                    # a batch decoded while the page is still being received, the cursor comes with the end of the page
+                    yield items, None
+                    continue
 
-            if items:
-                logger.info(f'request response includes {len(items)} items.')
-                for item in items:
-                    row = fetch_func(item)
+                millis = response_data.get('timestampLastItem')
+                logger.info(f'timestamp of next request : {millis}')
 
-                    if isinstance(row,list):
-                        records.extend(row)
-                    else:
-                        records.append(row)
+                if page_items:
+                    logger.info(f'request response includes {page_items} items.')
+                    yield items, millis
 
             if not millis or (end_millis is not None and millis >= end_millis):
-                logger.info(f'timestampLastItem not found in response or end millis reached, paginated request finished with a total of {len(records)} items.')
+                logger.info('timestampLastItem not found in response or end millis reached, timestamp chain finished.')
                 break
 
-        return records
+    def _iter_page_items(self, url : str, params : Optional[Dict[str,Any]] = None) -> Iterator[Tuple[List[Dict[str,Any]],Optional[Dict[str,Any]]]]:
+        """
+        Requests a page yielding (items, None) for each batch of items decoded while the body is received, and finally the last items with the rest of the response.
+
+        Without stream_items, or when the client has a response cache, the page is decoded at once and yielded as a single
+        final batch.
+        """
+
+        if not self.stream_items or self.cache:
+            response_data = self._get_json(url, params)
+            yield response_data.get('items') or [], response_data
+            return
+
+        response = self.transport.send(partial(self._send_streamed_request, url, params))
+        logger.info(f'GET request at URL : \n {url}. \n params = {params} \n status_code = {response.status_code}')
+
+        with response:
+            response.raise_for_status()
+
+            decoder = ItemsDecoder()
+            for chunk in response.iter_content(DEFAULT_CHUNK_SIZE):
+                record_download(len(chunk))
+                items = decoder.feed(chunk)
+                if items:
+                    yield items, None
+
+        items, response_data = decoder.close()
+        yield items, response_data
+
+    def _send_streamed_request(self, url : str, params : Optional[Dict[str,Any]] = None) -> requests.Response:
+        """Sends a GET request without reading its body, the connection of a response that will be retried is released right away."""
+
+        response = super().request(method='GET',url=url,headers=self.headers,auth=self.auth, params=params, timeout=self.timeout, stream=True)
+        if response.status_code in self.transport.retry_policy.retry_status_codes:
+            response.close()
+
+        return response
+
+    def _iter_sharded_request_with_timestamp(self, url : str, start_millis : int, end_millis : Optional[int] = None, params : Dict[str,Any] = None, page_func : Optional[Callable[[List[Dict[str,Any]]], List[T]]] = None, shards : int = 2, timestamp_key : str = 'updatedAtMillis') -> Iterator[T]:
+        """
+        Splits (start_millis, end_millis] into shards time windows and walks the timestamp chain of each window on its own thread.
+
+        Each chain stops once timestampLastItem reaches the end of its window and items past the window end are dropped
+        since they belong to the next window. A record updated during the extraction can show up in two windows, both
+        versions are yielded unless the newer one came first (see WindowMerger). When end_millis is not provided the last
+        window is left open like the sequential request. Records are yielded as pages arrive, without ordering between windows.
+        """
+
+        if not page_func:
+            page_func = list
+
+        upper_bound = end_millis if end_millis is not None else round(time.time()*1000)
+        if upper_bound <= start_millis:
+            yield from self._iter_request_with_timestamp(url, start_millis, end_millis, params, page_func)
+            return
+
+        windows = get_windows(start_millis, upper_bound, end_millis, shards)
+        logger.info(f'walking {len(windows)} timestamp windows in parallel from {start_millis} to {end_millis or "now"}.')
+
+        pages = queue.Queue(maxsize=2*len(windows))
+        stop = threading.Event()
+        finished = object()
+
+        def put(page : Any) -> bool:
+            while not stop.is_set():
+                try:
+                    pages.put(page, timeout=1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def walk_window(window : int, low : int, high : Optional[int]) -> None:
+            try:
+                for items, _ in self._iter_timestamp_pages(url, low, high, params):
+                    window_items = [
+                        item for item in items
+                        if item.get(timestamp_key) is None or (item[timestamp_key] > low and (high is None or item[timestamp_key] <= high))
+                        ]
+                    if not put((window, window_items)):
+                        return
+                put((window, finished))
+            except Exception as e:
+                put((window, e))
+
+        total_records = 0
+        merger = WindowMerger(len(windows), timestamp_key)
+
+        with ThreadPoolExecutor(max_workers=len(windows), thread_name_prefix='involves-shard') as executor:
+            for window, (low, high) in enumerate(windows):
+                executor.submit(contextvars.copy_context().run, walk_window, window, low, high)
+
+            try:
+                while merger.pending:
+                    window, page = pages.get()
+
+                    if page is finished:
+                        merger.finish(window)
+                        continue
+
+                    if isinstance(page, Exception):
+                        raise page
+
+                    rows = page_func(merger.merge(window, page))
+                    total_records += len(rows)
+                    yield from rows
+            finally:
+                stop.set()
+
+        logger.info(f'sharded request finished with a total of {total_records} items.')
     
-    def _paginated_request_with_page(self, url : str, params : Dict[str,Any] = None, fetch_func : Callable[[Dict[str,Any]], Union[T,List[T]]] = None) -> List[T]:
+    def _paginated_request_with_page(self, url : str, params : Dict[str,Any] = None, page_func : Optional[Callable[[List[Dict[str,Any]]], List[T]]] = None, stream : bool = False, checkpoint : Optional[PageCheckpoint] = None) -> Union[List[T],Iterator[T]]:
         """
         Get records from the provided API URL with pagination.
 
         Parameters:
             url (str): The base URL for the API endpoint.
             params (Dict[str, Any], optional): Additional parameters to include in the request.
-            fetch_func (Callable[[Dict[str, Any]], Union[T, List[T]]], optional): A function to transform each dict from the API response data into the desired format.
+            page_func (Callable[[List[Dict[str, Any]]], List[T]], optional): A function to transform the items of each page of the API response data into the desired format. If not provided the items are returned as they are.
+            stream (bool): If True returns a generator that yields records page by page instead of collecting them into a list.
+            checkpoint (Optional[PageCheckpoint]): Tracks the number of the emitted pages. When its cursor is set the request resumes on the following page.
 
         Returns:
-            List[T]: A list of records obtained from the URL.
+            Union[List[T], Iterator[T]]: The records obtained from the URL.
         """
+        records = self._iter_request_with_page(url, params, page_func, checkpoint)
 
-        records = []
-        page = 1
-        if not fetch_func:
-            fetch_func = lambda x : x
+        return records if stream else list(records)
+
+    def _iter_request_with_page(self, url : str, params : Dict[str,Any] = None, page_func : Optional[Callable[[List[Dict[str,Any]]], List[T]]] = None, checkpoint : Optional[PageCheckpoint] = None) -> Iterator[T]:
+        """
+        Generator version of _paginated_request_with_page, only one page of records is held in memory at a time.
+
+        The first page is always requested alone to learn totalPages. When the client was created with max_in_flight > 1
+        the remaining pages are fetched concurrently by a thread pool, with at most max_in_flight requests running and
+        the pages yielded in page order. With a checkpoint the request starts on the page that follows its cursor.
+        """
+
+        total_records = 0
+        if not page_func:
+            page_func = list
+
+        first_page = checkpoint.cursor + 1 if checkpoint and checkpoint.cursor else 1
+        if first_page > 1:
+            logger.info(f'resuming paginated request from checkpoint at page : {first_page}')
         
         default_params = {
             'size' : 200,
-            'page' : page
+            'page' : first_page
         }
 
         if params:
             default_params.update(params)
 
-        while True:         
+        response_data = self._get_json(url, default_params)
+        total_pages = response_data.get('totalPages') if isinstance(response_data,dict) else 1
+        pages = iter([response_data])
 
-            response = super().request(method='GET',url=url,headers=self.headers,auth=self.auth, params=default_params)
-            logger.info(f'GET request at URL : \n {url}. \n status_code = {response.status_code}')
+        if total_pages and total_pages > first_page:
+            remaining_pages = range(first_page + 1, total_pages + 1)
+            if self.max_in_flight > 1:
+                logger.info(f'fetching pages {first_page + 1}..{total_pages} with up to {self.max_in_flight} concurrent requests.')
+                pages = itertools.chain(pages, self._fetch_pages_concurrently(url, default_params, remaining_pages))
+            else:
+                pages = itertools.chain(pages, (self._get_json(url, {**default_params, 'page' : page}) for page in remaining_pages))
 
-            response.raise_for_status()
+        for page, response_data in enumerate(pages, start=first_page):
 
-            response_data : Dict = response.json()
+            items = response_data.get('items') if 'items' in response_data else response_data
 
-            if 'items' in response_data:
+            logger.info(f'request response includes {len(items)} items.')
 
-                items = response_data.get('items')
+            rows = page_func(items) if items else []
+            yield from rows
 
-            else:
+            total_records += len(rows)
+            if checkpoint:
+                checkpoint.page_done(len(rows), page)
 
-                items = response_data
+            logger.info(f'page progress : {page}/{total_pages}')
 
-            logger.info(f'request response includes {len(items)} items.')
+        logger.info(f'Paginated request finished with a total of {total_records} items.')
 
+    def _fetch_pages_concurrently(self, url : str, params : Dict[str,Any], pages : Iterable[int]) -> Iterator[Any]:
+        """Fetches the given pages on a thread pool keeping at most max_in_flight requests running, yields the decoded responses in page order."""
 
-            if items:
-                for item in items:
-                    row = fetch_func(item)
+        pages = iter(pages)
+        in_flight = deque()
 
-                    if isinstance(row,list):
-                        records.extend(row)
-                    else:
-                        records.append(row)
+        with ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix='involves-page') as executor:
+            try:
+                for page in itertools.islice(pages, self.max_in_flight):
+                    in_flight.append(executor.submit(contextvars.copy_context().run, self._get_json, url, {**params, 'page' : page}))
 
-            
-            total_pages = response_data.get('totalPages') if isinstance(response_data,dict) else 1
-            logger.info(f'page progress : {page}/{total_pages}')
-                
+                while in_flight:
+                    response_data = in_flight.popleft().result()
+                    next_page = next(pages, None)
+                    if next_page is not None:
+                        in_flight.append(executor.submit(contextvars.copy_context().run, self._get_json, url, {**params, 'page' : next_page}))
+                    yield response_data
 
-            if page >= total_pages or total_pages is None:
-                logger.info(f'Paginated request finished with a total of {len(records)} items.')
-                break
+            finally:
+                for future in in_flight:
+                    future.cancel()
+
+    def _get_json(self, url : str, params : Optional[Dict[str,Any]] = None) -> Any:
+        """
+        Sends an authenticated GET request through the transport and returns the decoded JSON body, raising for HTTP error status codes once the retries run out.
+
+        When the client has a response cache the body is served from it if possible and stored on it otherwise.
+        """
+
+        if self.cache:
+            data = self.cache.get(url, params)
+            if data is not None:
+                return data
+
+        response = self.transport.send(partial(super().request, method='GET',url=url,headers=self.headers,auth=self.auth, params=params, timeout=self.timeout))
+        logger.info(f'GET request at URL : \n {url}. \n params = {params} \n status_code = {response.status_code}')
+
+        response.raise_for_status()
 
-            page +=1  
-            default_params.update({'page':page}) 
+        record_download(len(response.content))
+        data = decode_json(response.content)
 
-        return records
+        if self.cache:
+            self.cache.put(url, params, data)
 
+        return data
 
-    def get_updated_visits(self, start_millis : Optional[int] = None, end_millis : Optional[int] = None ) -> List[Dict[str,Any]]:
+
+    def get_updated_visits(self, start_millis : Optional[int] = None, end_millis : Optional[int] = None, stream : bool = False, checkpoint : Optional[PageCheckpoint] = None, page_func : Optional[Callable[[List[Dict[str,Any]]], List[Dict[str,Any]]]] = None) -> Union[List[Dict[str,Any]],Iterator[Dict[str,Any]]]:
         """
         Get visits updated after start_millis and before end_millis 
 
         Parameters:
             start_millis (Optional[int]): The starting timestamp in milliseconds to use as a parameter. If not provided returns all records.
             end_millis (Optional[int]): The ending timestamp in milliseconds to use as a parameter. If not provided the method returns all records modified after start_millis.
+            stream (bool): If True returns a generator that yields the records instead of a list.
+            checkpoint (Optional[PageCheckpoint]): Pagination checkpoint the request resumes from and advances.
+            page_func (Optional[Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]]): Maps the items of each page into rows, e.g. the compiled mapper of the model. If not provided returns the raw items.
 
         Returns:
             List[T]: A list of dictionaries representing visits.
@@ -173,72 +419,48 @@ class InvolvesAPIClient(requests.Session):
         request_url = f'{self.base_url}/v1/{self.environment}/visit/sync/timestamp/'
         return self._paginated_request_with_timestamp(
                 url=request_url,
+                stream = stream,
+                checkpoint = checkpoint,
+                shards = self.timestamp_shards,
                 start_millis = start_millis,
                 end_millis = end_millis,             
-                fetch_func= lambda x : {
-                        'id' : x.get('id'),
-                        'employee_id' : x.get('employee',{}).get('id') if isinstance(x.get('employee',{}),dict) else None,
-                        'point_of_sale_id' : x.get('pointOfSale',{}).get('id') if isinstance(x.get('pointOfSale',{}),dict) else None,
-                        'visit_date' : x.get('visitDate'),
-                        'visit_type' : x.get('type'),
-                        'visit_status' : x.get('status'),
-                        'manual_entry_date' : x.get('entryDateManualCheckin'),
-                        'manual_exit_date' :  x.get('exitDateManualCheckin'),
-                        'gps_entry_date' : x.get('entryDateGPSCheckin'),
-                        'gps_exit_date' : x.get('exitDateGPSCheckin'),
-                        'visit_duration_manual' : x.get('visitDurationCheckinManual'),
-                        'visit_duration_gps' : x.get('visitDurationCheckinGPS'),
-                        'updated_at_millis' : x.get('updatedAtMillis'),
-                        'is_deleted' : x.get('deleted')  
-            }
+                page_func = page_func
             )
     
-    def get_updated_points_of_sale(self, start_millis : Optional[int] = None, end_millis : Optional[int] = None) -> List[Dict[str,Any]]:
+    def get_updated_points_of_sale(self, start_millis : Optional[int] = None, end_millis : Optional[int] = None, stream : bool = False, checkpoint : Optional[PageCheckpoint] = None, page_func : Optional[Callable[[List[Dict[str,Any]]], List[Dict[str,Any]]]] = None) -> Union[List[Dict[str,Any]],Iterator[Dict[str,Any]]]:
         """
         Get points of sale updated after start_millis and before end_millis 
 
         Parameters:
             start_millis (Optional[int]): The starting timestamp in milliseconds to use as a parameter. If not provided returns all records.
             end_millis (Optional[int]): The ending timestamp in milliseconds to use as a parameter. If not provided the method returns all records modified after start_millis.
+            stream (bool): If True returns a generator that yields the records instead of a list.
+            checkpoint (Optional[PageCheckpoint]): Pagination checkpoint the request resumes from and advances.
+            page_func (Optional[Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]]): Maps the items of each page into rows, e.g. the compiled mapper of the model. If not provided returns the raw items.
 
         Returns:
             List[T]: A list of dictionaries representing points of sale.
         """
         request_url = f'{self.base_url}/v1/{self.environment}/pointofsale/sync/timestamp/'
-        update_timestamp = round(time.time()*1000)
         return self._paginated_request_with_timestamp(
                 url=request_url,
+                stream = stream,
+                checkpoint = checkpoint,
                 start_millis = start_millis,
                 end_millis = end_millis,
-                fetch_func = lambda x :  {
-
-                        'id' : x.get('id'),
-                        'point_of_sale_base_id' : x.get('pointOfSaleBaseId'),
-                        'point_of_sale_name' : x.get('name'),
-                        'chain' : x.get('chain',{}).get('name') if isinstance(x.get('chain',{}),dict) else None,
-                        'chain_group' : x.get('chain',{}).get('chainGroup',{}).get('name') if isinstance(x.get('chain',{}),dict) else None,
-                        'channel' : x.get('pointOfSaleChannel',{}).get('name') if isinstance(x.get('pointOfSaleChannel',{}),dict) else None,
-                        'point_of_sale_code' : x.get('code'),
-                        'point_of_sale_region' : x.get('region',{}).get('name') if isinstance(x.get('region',{}),dict) else None,
-                        'macro_region' : x.get('region',{}).get('macroRegion',{}).get('name') if isinstance(x.get('region',{}),dict) else None,
-                        'point_of_sale_type' : x.get('pointOfSaleType',{}).get('name') if isinstance(x.get('pointOfSaleType',{}),dict) else None, 
-                        'point_of_sale_profile' : x.get('pointOfSaleProfile',{}).get('name') if isinstance(x.get('pointOfSaleProfile'),dict) else None,
-                        'latitude' : x.get('address',{}).get('latitude') if isinstance(x.get('address',{}),dict) else None,
-                        'longitude' : x.get('address',{}).get('longitude') if isinstance(x.get('address',{}),dict) else None,
-                        'zip_code' : x.get('address',{}).get('zipCode') if isinstance(x.get('address',{}),dict) else None,
-                        'is_enabled' : x.get('enabled'),
-                        'is_deleted' : x.get('deleted'),
-                        'updated_at_millis' : update_timestamp
-                    }
+                page_func = page_func
                     )
 
     
-    def get_updated_employees(self,millis : Optional[int] = None) ->List[Dict[str,Any]]:
+    def get_updated_employees(self,millis : Optional[int] = None, stream : bool = False, checkpoint : Optional[PageCheckpoint] = None, page_func : Optional[Callable[[List[Dict[str,Any]]], List[Dict[str,Any]]]] = None) -> Union[List[Dict[str,Any]],Iterator[Dict[str,Any]]]:
         """
         Get employees updated after millis.
 
         Parameters:
             millis (Optional[int]): The starting timestamp in milliseconds to use as a parameter. If not provided returns all records.
+            stream (bool): If True returns a generator that yields the records instead of a list.
+            checkpoint (Optional[PageCheckpoint]): Pagination checkpoint the request resumes from and advances.
+            page_func (Optional[Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]]): Maps the items of each page into rows, e.g. the compiled mapper of the model. If not provided returns the raw items.
 
         Returns:
             List[T]: A list of dictionaries representing employees.
@@ -248,27 +470,22 @@ class InvolvesAPIClient(requests.Session):
 
         return self._paginated_request_with_page(
                 url=request_url,
+                stream = stream,
+                checkpoint = checkpoint,
                 params = params,
-                fetch_func = lambda x : {
-
-                        'id' : x.get('id'),
-                        'employee_name' : x.get('name'),
-                        'employee_code' : x.get('nationalIdCard2'),
-                        'is_field_team' : x.get('fieldTeam'),
-                        'user_group' : x.get('userGroup',{}).get('name') if isinstance(x.get('userGroup',{}),dict) else None,
-                        'leader_name' : x.get('employeeEnvironmentLeader',{}).get('name') if isinstance(x.get('employeeEnvironmentLeader',{}),dict) else None,
-                        'is_enabled' : x.get('enabled'),
-                        'updated_at_millis' : x.get('userUpdatedAtMillis')
-                        }
+                page_func = page_func
                     )
 
-    def get_updated_products(self, start_millis : Optional[int] = None, end_millis : Optional[int] = None) -> List[Dict[str,Any]]:
+    def get_updated_products(self, start_millis : Optional[int] = None, end_millis : Optional[int] = None, stream : bool = False, checkpoint : Optional[PageCheckpoint] = None, page_func : Optional[Callable[[List[Dict[str,Any]]], List[Dict[str,Any]]]] = None) -> Union[List[Dict[str,Any]],Iterator[Dict[str,Any]]]:
         """
         Get products updated after start_millis and before end_millis 
 
         Parameters:
             start_millis (Optional[int]): The starting timestamp in milliseconds to use as a parameter. If not provided returns all records.
             end_millis (Optional[int]): The ending timestamp in milliseconds to use as a parameter. If not provided the method returns all records modified after start_millis.
+            stream (bool): If True returns a generator that yields the records instead of a list.
+            checkpoint (Optional[PageCheckpoint]): Pagination checkpoint the request resumes from and advances.
+            page_func (Optional[Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]]): Maps the items of each page into rows, e.g. the compiled mapper of the model. If not provided returns the raw items.
 
         Returns:
             List[T]: A list of dictionaries representing products.
@@ -277,27 +494,24 @@ class InvolvesAPIClient(requests.Session):
         request_url = f'{self.base_url}/v1/{self.environment}/sku/sync/timestamp/'
         return self._paginated_request_with_timestamp(
                 url=request_url,
+                stream = stream,
+                checkpoint = checkpoint,
+                shards = self.timestamp_shards,
                 start_millis = start_millis,
                 end_millis = end_millis,
-                fetch_func= lambda x : {
-
-                        'id' : x.get('id'),
-                        'product_name' : x.get('name'),
-                        'bar_code' : x.get('barCode'),
-                        'product_line' : x.get('productLine',{}).get('name') if isinstance(x.get('productLine',{}),dict) else None,
-                        'is_active' : x.get('active'),
-                        'is_deleted' : x.get('deleted'),
-                        'updated_at_millis' : x.get('updatedAtMillis')
-                    }
+                page_func = page_func
             )
 
     
-    def get_updated_forms(self, millis : Optional[int] = None)  -> Dict[str,List[Dict[str,Any]]]:
+    def get_updated_forms(self, millis : Optional[int] = None, stream : bool = False, checkpoint : Optional[PageCheckpoint] = None, page_func : Optional[Callable[[List[Dict[str,Any]]], List[Dict[str,Any]]]] = None) -> Union[List[Dict[str,Any]],Iterator[Dict[str,Any]]]:
         """
         Get forms updated after millis.
 
         Parameters:
             millis (Optional[int]): The starting timestamp in milliseconds to use as a parameter. If not provided returns all records.
+            stream (bool): If True returns a generator that yields the records instead of a list.
+            checkpoint (Optional[PageCheckpoint]): Pagination checkpoint the request resumes from and advances.
+            page_func (Optional[Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]]): Maps the items of each page into rows, e.g. the compiled mapper of the model. If not provided returns the raw items.
 
         Returns:
             List[T]: A list of dictionaries representing forms.
@@ -306,62 +520,73 @@ class InvolvesAPIClient(requests.Session):
         request_url = f'{self.base_url}/v1/{self.environment}/form/sync/timestamp/'
         return self._paginated_request_with_timestamp(
                 url=request_url,
+                stream = stream,
+                checkpoint = checkpoint,
                 start_millis=millis,
-                fetch_func= lambda x : {
-                        'id' : x.get('id'),
-                        'form_name' : x.get('name'),
-                        'is_active' : x.get('active'),
-                        'is_deleted' : x.get('deleted'),
-                        'form_purpose' : x.get('formPurpose'),
-                        'requires_check_in' : x.get('checkinRequired'),
-                        'requires_point_of_sale' : x.get('pointOfSaleRequired'),
-                        'updated_at_millis' : x.get('updatedAtMillis')
-
-                    }
+                page_func = page_func
             )
     
-    def get_updated_form_fields(self, millis: Optional[int] = None) -> List[Dict[str, Any]]:
+    def get_updated_form_fields(self, millis: Optional[int] = None, stream : bool = False, checkpoint : Optional[PageCheckpoint] = None, page_func : Optional[Callable[[List[Dict[str,Any]]], List[Dict[str,Any]]]] = None) -> Union[List[Dict[str, Any]],Iterator[Dict[str, Any]]]:
         """
         Get form fields updated after millis.
 
         Parameters:
             millis (Optional[int]): The starting timestamp in milliseconds to use as a parameter. If not provided returns all records.
+            stream (bool): If True returns a generator that yields the records instead of a list.
+            checkpoint (Optional[PageCheckpoint]): Pagination checkpoint the request resumes from and advances.
+            page_func (Optional[Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]]): Maps the items of each page into rows, e.g. the compiled mapper of the model. If not provided returns the raw items.
 
         Returns:
             List[T]: A list of dictionaries representing form fields.
         """
 
         request_url = f'{self.base_url}/v1/{self.environment}/form/sync/timestamp/'
-        def fetch_func(form_data: Dict[str, Any]) -> List[Dict[str, Any]]:
-            field_records = []
-            for field in form_data.get('formFields', []):
-                field_row = {
-                    'id': field.get('id'),
-                    'form_id': form_data.get('id'),
-                    'field_name': field.get('information', {}).get('label') if isinstance(field.get('information', {}),dict) else None,
-                    'field_description': field.get('information', {}).get('alternativeLabel') if isinstance(field.get('information', {}),dict) else None,
-                    'field_order': field.get('order'),
-                    'is_deleted': field.get('deleted'),
-                    'is_required': field.get('required'),
-                    'updated_at_millis': form_data.get('updatedAtMillis')
-                }
-                field_records.append(field_row)
-            return field_records
+        return self._paginated_request_with_timestamp(
+            url=request_url,
+            stream = stream,
+            checkpoint = checkpoint,
+            start_millis=millis,
+            page_func = page_func
+        )
     
+    def get_updated_forms_with_fields(self, millis : Optional[int] = None, stream : bool = False, checkpoint : Optional[PageCheckpoint] = None, page_funcs : Optional[Dict[str, Callable[[List[Dict[str,Any]]], List[Dict[str,Any]]]]] = None) -> Union[List[Tuple[str,Dict[str,Any]]],Iterator[Tuple[str,Dict[str,Any]]]]:
+        """
+        Get forms and their fields updated after millis with a single pass over the form endpoint.
+
+        Parameters:
+            millis (Optional[int]): The starting timestamp in milliseconds to use as a parameter. If not provided returns all records.
+            stream (bool): If True returns a generator that yields the records instead of a list.
+            checkpoint (Optional[PageCheckpoint]): Pagination checkpoint the request resumes from and advances.
+            page_funcs (Optional[Dict[str, Callable]]): Page functions of each table filled from the forms, e.g. {'form' : Form mapper, 'form_field' : FormField mapper}. If not provided returns ('form', item) pairs with the raw items.
+
+        Returns:
+            List[Tuple[str, T]]: A list of ('form', form) and ('form_field', field) pairs.
+        """
+
+        request_url = f'{self.base_url}/v1/{self.environment}/form/sync/timestamp/'
         return self._paginated_request_with_timestamp(
             url=request_url,
+            stream = stream,
+            checkpoint = checkpoint,
             start_millis=millis,
-            fetch_func=fetch_func
+            page_func = mappers.fan_out(page_funcs or {'form' : list})
         )
     
-    def get_updated_form_responses(self, start_millis: Optional[int] = None, end_millis: Optional[int] = None) -> List[Dict[str, Any]]:
+    def get_updated_form_responses(self, start_millis: Optional[int] = None, end_millis: Optional[int] = None, stream : bool = False, checkpoint : Optional[PageCheckpoint] = None, page_func : Optional[Callable[[List[Dict[str,Any]]], List[Dict[str,Any]]]] = None, form_id : Optional[int] = None) -> Union[List[Dict[str, Any]],Iterator[Dict[str, Any]]]:
         """
         Get form responses updated after start_millis and before end_millis.
 
+        With form_id the request asks for the responses of that form only, through a formId query parameter of the
+        /survey/sync/timestamp/ endpoint. The parameter is assumed to filter the chain on the server, a server that
+        ignores it returns the surveys of every form, so callers that need a single form must still filter the items.
+
         Parameters:
             start_millis (Optional[int]): The starting timestamp in milliseconds to use as a parameter. If not provided returns all records.
             end_millis (Optional[int]): The ending timestamp in milliseconds to use as a parameter. If not provided returns all records.
-
+            stream (bool): If True returns a generator that yields the records instead of a list.
+            checkpoint (Optional[PageCheckpoint]): Pagination checkpoint the request resumes from and advances.
+            page_func (Optional[Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]]): Maps the items of each page into rows, e.g. the compiled mapper of the model. If not provided returns the raw items.
+            form_id (Optional[int]): Id of the form whose responses are requested. If not provided returns the responses of every form.
 
         Returns:
             List[T]: A list of dictionaries representing form responses.
@@ -369,61 +594,45 @@ class InvolvesAPIClient(requests.Session):
 
         request_url = f'{self.base_url}/v1/{self.environment}/survey/sync/timestamp/'
         
-        def fetch_func(survey_data: Dict[str, Any]) -> List[Dict[str, Any]]:
-            response_records = []
-            for answer in survey_data.get('surveyData'):
-                row = {
-                    'id': answer.get('id'),
-                    'survey_id': survey_data.get('id'),
-                    'replied_at': survey_data.get('repliedAt'),
-                    'time_spent': survey_data.get('timeSpent'),
-                    'form_id': survey_data.get('form', {}).get('id') if isinstance(survey_data.get('form', {}),dict) else None,
-                    'form_field_id': answer.get('formField', {}).get('id') if isinstance(answer.get('formField', {}),dict) else None,
-                    'employee_id': survey_data.get('assignedTo', {}).get('id') if isinstance(survey_data.get('assignedTo', {}),dict) else None,
-                    'point_of_sale_id': survey_data.get('pointOfSale', {}).get('id') if isinstance(survey_data.get('pointOfSale', {}),dict) else None,
-                    'product_id': answer.get('sku', {}).get('id') if isinstance(answer.get('sku'),dict) else None,
-                    'response_value': answer.get('value'),
-                    'is_deleted': survey_data.get('deleted'),
-                    'updated_at_millis': survey_data.get('updatedAtMillis')
-                }
-                response_records.append(row)
-            return response_records
-
         return self._paginated_request_with_timestamp(
             url=request_url,
+            params = {'formId' : form_id} if form_id is not None else None,
+            stream = stream,
+            checkpoint = checkpoint,
+            shards = self.timestamp_shards,
             start_millis=start_millis,
             end_millis=end_millis,
-            fetch_func=fetch_func
+            page_func = page_func
         )
     
-    def get_employee_absences(self, start_date : Optional[str] = None) -> List[Dict[str,Any]]:
+    def get_employee_absences(self, millis : Optional[int] = None, start_date : Optional[str] = None, stream : bool = False, checkpoint : Optional[PageCheckpoint] = None, page_func : Optional[Callable[[List[Dict[str,Any]]], List[Dict[str,Any]]]] = None) -> Union[List[Dict[str,Any]],Iterator[Dict[str,Any]]]:
         """
-        Get employee absences valid from start_date.
+        Get employee absences updated after millis and valid from start_date.
 
         Parameters:
+            millis (Optional[int]): The starting timestamp in milliseconds to use as a parameter. If not provided returns all records.
             start_date (Optional[str]): The starting date as string in format 'YYYY-mm-dd'.
+            stream (bool): If True returns a generator that yields the records instead of a list.
+            checkpoint (Optional[PageCheckpoint]): Pagination checkpoint the request resumes from and advances.
+            page_func (Optional[Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]]): Maps the items of each page into rows, e.g. the compiled mapper of the model. If not provided returns the raw items.
 
         Returns:
             List[T]: A list of dictionaries representing absences.
         """
 
         request_url = f'{self.base_url}/v1/{self.environment}/employeeabsence/'
-        update_timestamp = round(time.time()*1000)
+        params = {}
+        if millis:
+            params['updatedAtMillis'] = millis
         if start_date:
-            params = {'startDate' : start_date}
+            params['startDate'] = start_date
 
         return self._paginated_request_with_page(
                 url=request_url,
-                params = params,
-                fetch_func = lambda x : {
-                        'id' : x.get('id'),
-                        'employee_id' : x.get('employeeEnvironmentSuspended',{}).get('id') if isinstance(x.get('employeeEnvironmentSuspended',{}),dict) else None,
-                        'start_date' : x.get('absenceStartDate'),
-                        'end_date' : x.get('absenceEndDate'),
-                        'absence_reason' : x.get('reasonNote'),
-                        'absence_note' : x.get('absenceNote'),
-                        'updated_at_millis' : update_timestamp
-                        }
+                stream = stream,
+                checkpoint = checkpoint,
+                params = params or None,
+                page_func = page_func
                     )
     
     def get_all_regions(self) -> List[Dict[str,Any]]:
@@ -437,12 +646,7 @@ class InvolvesAPIClient(requests.Session):
 
         return self._paginated_request_with_page(
                 url=request_url,
-                fetch_func = lambda x : {
-
-                        'id' : x.get('id'),
-                        'regional_name' : x.get('name'),
-                        'macroregional_id' : x.get('macroregional',{}).get('id') if isinstance(x.get('macroregional'),dict) else None
-                }
+                page_func = mappers.map_regions
             )
     
 
@@ -0,0 +1,164 @@
+"""
+JSON decoding of the API responses.
+
+decode_json parses a whole body with orjson. ItemsDecoder parses the items array of a page while the body is still
+being received: the end of each item is found with a regular expression matching balanced brackets and the complete
+items are decoded with a single orjson call per chunk, so the records of a large page can be mapped and written before
+its last byte arrives and the page is never held twice in memory (raw bytes and decoded objects).
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+import re
+import orjson
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+MAX_ITEM_DEPTH = 12
+
+# a complete string, a bracket, or a lone quote when the string continues on the next chunk
+_TOKEN = re.compile(rb'"(?:[^"\\]|\\.)*"|[\[\]{}"]', re.DOTALL)
+_SEPARATOR = re.compile(rb'[\s,]*')
+
+
+def _get_item_pattern(depth : int) -> re.Pattern:
+    """
+    Returns a pattern matching a complete JSON object or array nested up to depth levels, which fails on an incomplete one.
+
+    The repetitions are written as unrolled loops, runs of plain characters separated by strings or nested values, so
+    there is a single way to match any input and an incomplete item fails in linear time without possessive
+    quantifiers (Python 3.11+).
+    """
+
+    string = rb'"[^"\\]*(?:\\.[^"\\]*)*"'
+    other = rb'[^"{}\[\]]*'
+    nested = rb'(?!)'
+    for _ in range(depth):
+        nested = rb'[\[{]' + other + rb'(?:(?:' + string + rb'|' + nested + rb')' + other + rb')*[\]}]'
+    return re.compile(nested, re.DOTALL)
+
+
+_ITEM = _get_item_pattern(MAX_ITEM_DEPTH)
+
+
+def decode_json(body : bytes) -> Any:
+    """Decodes a complete JSON body."""
+
+    return orjson.loads(body)
+
+
+class ItemsDecoder:
+    """
+    Incremental decoder of the items array of a JSON object body, e.g. {"items" : [{...}, ...], "timestampLastItem" : 1}.
+
+    feed() takes the next chunk of the body and returns the items completed so far, close() returns the remaining
+    items with the rest of the object (every key except items) once the body ended. Items that are not objects or
+    arrays, or that are nested deeper than MAX_ITEM_DEPTH, stop the incremental decoding and are decoded with the rest
+    of the body on close(), as are bodies that are not an object with an items array.
+    """
+
+    def __init__(self, key : str = 'items'):
+
+        self.key = key
+        self._key_token = orjson.dumps(key)
+        self._buffer = bytearray()
+        self._pos = 0
+        self._depth = 0
+        self._last_key : Optional[bytes] = None
+        self._head : Optional[bytes] = None
+        self._items_done = False
+
+    def feed(self, chunk : bytes) -> List[Dict[str,Any]]:
+        """Adds the next chunk of the body and returns the items completed with it."""
+
+        self._buffer += chunk
+
+        if self._items_done or (self._head is None and not self._find_items()):
+            return []
+
+        return self._take_items()
+
+    def _find_items(self) -> bool:
+        """Scans the body up to the opening bracket of the items array, the bytes before it are kept as the head of the object."""
+
+        items_start = None
+
+        for match in _TOKEN.finditer(self._buffer, self._pos):
+            token = match.group()
+
+            if token == b'"':
+                # the string continues on the next chunk, it is scanned again once complete
+                self._pos = match.start()
+                break
+
+            if token[0] == 0x22:
+                if self._depth == 1:
+                    self._last_key = token
+            elif token in (b'{', b'['):
+                if self._depth == 1 and token == b'[' and self._last_key == self._key_token:
+                    items_start = match.start()
+                    break
+                self._depth += 1
+            else:
+                self._depth -= 1
+
+            self._pos = match.end()
+
+        else:
+            self._pos = len(self._buffer)
+
+        if items_start is None:
+            return False
+
+        self._head = bytes(self._buffer[:items_start])
+        del self._buffer[:items_start + 1]
+
+        return True
+
+    def _take_items(self) -> List[Dict[str,Any]]:
+        """Decodes the complete items at the start of the buffer and drops their bytes."""
+
+        buffer = self._buffer
+        pos = 0
+        first = None
+        last = 0
+
+        while True:
+            pos = _SEPARATOR.match(buffer, pos).end()
+            if pos == len(buffer):
+                break
+
+            if buffer[pos] == 0x5d:
+                # end of the items array, the rest of the body is decoded on close
+                self._items_done = True
+                break
+
+            item = _ITEM.match(buffer, pos)
+            if item is None:
+                break
+
+            if first is None:
+                first = pos
+            pos = last = item.end()
+
+        items = orjson.loads(b'[' + buffer[first:last] + b']') if first is not None else []
+        del buffer[:pos + 1 if self._items_done else last]
+
+        return items
+
+    def close(self) -> Tuple[List[Dict[str,Any]], Dict[str,Any]]:
+        """Returns the items left and the decoded rest of the object once the whole body was fed."""
+
+        if self._head is None:
+            data = orjson.loads(bytes(self._buffer))
+            if isinstance(data, dict):
+                return data.pop(self.key, None) or [], data
+            return data if isinstance(data, list) else [], {}
+
+        if not self._items_done:
+            rest = bytes(self._buffer[_SEPARATOR.match(self._buffer).end():])
+            data = orjson.loads(self._head + b'[' + rest)
+            return data.pop(self.key, None) or [], data
+
+        envelope = orjson.loads(self._head + b'[]' + bytes(self._buffer))
+        envelope.pop(self.key, None)
+
+        return [], envelope
@@ -0,0 +1,204 @@
+"""
+Declarative mapping of API items into table rows.
+
+A mapping is a dict of column name to field spec, where the spec is a dotted source path (e.g. 'pointOfSale.id') or a
+Field carrying the path with its coercion and null rules. compile_page_mapper turns it once into a function that maps a
+whole page of items, the item access is generated as straight-line code with each nested object looked up only once,
+and the coercions run afterwards in batch, column by column over the page, converting each distinct value a single time.
+When a child list is exploded the fields of the parent item are read and coerced once per item instead of per row.
+"""
+
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Any, Callable, Dict, List, Optional, Union, Tuple
+
+PARENT_PREFIX = '^'
+
+PageMapper = Callable[[List[Dict[str,Any]]], List[Dict[str,Any]]]
+
+
+@dataclass(frozen=True)
+class Field:
+    """
+    Source of a column.
+
+    path: dotted path of the value on the item, missing or non-object steps give None. When the mapping explodes a
+        child list the path is relative to the child and a leading '^' reads it from the parent item instead.
+    coerce: name of a coercion on COERCIONS applied to the non null values.
+    empty_as_null: blank strings are stored as NULL.
+    default: value stored when the result is None.
+    """
+
+    path : str
+    coerce : Optional[str] = None
+    empty_as_null : bool = False
+    default : Any = None
+
+
+def to_date(value : Any) -> Optional[date]:
+    """Parses an ISO date, or the date of an ISO datetime, blank strings are None. Raises ValueError on any other format instead of storing NULL."""
+
+    if isinstance(value, date):
+        return value if not isinstance(value, datetime) else value.date()
+    if isinstance(value, str) and not value.strip():
+        return None
+    return date.fromisoformat(str(value)[:10])
+
+
+def to_datetime(value : Any) -> Optional[datetime]:
+    """Parses an ISO datetime as a naive datetime, blank strings are None. Raises ValueError on any other format instead of storing NULL."""
+
+    if isinstance(value, str) and not value.strip():
+        return None
+    parsed = value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+    return parsed.replace(tzinfo=None) if parsed.tzinfo else parsed
+
+
+def to_int(value : Any) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_float(value : Any) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+COERCIONS : Dict[str, Callable[[Any], Any]] = {
+    'date' : to_date,
+    'datetime' : to_datetime,
+    'int' : to_int,
+    'float' : to_float,
+    'bool' : bool,
+    'str' : str
+}
+
+
+def make_rule(coerce : Optional[Callable[[Any],Any]], empty_as_null : bool, default : Any, column : str = '') -> Callable[[Any],Any]:
+    """Returns a function applying the null rules and the coercion of a field to a value, a value the coercion rejects raises a ValueError naming column."""
+
+    def rule(value : Any) -> Any:
+        if empty_as_null and value.__class__ is str and not value.strip():
+            value = None
+        if value is not None and coerce is not None:
+            try:
+                value = coerce(value)
+            except ValueError as e:
+                raise ValueError(f'column {column} : cannot convert {value!r} with {coerce.__name__} : {e}') from e
+        return default if value is None else value
+
+    return rule
+
+
+def apply_rules(rows : List[Dict[str,Any]], rules : List[Tuple[str, Callable[[Any],Any]]]) -> None:
+    """Applies the rule of each column over a page of rows, converting each distinct value of the column once."""
+
+    for column, rule in rules:
+        try:
+            converted = {value : rule(value) for value in {row[column] for row in rows}}
+        except TypeError:
+            for row in rows:
+                row[column] = rule(row[column])
+            continue
+
+        for row in rows:
+            row[column] = converted[row[column]]
+
+
+def compile_page_mapper(fields : Dict[str, Union[str, Field]], explode : Optional[str] = None, name : str = 'mapper') -> PageMapper:
+    """
+    Compiles a mapping into a function that maps a list of API items into a list of rows.
+
+    When explode is given each item produces one row per element of its explode list, e.g. one row per answer of a
+    survey, and the fields read from the parent item are computed once per item.
+    """
+
+    specs = {column : spec if isinstance(spec, Field) else Field(spec) for column, spec in fields.items()}
+
+    for column, spec in specs.items():
+        if spec.coerce is not None and spec.coerce not in COERCIONS:
+            raise ValueError(f'unknown coercion {spec.coerce} for column {column}')
+        if spec.path.startswith(PARENT_PREFIX) and explode is None:
+            raise ValueError(f'column {column} reads the parent item but the mapping does not explode a child list')
+
+    lines = []
+    variables = {}
+
+    def get_expression(scope : str, keys : Tuple[str,...], indent : str) -> str:
+        """Returns the expression of the value at keys on scope, emitting the lookups of its parent objects once."""
+
+        parent = scope
+        for depth in range(1, len(keys)):
+            node = (scope, keys[:depth])
+            if node not in variables:
+                variables[node] = f'v{len(variables)}'
+                if depth == 1:
+                    lines.append(f'{indent}{variables[node]} = {scope}.get({keys[0]!r})')
+                else:
+                    lines.append(f'{indent}{variables[node]} = {parent}.get({keys[depth-1]!r}) if {parent}.__class__ is dict else None')
+            parent = variables[node]
+
+        if len(keys) == 1:
+            return f'{scope}.get({keys[0]!r})'
+
+        return f'{parent}.get({keys[-1]!r}) if {parent}.__class__ is dict else None'
+
+    namespace = {'apply_rules' : apply_rules}
+    rules = []
+
+    def get_rule(column : str, spec : Field) -> Optional[Callable[[Any],Any]]:
+        if spec.coerce is None and not spec.empty_as_null and spec.default is None:
+            return None
+        return make_rule(COERCIONS[spec.coerce] if spec.coerce else None, spec.empty_as_null, spec.default, column)
+
+    child_indent = ' ' * 12 if explode else ' ' * 8
+    values = {}
+
+    for column, spec in specs.items():
+        if spec.path.startswith(PARENT_PREFIX):
+            keys = tuple(spec.path[len(PARENT_PREFIX):].split('.'))
+            parent_value = f'p{len(values)}'
+            expression = get_expression("x", keys, " " * 8)
+            rule = get_rule(column, spec)
+            if rule is not None:
+                namespace[f'r{parent_value}'] = rule
+                expression = f'r{parent_value}({expression})'
+            lines.append(f'        {parent_value} = {expression}')
+            values[column] = parent_value
+
+    if explode:
+        lines.append(f'        for c in (x.get({explode!r}) or ()):')
+
+    for column, spec in specs.items():
+        if not spec.path.startswith(PARENT_PREFIX):
+            values[column] = f'({get_expression("c" if explode else "x", tuple(spec.path.split(".")), child_indent)})'
+            rule = get_rule(column, spec)
+            if rule is not None:
+                rules.append((column, rule))
+
+    row = ', '.join(f'{column!r} : {values[column]}' for column in specs)
+
+    source = '\n'.join([
+        f'def {name}(items):',
+        '    rows = []',
+        '    append = rows.append',
+        '    for x in items:',
+        *lines,
+        f'{child_indent}append({{{row}}})',
+        '    if rules:',
+        '        apply_rules(rows, rules)',
+        '    return rows'
+    ])
+
+    namespace['rules'] = rules
+
+    exec(compile(source, f'<{name}>', 'exec'), namespace)
+
+    page_mapper = namespace[name]
+    page_mapper.source = source
+
+    return page_mapper
@@ -0,0 +1,27 @@
+"""Helpers to map the items returned by the Involves Stage API, shared by the sync and async clients. The mappings of the sync tables are declared on the models, see involves_api.fields."""
+
+from typing import Dict, Any, List, Callable, Tuple, Union
+from .fields import Field, compile_page_mapper
+
+# rows of get_all_regions, which are not stored on a table model
+REGION_FIELDS : Dict[str, Union[str, Field]] = {
+    'id' : 'id',
+    'regional_name' : 'name',
+    'macroregional_id' : 'macroregional.id'
+}
+
+map_regions = compile_page_mapper(REGION_FIELDS, name='map_regions')
+
+
+def fan_out(page_funcs : Dict[str, Callable[[List[Dict[str,Any]]], List[Dict[str,Any]]]]) -> Callable[[List[Dict[str,Any]]], List[Tuple[str,Dict[str,Any]]]]:
+    """
+    Combines several page functions into one that sends each page to every function.
+
+    The rows are returned as (key, row) pairs, where key is the key of the function that produced the row, so a single
+    pass over an endpoint can fill several tables.
+    """
+
+    def page_func(items : List[Dict[str,Any]]) -> List[Tuple[str,Dict[str,Any]]]:
+        return [(key, row) for key, func in page_funcs.items() for row in func(items)]
+
+    return page_func
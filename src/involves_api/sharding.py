@@ -0,0 +1,69 @@
+"""Merging of the timestamp windows walked in parallel by the sharded extractions of the API clients."""
+
+from typing import Any, Dict, List, Optional, Set, Tuple
+import math
+
+
+def get_windows(start_millis : int, upper_bound : int, end_millis : Optional[int], shards : int) -> List[Tuple[int, Optional[int]]]:
+    """Splits (start_millis, upper_bound] into at most shards windows, the last one ends at end_millis (open when None)."""
+
+    step = max(1, math.ceil((upper_bound - start_millis) / shards))
+    bounds = list(range(start_millis, upper_bound, step)) + [upper_bound]
+    windows = [(low, high) for low, high in zip(bounds, bounds[1:])]
+    windows[-1] = (windows[-1][0], end_millis)
+
+    return windows
+
+
+class WindowMerger:
+    """
+    Merges the pages of several timestamp windows into one stream keeping the latest version of each record.
+
+    The windows do not overlap, so a record shows up in two of them only when it was updated while the extraction was
+    running. Both versions are yielded, as the sequential chain does, except when the newer one was already yielded by a
+    later window, then the older copy arriving afterwards is dropped so it cannot overwrite the newer one downstream.
+    The ids of a window are only kept while an earlier window is still being walked, the first running window never
+    stores any. Items without a timestamp pass every window filter and are yielded once per id.
+    """
+
+    def __init__(self, windows : int, timestamp_key : str = 'updatedAtMillis'):
+
+        self.timestamp_key = timestamp_key
+        self.pending : Set[int] = set(range(windows))
+        self.yielded : Dict[int, Dict[Any,int]] = {window : {} for window in range(windows)}
+        self.untimed_ids : Set[Any] = set()
+
+    def merge(self, window : int, items : List[Dict[str,Any]]) -> List[Dict[str,Any]]:
+        """Returns the items of a page of window that have to be yielded."""
+
+        later = [self.yielded[other] for other in self.yielded if other > window]
+        store = self.yielded[window] if window > min(self.pending, default=window) else None
+        kept = []
+
+        for item in items:
+            item_id = item.get('id')
+            millis = item.get(self.timestamp_key)
+
+            if item_id is not None:
+                if millis is None:
+                    if item_id in self.untimed_ids:
+                        continue
+                    self.untimed_ids.add(item_id)
+                else:
+                    if any(timestamps.get(item_id, millis - 1) >= millis for timestamps in later):
+                        continue
+                    if store is not None:
+                        store[item_id] = millis
+
+            kept.append(item)
+
+        return kept
+
+    def finish(self, window : int) -> None:
+        """Marks window as walked, dropping the ids no earlier running window can duplicate anymore."""
+
+        self.pending.discard(window)
+        first_pending = min(self.pending, default=math.inf)
+
+        for other in [other for other in self.yielded if other <= first_pending]:
+            del self.yielded[other]
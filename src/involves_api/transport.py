@@ -0,0 +1,244 @@
+"""Rate limiting, retries and request metrics shared by the sync and async clients."""
+
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Optional, Callable, Awaitable, Any, Dict, Tuple, Type
+import asyncio
+import random
+import threading
+import time
+import logging
+from utils.metrics import record_request
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+RETRY_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 60.0
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket limiting the request rate of every thread and task that shares it.
+
+    reserve() takes a token and returns how long the caller has to wait before sending, so the sync client can sleep
+    and the async client can await the delay without blocking its event loop. A rate of 0 disables the limit, pause()
+    still holds every caller, which is how a Retry-After answer throttles all the requests of the client at once.
+    """
+
+    def __init__(self, rate : float = 0, capacity : Optional[float] = None):
+
+        self.rate = rate
+        self.capacity = capacity if capacity else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Takes a token and returns the seconds to wait before using it."""
+
+        with self._lock:
+            now = time.monotonic()
+            delay = max(0.0, self._paused_until - now)
+
+            if self.rate > 0:
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                self._tokens -= 1
+                if self._tokens < 0:
+                    delay = max(delay, -self._tokens / self.rate)
+
+            return delay
+
+    def pause(self, seconds : float) -> None:
+        """Holds every request for the given seconds."""
+
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+@dataclass
+class RetryPolicy:
+    """
+    Retry rules for idempotent GET requests.
+
+    Responses with a status code on retry_status_codes and connection errors are retried up to max_retries times. The
+    wait honours the Retry-After header when the server sends it, otherwise it is a random delay between 0 and
+    backoff_base * 2**attempt seconds capped at backoff_max (exponential backoff with full jitter).
+    """
+
+    max_retries : int = DEFAULT_MAX_RETRIES
+    backoff_base : float = 0.5
+    backoff_max : float = 60.0
+    retry_status_codes : frozenset = RETRY_STATUS_CODES
+
+    def get_delay(self, attempt : int, retry_after : Optional[float] = None) -> float:
+
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+
+def parse_retry_after(value : Optional[str]) -> Optional[float]:
+    """Returns the seconds requested by a Retry-After header, given either as seconds or as an HTTP date."""
+
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class TransportMetrics:
+    """Thread-safe counters of the requests sent by a client."""
+
+    def __init__(self):
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.errors = 0
+        self.status_codes : Dict[int,int] = {}
+        self.latency_seconds = 0.0
+        self.rate_limit_wait_seconds = 0.0
+        self.retry_wait_seconds = 0.0
+
+    def record_request(self, status_code : Optional[int], latency : float, rate_limit_wait : float) -> None:
+
+        with self._lock:
+            self.requests += 1
+            self.latency_seconds += latency
+            self.rate_limit_wait_seconds += rate_limit_wait
+            if status_code is None:
+                self.errors += 1
+            else:
+                self.status_codes[status_code] = self.status_codes.get(status_code, 0) + 1
+                if status_code == 429:
+                    self.throttled += 1
+
+    def record_retry(self, delay : float) -> None:
+
+        with self._lock:
+            self.retries += 1
+            self.retry_wait_seconds += delay
+
+    def snapshot(self) -> Dict[str,Any]:
+        """Returns the current values of the counters."""
+
+        with self._lock:
+            return {
+                'requests' : self.requests,
+                'retries' : self.retries,
+                'throttled' : self.throttled,
+                'errors' : self.errors,
+                'status_codes' : dict(self.status_codes),
+                'avg_latency_seconds' : round(self.latency_seconds / self.requests, 4) if self.requests else 0.0,
+                'rate_limit_wait_seconds' : round(self.rate_limit_wait_seconds, 3),
+                'retry_wait_seconds' : round(self.retry_wait_seconds, 3)
+            }
+
+
+class Transport:
+    """
+    Sends the requests of a client through a shared token bucket, retrying throttled and failed requests.
+
+    The request is given as a callable so the same transport serves requests.Session and httpx.AsyncClient calls, the
+    responses only need status_code and headers. Exceptions listed on retry_exceptions (connection errors, timeouts)
+    are retried like a 5xx answer, the last response or exception is returned or raised once the retries run out.
+    """
+
+    def __init__(self, rate_limit : float = 0, burst : Optional[float] = None, retry_policy : Optional[RetryPolicy] = None, retry_exceptions : Tuple[Type[BaseException],...] = ()):
+
+        self.bucket = TokenBucket(rate_limit, burst)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.retry_exceptions = retry_exceptions
+        self.metrics = TransportMetrics()
+
+    def send(self, request : Callable[[], Any]) -> Any:
+        """Sends a blocking request, sleeping the calling thread while rate limited or backing off."""
+
+        attempt = 0
+
+        while True:
+            wait = self.bucket.reserve()
+            if wait:
+                time.sleep(wait)
+
+            started_at = time.perf_counter()
+            try:
+                response = request()
+            except self.retry_exceptions as e:
+                delay = self._get_retry_delay(attempt, wait, started_at, error=e)
+                if delay is None:
+                    raise
+            else:
+                delay = self._get_retry_delay(attempt, wait, started_at, response=response)
+                if delay is None:
+                    return response
+
+            time.sleep(delay)
+            attempt += 1
+
+    async def send_async(self, request : Callable[[], Awaitable[Any]]) -> Any:
+        """Async version of send, the waits are awaited so the other requests of the event loop keep running."""
+
+        attempt = 0
+
+        while True:
+            wait = self.bucket.reserve()
+            if wait:
+                await asyncio.sleep(wait)
+
+            started_at = time.perf_counter()
+            try:
+                response = await request()
+            except self.retry_exceptions as e:
+                delay = self._get_retry_delay(attempt, wait, started_at, error=e)
+                if delay is None:
+                    raise
+            else:
+                delay = self._get_retry_delay(attempt, wait, started_at, response=response)
+                if delay is None:
+                    return response
+
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def _get_retry_delay(self, attempt : int, wait : float, started_at : float, response : Any = None, error : Optional[BaseException] = None) -> Optional[float]:
+        """Records the outcome of a request and returns the seconds to wait before retrying it, None when it must not be retried."""
+
+        status_code = response.status_code if response is not None else None
+        latency = time.perf_counter() - started_at
+        self.metrics.record_request(status_code, latency, wait)
+        record_request(latency)
+
+        if response is not None and status_code not in self.retry_policy.retry_status_codes:
+            return None
+
+        if attempt >= self.retry_policy.max_retries:
+            logger.error(f'request failed after {attempt} retries : {status_code or error}')
+            return None
+
+        retry_after = parse_retry_after(response.headers.get('Retry-After')) if response is not None else None
+        delay = self.retry_policy.get_delay(attempt, retry_after)
+
+        if status_code == 429:
+            self.bucket.pause(delay)
+
+        self.metrics.record_retry(delay)
+        logger.warning(f'request answered with {status_code or repr(error)}, retry {attempt + 1}/{self.retry_policy.max_retries} in {delay:.2f} seconds.')
+
+        return delay
@@ -1,69 +1,618 @@
 from prefect import task, flow, get_run_logger
-from prefect.artifacts import create_table_artifact
+from prefect.task_runners import ConcurrentTaskRunner
+from prefect.artifacts import create_markdown_artifact
 from sqlalchemy.orm import Session
+from dataclasses import dataclass
+from pathlib import Path
 import logging
-from typing import Type, Optional
+import time
+from typing import Type, Optional, List, Dict, Any, Iterable, Tuple, Callable
 from models.base import Base
 from models.exceptions import SyncError
+from models.index import TableIndex, classify_with_index
+from models.landing import LandingZone
+from models.changelog import ChangeLog
+from models.storage import get_storage_layout
+from models.orm_model import Form, FormResponse
 from sqlalchemy.orm import sessionmaker
-from involves_api.client import InvolvesAPIClient
-from models.tasks import create_db_engine, get_models_to_sync
-from config.settings import Config
+from involves_api.client import InvolvesAPIClient, DEFAULT_POOL_SIZE
+from involves_api.async_client import SyncInvolvesAPIClient, DEFAULT_MAX_CONNECTIONS
+from involves_api.cache import ResponseCache
+from involves_api.checkpoint import PageCheckpoint
+from models.tasks import create_db_engine, get_models_to_sync, sort_models_by_dependencies, get_scheduled_dependencies
+from config.settings import Config, SyncConfig
+from utils.metrics import RunMetrics, TableMetrics, track, phase, instrument_engine
+from utils.scheduling import Job, run_bounded
 
 logging.basicConfig(level=logging.DEBUG, format="%(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
+SCHEDULER_POLL_SECONDS = 0.5
+
+
+@dataclass
+class SyncEnvironment:
+    """An Involves environment synced by the flow with its own client, database and metrics, name is empty when the flow syncs a single environment."""
+
+    name : str
+    api_client : InvolvesAPIClient
+    models : List[Type[Base]]
+    session_factory : sessionmaker
+    sync_config : SyncConfig
+    landing : Optional[LandingZone] = None
+    run_metrics : Optional[RunMetrics] = None
+    cache : Optional[ResponseCache] = None
+
+    def get_label(self, table_name : str) -> str:
+        return f'{self.name}/{table_name}' if self.name else table_name
+
 
 @task(task_run_name = 'sincronizar-tabla-{model.__tablename__}')
-def sync_table(api_client : InvolvesAPIClient, model : Type[Base], db : Session) -> None:
+def sync_table(api_client : InvolvesAPIClient, model : Type[Base], session_factory : sessionmaker, sync_config : SyncConfig, landing : Optional[LandingZone] = None, run_metrics : Optional[RunMetrics] = None, environment : str = '') -> None:
+
+    logger = get_run_logger()
+
+    metrics = run_metrics.get_table(model.__tablename__) if run_metrics is not None else TableMetrics(model.__tablename__)
+
+    with session_factory() as db, track(metrics):
+        _sync_table(api_client, model, db, sync_config, landing, environment)
+
+    logger.info(f'metricas de la tabla {model.__tablename__} : {metrics.summary()}')
+
+
+def _sync_table(api_client : InvolvesAPIClient, model : Type[Base], db : Session, sync_config : SyncConfig, landing : Optional[LandingZone] = None, environment : str = '') -> Dict[str, Dict[str,int]]:
+    """Syncs the table of the model and the tables filled from the same extraction, returns the record counts of each table."""
 
     logger = get_run_logger()
 
+    models = {m.__tablename__ : m for m in [model, *model.get_fan_out_models()]}
     table_name = model.__tablename__
 
-    logger.info(f'iniciando proceso de sincronizacion tabla : {table_name}')
-    data = model.get_records_to_sync(api_client,db)
-    logger.info(f'{len(data)} registros obtenidos tabla : {table_name}.')
+    logger.info(f'iniciando proceso de sincronizacion tabla : {table_name}' + (f' (incluye tablas : {model.__fan_out__})' if model.__fan_out__ else ''))
+    checkpoint = model.get_checkpoint(db)
+    watermarks = {table : models[table].get_watermark(db) for table in models}
 
-    classified_data = model.classify_records(data,db)
+    if landing is None:
+        data = model.get_tagged_records_to_sync(api_client,db,stream=True,checkpoint=checkpoint)
+    else:
+        if not landing.replay:
+            with phase('spool') as counter:
+                counter['rows'] = sum(landing.spool(model.get_tagged_records_to_sync(api_client,db,stream=True,checkpoint=checkpoint), watermarks).values())
+        logger.info(f'cargando registros de la tabla {table_name} desde la zona de aterrizaje, ejecucion : {landing.run_id}')
+        data = landing.iter_tagged_records(models)
 
-    new_records = classified_data['to_insert']
-    modified_records = classified_data['to_update']
+    indexes = _load_indexes(models, db, sync_config)
+    changes = ChangeLog(sample_size=sync_config.artifact_sample_size, batch_size=sync_config.write_batch_size, environment=environment)
+    save_progress = _get_progress_saver(model, db, checkpoint, watermarks[table_name]) if landing is None else None
 
     try:
 
-        if new_records or modified_records:
-
-            if new_records:
-                logger.info(f'{len(new_records)} registros nuevos encontrados para insertar en la tabla {table_name}')
-                model.insert_records(new_records,db)
-                create_table_artifact(new_records,'registros-nuevos')
-                logger.info('registros insertados exitosamente.')
-            if modified_records:
-                logger.info(f'{len(modified_records)} registros modificados encontrados para actualizar en la tabla {table_name}')
-                model.update_records(modified_records,db)
-                create_table_artifact(modified_records, 'registros-actualizados')
-                logger.info('registros actualizados exitosamente.')
+        totals = _write_records(data, models, db, sync_config, watermarks, indexes, changes, save_progress)
 
+        with phase('commit'):
+            for table, watermark in watermarks.items():
+                models[table].save_sync_state(db, watermark=watermark)
 
             db.commit()
 
+        if any(total['insertados'] or total['actualizados'] for total in totals.values()):
+            _save_indexes(models, indexes, db, sync_config)
+            for table, total in totals.items():
+                logger.info(f'tabla {table} sincronizada : {total["insertados"]} registros insertados, {total["actualizados"]} registros actualizados, {total["sin cambios"]} registros sin cambios omitidos.')
+            _create_change_artifacts(changes)
+
         else:
-            logger.info(f'No hay registros nuevos para insertar o modificar en la tabla {table_name}')
+            logger.info(f'No hay registros nuevos para insertar o modificar en las tablas {list(models)} ({sum(total["sin cambios"] for total in totals.values())} registros sin cambios omitidos)')
 
     except Exception as e:
         db.rollback()
         logger.error(f'no se pudo actualizar la tabla : {table_name} debido al siguiente error :\n {e}')
         raise SyncError from e 
 
+    return totals
+
+
+def _write_records(data : Iterable[Tuple[str,Dict[str,Any]]], models : Dict[str, Type[Base]], db : Session, sync_config : SyncConfig, watermarks : Dict[str,int], indexes : Dict[str, TableIndex], changes : ChangeLog, save_progress : Optional[Callable[[int], None]] = None, shared : bool = False) -> Dict[str, Dict[str,int]]:
+    """
+    Writes the tagged records in chunks of sync_config.chunk_size records of each table, or of at least
+    sync_config.columnstore_chunk_size records for columnstore tables so each insert fills compressed rowgroups.
+
+    The transaction is committed every sync_config.commit_rows written records or sync_config.commit_seconds seconds,
+    when set, and otherwise left to the caller. Before such a commit the buffers of every table are written, so all the
+    records pulled from data are in the transaction, and save_progress is called with their count to store the resume
+    point of the extraction along with them. watermarks is advanced to the highest updated_at_millis written on each
+    table, the caller saves it once the extraction finished. shared tells that other tasks write the same tables
+    concurrently (see _use_table_lock). Returns the record counts of each table.
+    """
+
+    logger = get_run_logger()
+
+    buffers = {table : [] for table in models}
+    totals = {table : {'obtenidos' : 0, 'insertados' : 0, 'actualizados' : 0, 'sin cambios' : 0} for table in models}
+    chunk_sizes = {table : _get_chunk_size(model, db, sync_config) for table, model in models.items()}
+    table_lock = _use_table_lock(sync_config, shared)
+
+    def flush(table : str) -> None:
+        _write_chunk(models[table], buffers[table], db, totals[table], sync_config, indexes.get(table), changes, table_lock)
+        watermarks[table] = _get_chunk_watermark(buffers[table], watermarks[table])
+        buffers[table] = []
+
+    uncommitted = 0
+    committed_at = time.monotonic()
+
+    with phase('extract') as counter:
+
+        for table, record in data:
+
+            buffer = buffers[table]
+            buffer.append(record)
+
+            if len(buffer) >= chunk_sizes[table]:
+                uncommitted += len(buffer)
+                flush(table)
+
+                if _is_commit_due(sync_config, uncommitted, committed_at):
+                    for pending_table, pending in buffers.items():
+                        if pending:
+                            flush(pending_table)
+                    written = sum(total['obtenidos'] for total in totals.values())
+                    with phase('commit'):
+                        if save_progress is not None:
+                            save_progress(written)
+                        db.commit()
+                    logger.info(f'transaccion confirmada con {written} registros escritos de las tablas {list(models)}.')
+                    uncommitted = 0
+                    committed_at = time.monotonic()
+
+        for table, buffer in buffers.items():
+            if buffer:
+                flush(table)
+
+        counter['rows'] = sum(total['obtenidos'] for total in totals.values())
+
+    return totals
+
+
+def _get_chunk_size(model : Type[Base], db : Session, sync_config : SyncConfig) -> int:
+    """Returns the records per chunk of the table, inserts of 102400 rows or more into a columnstore skip the delta store."""
+
+    if get_storage_layout(model, db).columnstore:
+        return max(sync_config.chunk_size, sync_config.columnstore_chunk_size)
+
+    return sync_config.chunk_size
+
+
+def _use_table_lock(sync_config : SyncConfig, shared : bool) -> bool:
+    """
+    Returns whether the bulk inserts into columnstore and partitioned tables take a table lock (WITH (TABLOCK)).
+
+    The table lock makes the inserts minimally logged and parallel, but it is exclusive and held until the commit. It is
+    only taken when the table has a single writer, not from the per-form syncs that write form_response concurrently,
+    where the tasks would wait on each other or deadlock against their own updates, and when the transaction is
+    committed every commit_rows or commit_seconds, otherwise the readers of the table would wait for the whole load.
+    """
+
+    return not shared and bool(sync_config.commit_rows or sync_config.commit_seconds)
+
+
+def _is_commit_due(sync_config : SyncConfig, uncommitted : int, committed_at : float) -> bool:
+    """Returns whether the commit policy of sync_config asks to commit the records written since committed_at."""
+
+    return bool(
+        (sync_config.commit_rows and uncommitted >= sync_config.commit_rows) or
+        (sync_config.commit_seconds and time.monotonic() - committed_at >= sync_config.commit_seconds)
+    )
+
+
+def _get_progress_saver(model : Type[Base], db : Session, checkpoint : PageCheckpoint, watermark : int, sync_key : Optional[str] = None) -> Callable[[int], None]:
+    """
+    Returns the save_progress function of _write_records for an extraction started at watermark.
+
+    It stores the cursor of the last page whose records are all written and keeps the starting watermark, so a run
+    interrupted after an intermediate commit resumes from that page and the watermark only advances once the extraction
+    finished.
+    """
+
+    def save_progress(records : int) -> None:
+        model.save_sync_state(db, watermark=watermark, cursor=checkpoint.committed(records), sync_key=sync_key)
+
+    return save_progress
+
+
+def _get_chunk_watermark(chunk : List[Dict[str,Any]], watermark : int) -> int:
+    """Returns the highest updated_at_millis between watermark and the records of chunk."""
+
+    return max([watermark, *(rec['updated_at_millis'] for rec in chunk if rec.get('updated_at_millis'))])
+
+
+def _load_indexes(models : Dict[str, Type[Base]], db : Session, sync_config : SyncConfig) -> Dict[str, TableIndex]:
+    """Builds the in-memory id and hash index of each table when sync_config.index_mode is 'memory'."""
+
+    if sync_config.index_mode != 'memory' or sync_config.write_mode == 'merge':
+        return {}
+
+    return {table : TableIndex.load(model, db, snapshot_dir=sync_config.index_dir) for table, model in models.items()}
+
+
+def _save_indexes(models : Dict[str, Type[Base]], indexes : Dict[str, TableIndex], db : Session, sync_config : SyncConfig) -> None:
+    """Saves the index snapshots once the transaction is committed, failures only cost a full rebuild on the next run."""
+
+    if not sync_config.index_dir:
+        return
+
+    for table, index in indexes.items():
+        try:
+            index.save(TableIndex.get_snapshot_path(sync_config.index_dir, models[table], db))
+        except OSError as e:
+            logger.warning(f'no se pudo guardar el indice de la tabla {table} : {e}')
+
+
+def _create_change_artifacts(changes : ChangeLog) -> None:
+    """Creates the sample artifacts of the committed changes, a failure only loses the artifacts since the changes are already logged."""
+
+    try:
+        with phase('artifacts'):
+            changes.create_artifacts()
+    except Exception as e:
+        logger.warning(f'no se pudieron crear los artefactos de cambios de la ejecucion {changes.run_id} : {e}')
+
+
+def _write_chunk(model : Type[Base], chunk : List[Dict[str,Any]], db : Session, totals : Dict[str,int], sync_config : SyncConfig, index : Optional[TableIndex] = None, changes : Optional[ChangeLog] = None, table_lock : bool = False) -> None:
+    """
+    Writes a chunk of records of a table, adding the record counts to totals.
+
+    updated_at_millis keeps the change timestamp provided by the API, the time of the load is stored on synced_at_millis.
+
+    With sync_config.write_mode 'classify' the records are split into new and existing ones and written with separate insert and
+    update statements, with 'merge' they are applied with a single MERGE through a staging table. When an index of the table is
+    given the classification is resolved in memory and the index is updated with the written records. The written records are
+    logged on changes, in the same transaction.
+
+    Columnstore and partitioned tables (see models.storage) are written from a staging table with set-based statements,
+    the new records with an INSERT ... SELECT ordered by the partition column, table locked when table_lock is set, and,
+    with 'merge', with an UPDATE and an INSERT instead of the MERGE.
+    """
+
+    logger = get_run_logger()
+
+    table_name = model.__tablename__
+    layout = get_storage_layout(model, db)
+
+    totals['obtenidos'] += len(chunk)
+
+    synced_at_millis = round(time.time()*1000)
+    for rec in chunk:
+        rec['synced_at_millis'] = synced_at_millis
+    logger.info(f'{len(chunk)} registros obtenidos tabla : {table_name} ({totals["obtenidos"]} acumulados).')
+
+    if sync_config.write_mode == 'merge':
+
+        with phase('merge') as counter:
+            result = model.upsert_records(chunk,db,batch_size=sync_config.write_batch_size,use_merge=not layout.is_bulk,order_by=model.__partition_column__,table_lock=table_lock)
+            counter['rows'] = len(chunk)
+        inserted_ids = set(result['inserted'])
+        updated_ids = set(result['updated'])
+
+        new_records = [rec for rec in chunk if rec['id'] in inserted_ids]
+        modified_records = [rec for rec in chunk if rec['id'] in updated_ids]
+        logger.info(f'merge aplicado en la tabla {table_name} : {len(inserted_ids)} registros insertados, {len(updated_ids)} registros actualizados, {len(result["unchanged"])} registros sin cambios omitidos.')
+
+        if changes is not None:
+            _log_changes(changes, model, db, new_records, modified_records)
+
+        totals['insertados'] += len(inserted_ids)
+        totals['actualizados'] += len(updated_ids)
+        totals['sin cambios'] += len(result['unchanged'])
+        return
+
+    with phase('classify') as counter:
+        classified_data = classify_with_index(model, chunk, index) if index is not None else model.classify_records(chunk,db)
+        counter['rows'] = len(chunk)
+
+    new_records = classified_data['to_insert']
+    modified_records = classified_data['to_update']
+    totals['sin cambios'] += len(classified_data['unchanged'])
+
+    if classified_data['unchanged']:
+        logger.info(f'{len(classified_data["unchanged"])} registros sin cambios omitidos en la tabla {table_name}')
+
+    if new_records:
+        logger.info(f'{len(new_records)} registros nuevos encontrados para insertar en la tabla {table_name}')
+        with phase('insert') as counter:
+            if layout.is_bulk:
+                model.bulk_insert_records(new_records,db,batch_size=sync_config.write_batch_size,order_by=model.__partition_column__,table_lock=table_lock)
+            else:
+                model.insert_records(new_records,db,batch_size=sync_config.write_batch_size)
+            counter['rows'] = len(new_records)
+        totals['insertados'] += len(new_records)
+        logger.info('registros insertados exitosamente.')
+    if modified_records:
+        logger.info(f'{len(modified_records)} registros modificados encontrados para actualizar en la tabla {table_name}')
+        with phase('update') as counter:
+            if layout.is_bulk:
+                model.bulk_update_records(modified_records,db,batch_size=sync_config.write_batch_size)
+            else:
+                model.update_records(modified_records,db,batch_size=sync_config.write_batch_size)
+            counter['rows'] = len(modified_records)
+        totals['actualizados'] += len(modified_records)
+        logger.info('registros actualizados exitosamente.')
+
+    if changes is not None:
+        _log_changes(changes, model, db, new_records, modified_records)
+
+    if index is not None:
+        index.update(new_records)
+        index.update(modified_records)
+
+
+def _log_changes(changes : ChangeLog, model : Type[Base], db : Session, new_records : List[Dict[str,Any]], modified_records : List[Dict[str,Any]]) -> None:
+
+    with phase('change_log') as counter:
+        changes.record(model, db, 'insert', new_records)
+        changes.record(model, db, 'update', modified_records)
+        counter['rows'] = len(new_records) + len(modified_records)
+
+
+def run_sync_tables(api_client : InvolvesAPIClient, models : List[Type[Base]], session_factory : sessionmaker, sync_config : SyncConfig, landing : Optional[LandingZone] = None, run_metrics : Optional[RunMetrics] = None) -> None:
+    """
+    Submits a sync_table task for each model to the flow task runner, respecting the dependencies declared on __depends_on__.
+
+    A model is submitted once all the models it depends on finished successfully and fewer than max_concurrent_tables
+    tasks are running, models depending on a failed table are skipped. Raises SyncError when any table failed or was skipped.
+    With a landing zone every table is spooled to local files before being loaded from them, or only loaded from the
+    files of a previous run when the landing zone is a replay. The timing of every table is gathered on run_metrics.
+    """
+
+    failed = run_environment_syncs([SyncEnvironment('', api_client, models, session_factory, sync_config, landing, run_metrics)])
+
+    if failed:
+        raise SyncError(f'no se pudieron sincronizar las tablas : {sorted(failed)}')
+
+
+def run_environment_syncs(environments : List[SyncEnvironment]) -> List[str]:
+    """
+    Submits a sync_table task for each model of every environment to the flow task runner, see run_sync_tables.
+
+    The environments are scheduled together on the same task runner, each one keeping at most the max_concurrent_tables
+    of its sync config running, so a slow table of an environment does not hold back the tables of the others.
+    Returns the labels of the tables that failed or were skipped.
+    """
+
+    logger = get_run_logger()
+
+    models = {(index, model.__tablename__) : model for index, env in enumerate(environments) for model in env.models}
+    jobs = [
+        Job((index, model.__tablename__), index, tuple((index, table) for table in get_scheduled_dependencies(model, env.models)))
+        for index, env in enumerate(environments) for model in sort_models_by_dependencies(env.models)
+    ]
+
+    def submit(job : Job) -> Any:
+        return _submit_table_sync(environments[job.group], models[job.key])
+
+    def on_skipped(job : Job, dependencies : List[Tuple[int,str]]) -> None:
+        logger.warning(f'la tabla {environments[job.group].get_label(job.key[1])} no se sincronizara porque depende de tablas con errores : {[table for _, table in dependencies]}')
+
+    limits = {index : env.sync_config.max_concurrent_tables for index, env in enumerate(environments)}
+    failed = run_bounded(jobs, submit, limits, SCHEDULER_POLL_SECONDS, on_skipped)
+
+    return [environments[index].get_label(table_name) for index, table_name in sorted(failed)]
+
+
+def _submit_table_sync(environment : SyncEnvironment, model : Type[Base]) -> Any:
+    """Submits the sync_table task of model, named after the environment when the flow syncs several of them."""
+
+    sync_task = sync_table.with_options(task_run_name=f'sincronizar-tabla-{environment.name}-{model.__tablename__}') if environment.name else sync_table
+
+    return sync_task.submit(environment.api_client, model, environment.session_factory, environment.sync_config, environment.landing, environment.run_metrics, environment.name)
+
 
+def _get_landing_zone(sync_config : SyncConfig, subdirectory : Optional[str] = None) -> Optional[LandingZone]:
+    """
+    Returns the landing zone of the run when sync_config.landing_dir is set, the one of a previous run when replay_run_id is set.
 
-# def sync_form_responses_by_form_id(form_id : int, api_client : InvolvesAPIClient, db : Session) -> None:
-#  """pending to implement a function to sync responses from a specific form."""
+    The files are landed on subdirectory of landing_dir when given, so the environments synced by the same flow do not mix their runs.
+    """
 
+    if not sync_config.landing_dir:
+        if sync_config.replay_run_id:
+            raise ValueError('SYNC_REPLAY_RUN_ID requiere definir SYNC_LANDING_DIR')
+        return None
 
+    directory = str(Path(sync_config.landing_dir) / subdirectory) if subdirectory else sync_config.landing_dir
 
-@flow(name='sincronizar_datos_involves')
+    if sync_config.replay_run_id:
+        return LandingZone.for_replay(directory, sync_config.replay_run_id)
+
+    return LandingZone(directory)
+
+
+def _publish_metrics(run_metrics : RunMetrics, sync_config : SyncConfig, name : str = '') -> None:
+    """
+    Publishes the metrics of the run as a markdown artifact and, when sync_config.metrics_path is set, as an OpenMetrics file.
+
+    The artifact key and the file name are suffixed with name, the environment of the metrics when the flow syncs several of them.
+    """
+
+    logger = get_run_logger()
+
+    try:
+        create_markdown_artifact(run_metrics.to_markdown(), key=f'metricas-sincronizacion-{name}' if name else 'metricas-sincronizacion')
+        if sync_config.metrics_path:
+            metrics_path = Path(sync_config.metrics_path)
+            metrics_path = metrics_path.with_name(f'{metrics_path.stem}-{name}{metrics_path.suffix}') if name else metrics_path
+            run_metrics.write_openmetrics(str(metrics_path))
+            logger.info(f'metricas de sincronizacion escritas en {metrics_path}')
+    except Exception as e:
+        logger.warning(f'no se pudieron publicar las metricas de sincronizacion : {e}')
+
+
+@task(task_run_name = 'sincronizar-respuestas-formulario-{form_id}')
+def sync_form_responses_by_form_id(form_id : int, api_client : InvolvesAPIClient, session_factory : sessionmaker, sync_config : SyncConfig, run_metrics : Optional[RunMetrics] = None) -> None:
+
+    logger = get_run_logger()
+
+    sync_key = FormResponse.get_form_sync_key(form_id)
+    metrics = run_metrics.get_table(sync_key) if run_metrics is not None else TableMetrics(sync_key)
+
+    with session_factory() as db, track(metrics):
+        _sync_form_responses(api_client, form_id, db, sync_config)
+
+    logger.info(f'metricas de {sync_key} : {metrics.summary()}')
+
+
+def _sync_form_responses(api_client : InvolvesAPIClient, form_id : int, db : Session, sync_config : SyncConfig) -> Dict[str,int]:
+    """
+    Syncs the responses of a single form from the watermark of the form, returns the record counts.
+
+    The watermark is saved under the sync key of the form and the one of the form_response table is left untouched, so
+    the next full sync of the table fetches these responses again and skips them as unchanged.
+    """
+
+    logger = get_run_logger()
+
+    table_name = FormResponse.__tablename__
+    sync_key = FormResponse.get_form_sync_key(form_id)
+
+    logger.info(f'iniciando sincronizacion de respuestas del formulario : {form_id}')
+    checkpoint = FormResponse.get_checkpoint(db, sync_key)
+    watermarks = {table_name : FormResponse.get_form_watermark(db, form_id)}
+    data = ((table_name, record) for record in FormResponse.get_form_records_to_sync(api_client, db, form_id, stream=True, checkpoint=checkpoint))
+    changes = ChangeLog(sample_size=sync_config.artifact_sample_size, batch_size=sync_config.write_batch_size)
+    save_progress = _get_progress_saver(FormResponse, db, checkpoint, watermarks[table_name], sync_key)
+
+    try:
+
+        totals = _write_records(data, {table_name : FormResponse}, db, sync_config, watermarks, {}, changes, save_progress, shared=True)[table_name]
+
+        with phase('commit'):
+            FormResponse.save_sync_state(db, watermark=watermarks[table_name], sync_key=sync_key)
+            db.commit()
+
+        logger.info(f'respuestas del formulario {form_id} sincronizadas : {totals["insertados"]} registros insertados, {totals["actualizados"]} registros actualizados, {totals["sin cambios"]} registros sin cambios omitidos.')
+
+        if totals['insertados'] or totals['actualizados']:
+            _create_change_artifacts(changes)
+
+    except Exception as e:
+        db.rollback()
+        logger.error(f'no se pudieron sincronizar las respuestas del formulario : {form_id} debido al siguiente error :\n {e}')
+        raise SyncError from e
+
+    return totals
+
+
+def run_form_response_syncs(api_client : InvolvesAPIClient, form_ids : List[int], session_factory : sessionmaker, sync_config : SyncConfig, run_metrics : Optional[RunMetrics] = None) -> None:
+    """
+    Submits a sync_form_responses_by_form_id task for each form to the flow task runner, keeping at most max_concurrent_tables tasks running.
+
+    Raises SyncError when the responses of any form could not be synced.
+    """
+
+    def submit(job : Job) -> Any:
+        return sync_form_responses_by_form_id.submit(job.key, api_client, session_factory, sync_config, run_metrics)
+
+    failed = run_bounded([Job(form_id) for form_id in form_ids], submit, {None : sync_config.max_concurrent_tables}, SCHEDULER_POLL_SECONDS)
+
+    if failed:
+        raise SyncError(f'no se pudieron sincronizar las respuestas de los formularios : {sorted(failed)}')
+
+
+def _create_resources(config : Config, pool_client : Optional[InvolvesAPIClient] = None, cache : Optional[ResponseCache] = None, **pool_options) -> Tuple[sessionmaker, InvolvesAPIClient, Optional[ResponseCache]]:
+    """
+    Creates the database session factory, the response cache and the API client of the flow from config.
+
+    The API client sends its requests through the connection pool of pool_client when given, otherwise through a pool
+    of its own created with pool_options (pool_size for requests, max_connections for httpx). It uses cache when
+    given instead of a cache of its own.
+    """
+
+    engine = create_db_engine(config.db.server, config.db.database, config.db.username, config.db.password, pool_size=config.sync.max_concurrent_tables, fast_executemany=config.db.fast_executemany)
+    instrument_engine(engine)
+    if cache is None and config.api.cache_mode != 'off':
+        cache = ResponseCache(config.api.cache_dir, config.api.cache_mode, config.api.cache_ttl, config.api.cache_max_mb*1024**2)
+    api_client_cls = pool_client.for_environment if pool_client is not None else SyncInvolvesAPIClient if config.api.http_client == 'httpx' else InvolvesAPIClient
+    api_client = api_client_cls(config.api.environment, config.api.domain, config.api.app_user, config.api.app_password, max_in_flight=config.api.max_in_flight, timestamp_shards=config.api.timestamp_shards, rate_limit=config.api.rate_limit, max_retries=config.api.max_retries, cache=cache, stream_items=config.api.stream_items, base_url=config.api.base_url, connect_timeout=config.api.connect_timeout, read_timeout=config.api.read_timeout, **pool_options)
+
+    return sessionmaker(engine), api_client, cache
+
+
+def _create_environments(config_blocks : List[str]) -> List[SyncEnvironment]:
+    """
+    Creates the environments of the config blocks, sharing the connection pools of the API clients between them.
+
+    The clients of the same http_client send their requests through the pool of the first one, sized for all of them,
+    and each database gets a single engine sized for the max_concurrent_tables of its environment. The environments
+    caching their responses on the same directory share a single ResponseCache, so its size is accounted and evicted
+    once. Two blocks writing to the same database are rejected, as the sync tables and their watermarks would be
+    overwritten by each other. The clients created before a failure are closed.
+    """
+
+    configs = {block : Config.load_from_block(block) for block in dict.fromkeys(config_blocks)}
+
+    databases = {}
+    for block, config in configs.items():
+        database = (config.db.server.lower(), config.db.database.lower())
+        if database in databases:
+            raise ValueError(f'los bloques {databases[database]} y {block} sincronizan la misma base de datos {config.db.database}')
+        databases[database] = block
+
+    pool_clients = {}
+    caches = {}
+    environments = []
+
+    try:
+
+        for block, config in configs.items():
+
+            http_client = config.api.http_client
+            pool_options = {} if http_client in pool_clients else _get_pool_options(http_client, [c for c in configs.values() if c.api.http_client == http_client])
+            cache_dir = str(Path(config.api.cache_dir).resolve())
+
+            Session, api_client, cache = _create_resources(config, pool_clients.get(http_client), caches.get(cache_dir), **pool_options)
+            pool_clients.setdefault(http_client, api_client)
+            if cache is not None:
+                caches.setdefault(cache_dir, cache)
+
+            name = block.lower().replace('_','-')
+            environments.append(SyncEnvironment(name, api_client, get_models_to_sync(config.api.environment), Session, config.sync, _get_landing_zone(config.sync, name), RunMetrics(), cache))
+
+    except Exception:
+        _close_environments(environments)
+        raise
+
+    return environments
+
+
+def _close_environments(environments : List[SyncEnvironment]) -> None:
+    """Closes the API clients of the environments in reverse order, so the clients owning a shared pool or event loop are closed after the ones using it."""
+
+    for env in reversed(environments):
+        try:
+            env.api_client.close()
+        except Exception as e:
+            logger.warning(f'no se pudo cerrar el cliente de la API del entorno {env.name} : {e}')
+
+
+def _get_pool_options(http_client : str, configs : List[Config]) -> Dict[str,int]:
+    """Returns the size of the connection pool shared by the API clients of configs, per domain for requests and in total for httpx."""
+
+    if http_client == 'httpx':
+        return {'max_connections' : DEFAULT_MAX_CONNECTIONS * len(configs)}
+
+    return {'pool_size' : max(DEFAULT_POOL_SIZE, *(max(c.api.max_in_flight, c.api.timestamp_shards) for c in configs))}
+
+
+def _publish_run_stats(api_client : InvolvesAPIClient, cache : Optional[ResponseCache], run_metrics : RunMetrics, sync_config : SyncConfig, name : str = '') -> None:
+
+    logger = get_run_logger()
+
+    _publish_metrics(run_metrics, sync_config, name)
+    logger.info(f'metricas de solicitudes a la API{f" del entorno {name}" if name else ""} : {api_client.transport.metrics.snapshot()}')
+    if cache:
+        logger.info(f'metricas de la cache de respuestas{f" del entorno {name}" if name else ""} : {cache.get_stats()}')
+
+
+@flow(name='sincronizar_datos_involves', task_runner=ConcurrentTaskRunner())
 def main(config_block : Optional[str] = None):
 
     logger = get_run_logger()
@@ -71,9 +620,8 @@ def main(config_block : Optional[str] = None):
     try:
 
         config = Config.load_from_block(config_block) if config_block else Config.load_from_env()
-        engine = create_db_engine(config.db.server, config.db.database, config.db.username, config.db.password)
-        Session = sessionmaker(engine)
-        api_client = InvolvesAPIClient(config.api.environment, config.api.domain, config.api.app_user, config.api.app_password)
+        Session, api_client, cache = _create_resources(config)
+        landing = _get_landing_zone(config.sync)
     
     except Exception as e:
     
@@ -81,12 +629,90 @@ def main(config_block : Optional[str] = None):
         raise
 
     models = get_models_to_sync(config.api.environment)
+    run_metrics = RunMetrics()
+
+    try:
+        run_sync_tables(api_client, models, Session, config.sync, landing, run_metrics)
+    finally:
+        _publish_run_stats(api_client, cache, run_metrics, config.sync)
+
+
+@flow(name='sincronizar_respuestas_por_formulario', task_runner=ConcurrentTaskRunner())
+def sync_form_responses(form_ids : Optional[List[int]] = None, config_block : Optional[str] = None):
+    """
+    Syncs the responses of the given forms, or of every active form of the form table when no ids are given.
+
+    Each form is synced from its own watermark and the forms run in parallel, so the forms that change the most can be
+    refreshed often without walking the survey chain of the whole environment. The formId filter of the API is checked
+    once on the first form, when the server ignores it the whole form_response table is synced in a single extraction
+    instead of walking the chain once per form.
+    """
+
+    logger = get_run_logger()
+
+    try:
 
-    for tbl in models:
+        config = Config.load_from_block(config_block) if config_block else Config.load_from_env()
+        Session, api_client, cache = _create_resources(config)
+
+    except Exception as e:
+
+        logger.critical(f'No se pudo ejecutar el flujo debido a un error critico: \n {e}')
+        raise
+
+    if not form_ids:
         with Session() as db:
-            sync_table(api_client,tbl,db)
+            form_ids = Form.get_active_ids(db)
+        logger.info(f'{len(form_ids)} formularios activos encontrados para sincronizar sus respuestas.')
+
+    run_metrics = RunMetrics()
+
+    try:
+        if not form_ids or FormResponse.is_form_filter_supported(api_client, form_ids[0]):
+            run_form_response_syncs(api_client, form_ids, Session, config.sync, run_metrics)
+        else:
+            logger.warning('la API no filtra las respuestas por formulario, se sincronizara la tabla form_response completa en una sola extraccion.')
+            run_sync_tables(api_client, [FormResponse], Session, config.sync, None, run_metrics)
+    finally:
+        _publish_run_stats(api_client, cache, run_metrics, config.sync)
+
+
+@flow(name='sincronizar_datos_involves_multientorno', task_runner=ConcurrentTaskRunner())
+def sync_environments(config_blocks : List[str]):
+    """
+    Syncs the Involves environments of several config blocks in a single flow run.
+
+    The tables of every environment run on the same task runner and the API clients share their connection pool, so one
+    worker process serves all the environments instead of a process, an event loop and a set of pools per environment.
+    Each environment keeps its own database, dependencies, concurrency limit and metrics, and a failure in one of them
+    does not stop the others.
+    """
+
+    logger = get_run_logger()
+
+    try:
+        environments = _create_environments(config_blocks)
+
+    except Exception as e:
+
+        logger.critical(f'No se pudo ejecutar el flujo debido a un error critico: \n {e}')
+        raise
+
+    logger.info(f'sincronizando {len(environments)} entornos : {[env.name for env in environments]}')
+
+    try:
+        failed = run_environment_syncs(environments)
+    finally:
+        for env in environments:
+            _publish_run_stats(env.api_client, None, env.run_metrics, env.sync_config, env.name)
+        for cache in {id(env.cache) : env.cache for env in environments if env.cache is not None}.values():
+            logger.info(f'metricas de la cache de respuestas en {cache.directory} : {cache.get_stats()}')
+        _close_environments(environments)
+
+    if failed:
+        raise SyncError(f'no se pudieron sincronizar las tablas : {failed}')
 
 
 
 if __name__ == "__main__" :
-    main()
\ No newline at end of file
+    main()
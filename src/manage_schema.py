@@ -0,0 +1,77 @@
+from config.settings import Config
+from models.tasks import create_db_engine
+from models.schema import upgrade_schema, get_schema_differences, get_current_revision
+from models.storage import PROFILES, DEFAULT_MONTHS_AHEAD, apply_storage_profile
+from models.base import Base
+from sqlalchemy import Engine
+from pathlib import Path
+from typing import Optional, Tuple
+import click
+
+
+def get_engine(block_name : Optional[str], env_path : Optional[Path]) -> Engine:
+    """Creates the engine of the database configured on the block, or on the environment variables when no block is given."""
+
+    config = Config.load_from_block(block_name, env_path) if block_name else Config.load_from_env(env_path)
+
+    return create_db_engine(config.db.server, config.db.database, config.db.username, config.db.password, pool_size=1)
+
+
+@click.group('manage_schema')
+def main():
+    """Administra el esquema de la base de datos de sincronizacion con las migraciones de Alembic."""
+
+
+@main.command('upgrade')
+@click.option('--block_name', default=None, help='Bloque de configuracion con la base de datos, por defecto se usan las variables de entorno.')
+@click.option('--env_path', default=None, type=click.Path(exists=True, path_type=Path), help='Archivo .env con la configuracion.')
+@click.option('--revision', default='head', help='Revision hasta la que se aplican las migraciones.')
+def upgrade(block_name : Optional[str], env_path : Optional[Path], revision : str):
+    """Crea las tablas e indices que falten en la base de datos aplicando las migraciones."""
+
+    engine = get_engine(block_name, env_path)
+
+    upgrade_schema(engine, revision)
+
+    click.echo(f'Esquema actualizado a la revision {get_current_revision(engine)} en la base de datos {engine.url.database}.')
+
+
+@main.command('check')
+@click.option('--block_name', default=None, help='Bloque de configuracion con la base de datos, por defecto se usan las variables de entorno.')
+@click.option('--env_path', default=None, type=click.Path(exists=True, path_type=Path), help='Archivo .env con la configuracion.')
+def check(block_name : Optional[str], env_path : Optional[Path]):
+    """Compara la base de datos con los modelos, termina con error si hay diferencias."""
+
+    engine = get_engine(block_name, env_path)
+
+    differences = get_schema_differences(engine)
+
+    if differences:
+        raise click.ClickException(f'El esquema de la base de datos {engine.url.database} no coincide con los modelos :\n' + '\n'.join(f'  - {d}' for d in differences) + '\nEjecute manage_schema.py upgrade para aplicar las migraciones pendientes.')
+
+    click.echo(f'El esquema de la base de datos {engine.url.database} coincide con los modelos (revision {get_current_revision(engine)}).')
+
+
+@main.command('storage')
+@click.option('--profile', required=True, type=click.Choice(PROFILES), help='Perfil de almacenamiento de las tablas.')
+@click.option('--table', 'tables', multiple=True, help='Tabla a la que se aplica el perfil, por defecto todas las tablas con columna de particion.')
+@click.option('--months_ahead', default=DEFAULT_MONTHS_AHEAD, help='Meses futuros con particion creada de antemano.')
+@click.option('--block_name', default=None, help='Bloque de configuracion con la base de datos, por defecto se usan las variables de entorno.')
+@click.option('--env_path', default=None, type=click.Path(exists=True, path_type=Path), help='Archivo .env con la configuracion.')
+def storage(profile : str, tables : Tuple[str,...], months_ahead : int, block_name : Optional[str], env_path : Optional[Path]):
+    """Aplica un perfil de almacenamiento (columnstore y/o particiones mensuales) a las tablas de hechos, puede ejecutarse de nuevo para crear las particiones de los meses siguientes."""
+
+    models = {mapper.class_.__tablename__ : mapper.class_ for mapper in Base.registry.mappers if getattr(mapper.class_, '__partition_column__', None)}
+    unknown = set(tables) - set(models)
+    if unknown:
+        raise click.BadParameter(f'las tablas {sorted(unknown)} no tienen columna de particion, tablas disponibles : {sorted(models)}', param_hint='--table')
+
+    engine = get_engine(block_name, env_path)
+
+    for table_name in tables or sorted(models):
+        layout = apply_storage_profile(engine, models[table_name], profile, months_ahead)
+        click.echo(f'Tabla {table_name} con perfil {profile} : {layout}')
+
+
+if __name__ == '__main__':
+    main()
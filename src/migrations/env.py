@@ -0,0 +1,61 @@
+"""
+Alembic environment of the sync database.
+
+The migrations run on the engine given by manage_schema.py, otherwise on the URL passed with `alembic -x url=...`
+or built from the SQL Server variables of the flow (SERVER, DATABASE, SQL_USER, SQL_PASSWORD).
+"""
+
+from logging.config import fileConfig
+from alembic import context
+from sqlalchemy import create_engine
+from config.settings import Config
+from models.schema import Base, include_object
+from models.tasks import get_connection_url
+
+config = context.config
+engine = config.attributes.get('engine')
+
+if engine is None and config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+
+
+def get_url() -> str:
+
+    url = context.get_x_argument(as_dictionary=True).get('url') or config.get_main_option('sqlalchemy.url')
+    if url:
+        return url
+
+    db = Config.load_from_env().db
+
+    return get_connection_url(db.server, db.database, db.username, db.password)
+
+
+def run_migrations_offline() -> None:
+    """Renders the migrations as SQL without connecting to the database."""
+
+    context.configure(url=get_url(), target_metadata=target_metadata, include_object=include_object, literal_binds=True, dialect_opts={'paramstyle' : 'named'})
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online() -> None:
+
+    connectable = engine if engine is not None else create_engine(get_url())
+
+    with connectable.connect() as connection:
+        context.configure(connection=connection, target_metadata=target_metadata, include_object=include_object, compare_type=True)
+
+        with context.begin_transaction():
+            context.run_migrations()
+
+    if engine is None:
+        connectable.dispose()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,269 @@
+"""initial schema
+
+Creates the tables of the models, sync_state and sync_change_log with the indexes on updated_at_millis, which the
+watermark lookups read, and on the id columns of the related tables, which the downstream joins use.
+
+The tables were created by hand before the schema was managed with Alembic, so every step checks the live database
+first: existing tables are kept and only get the sync columns and indexes they are missing, and the columns whose type
+differs from the models (an INT updated_at_millis from before the BIGINT change) are altered to the model type.
+
+Revision ID: 0001
+Revises: 
+Create Date: 2026-10-17 12:05:38.819125
+
+"""
+from typing import Sequence, Union, Dict, List, Any
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def get_tables() -> Dict[str, List[Any]]:
+    """Returns the columns and constraints of each table, new objects on each call since a column belongs to a single table."""
+
+    return {
+        'employee' : [
+            sa.Column('employee_name', sa.String(), nullable=True),
+            sa.Column('employee_code', sa.String(), nullable=True),
+            sa.Column('is_field_team', sa.String(), nullable=True),
+            sa.Column('user_group', sa.String(), nullable=True),
+            sa.Column('leader_name', sa.String(), nullable=True),
+            sa.Column('is_enabled', sa.String(), nullable=True),
+            sa.Column('updated_at_millis', sa.BigInteger(), nullable=True),
+            sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+            sa.Column('row_hash', sa.String(length=32), nullable=True),
+            sa.Column('synced_at_millis', sa.BigInteger(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        ],
+        'employee_absence' : [
+            sa.Column('employee_id', sa.Integer(), nullable=True),
+            sa.Column('start_date', sa.Date(), nullable=True),
+            sa.Column('end_date', sa.Date(), nullable=True),
+            sa.Column('absence_reason', sa.String(), nullable=True),
+            sa.Column('absence_note', sa.String(), nullable=True),
+            sa.Column('updated_at_millis', sa.BigInteger(), nullable=True),
+            sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+            sa.Column('row_hash', sa.String(length=32), nullable=True),
+            sa.Column('synced_at_millis', sa.BigInteger(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        ],
+        'form' : [
+            sa.Column('form_name', sa.String(), nullable=True),
+            sa.Column('is_active', sa.Boolean(), nullable=True),
+            sa.Column('is_deleted', sa.Boolean(), nullable=True),
+            sa.Column('form_purpose', sa.String(), nullable=True),
+            sa.Column('requires_check_in', sa.Boolean(), nullable=True),
+            sa.Column('requires_point_of_sale', sa.Boolean(), nullable=True),
+            sa.Column('updated_at_millis', sa.BigInteger(), nullable=True),
+            sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+            sa.Column('row_hash', sa.String(length=32), nullable=True),
+            sa.Column('synced_at_millis', sa.BigInteger(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        ],
+        'form_field' : [
+            sa.Column('form_id', sa.Integer(), nullable=True),
+            sa.Column('field_name', sa.String(), nullable=True),
+            sa.Column('field_description', sa.String(), nullable=True),
+            sa.Column('field_order', sa.Integer(), nullable=True),
+            sa.Column('is_deleted', sa.Boolean(), nullable=True),
+            sa.Column('is_required', sa.Boolean(), nullable=True),
+            sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+            sa.Column('updated_at_millis', sa.BigInteger(), nullable=False),
+            sa.Column('row_hash', sa.String(length=32), nullable=True),
+            sa.Column('synced_at_millis', sa.BigInteger(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        ],
+        'form_response' : [
+            sa.Column('survey_id', sa.Integer(), nullable=True),
+            sa.Column('replied_at', sa.DateTime(), nullable=True),
+            sa.Column('time_spent', sa.BigInteger(), nullable=True),
+            sa.Column('form_id', sa.Integer(), nullable=True),
+            sa.Column('form_field_id', sa.Integer(), nullable=True),
+            sa.Column('employee_id', sa.Integer(), nullable=True),
+            sa.Column('point_of_sale_id', sa.Integer(), nullable=True),
+            sa.Column('product_id', sa.Integer(), nullable=True),
+            sa.Column('response_value', sa.String(), nullable=True),
+            sa.Column('is_deleted', sa.Boolean(), nullable=True),
+            sa.Column('updated_at_millis', sa.BigInteger(), nullable=True),
+            sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+            sa.Column('row_hash', sa.String(length=32), nullable=True),
+            sa.Column('synced_at_millis', sa.BigInteger(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        ],
+        'point_of_sale' : [
+            sa.Column('point_of_sale_base_id', sa.Integer(), nullable=True),
+            sa.Column('point_of_sale_name', sa.String(), nullable=True),
+            sa.Column('chain', sa.String(), nullable=True),
+            sa.Column('chain_group', sa.String(), nullable=True),
+            sa.Column('channel', sa.String(), nullable=True),
+            sa.Column('point_of_sale_code', sa.String(), nullable=True),
+            sa.Column('region', sa.String(), nullable=True),
+            sa.Column('macro_region', sa.String(), nullable=True),
+            sa.Column('point_of_sale_type', sa.String(), nullable=True),
+            sa.Column('point_of_sale_profile', sa.String(), nullable=True),
+            sa.Column('latitude', sa.Float(), nullable=True),
+            sa.Column('longitude', sa.Float(), nullable=True),
+            sa.Column('zip_code', sa.String(), nullable=True),
+            sa.Column('is_enabled', sa.Boolean(), nullable=True),
+            sa.Column('is_deleted', sa.Boolean(), nullable=True),
+            sa.Column('updated_at_millis', sa.BigInteger(), nullable=True),
+            sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+            sa.Column('row_hash', sa.String(length=32), nullable=True),
+            sa.Column('synced_at_millis', sa.BigInteger(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        ],
+        'product' : [
+            sa.Column('product_name', sa.String(), nullable=True),
+            sa.Column('bar_code', sa.String(), nullable=True),
+            sa.Column('product_line', sa.String(), nullable=True),
+            sa.Column('is_active', sa.Boolean(), nullable=True),
+            sa.Column('is_deleted', sa.Boolean(), nullable=True),
+            sa.Column('updated_at_millis', sa.BigInteger(), nullable=True),
+            sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+            sa.Column('row_hash', sa.String(length=32), nullable=True),
+            sa.Column('synced_at_millis', sa.BigInteger(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        ],
+        'sync_change_log' : [
+            sa.Column('log_id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), autoincrement=True, nullable=False),
+            sa.Column('run_id', sa.String(length=64), nullable=False),
+            sa.Column('table_name', sa.String(length=100), nullable=False),
+            sa.Column('record_id', sa.BigInteger(), nullable=False),
+            sa.Column('operation', sa.String(length=10), nullable=False),
+            sa.Column('row_hash', sa.String(length=32), nullable=True),
+            sa.Column('synced_at_millis', sa.BigInteger(), nullable=True),
+            sa.PrimaryKeyConstraint('log_id')
+        ],
+        'sync_state' : [
+            sa.Column('sync_key', sa.String(length=100), nullable=False),
+            sa.Column('watermark', sa.BigInteger(), nullable=True),
+            sa.Column('cursor', sa.BigInteger(), nullable=True),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('sync_key')
+        ],
+        'visit' : [
+            sa.Column('employee_id', sa.Integer(), nullable=True),
+            sa.Column('point_of_sale_id', sa.Integer(), nullable=True),
+            sa.Column('visit_date', sa.Date(), nullable=True),
+            sa.Column('visit_type', sa.String(), nullable=True),
+            sa.Column('visit_status', sa.String(), nullable=True),
+            sa.Column('manual_entry_date', sa.DateTime(), nullable=True),
+            sa.Column('manual_exit_date', sa.DateTime(), nullable=True),
+            sa.Column('gps_entry_date', sa.DateTime(), nullable=True),
+            sa.Column('gps_exit_date', sa.DateTime(), nullable=True),
+            sa.Column('visit_duration_manual', sa.Integer(), nullable=True),
+            sa.Column('visit_duration_gps', sa.Integer(), nullable=True),
+            sa.Column('is_deleted', sa.Boolean(), nullable=True),
+            sa.Column('updated_at_millis', sa.BigInteger(), nullable=True),
+            sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+            sa.Column('row_hash', sa.String(length=32), nullable=True),
+            sa.Column('synced_at_millis', sa.BigInteger(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        ],
+    }
+
+
+INDEXES = [
+    ('ix_employee_updated_at_millis', 'employee', ['updated_at_millis']),
+    ('ix_employee_absence_employee_id', 'employee_absence', ['employee_id']),
+    ('ix_employee_absence_updated_at_millis', 'employee_absence', ['updated_at_millis']),
+    ('ix_form_updated_at_millis', 'form', ['updated_at_millis']),
+    ('ix_form_field_form_id', 'form_field', ['form_id']),
+    ('ix_form_field_updated_at_millis', 'form_field', ['updated_at_millis']),
+    ('ix_form_response_employee_id', 'form_response', ['employee_id']),
+    ('ix_form_response_form_field_id', 'form_response', ['form_field_id']),
+    ('ix_form_response_form_id_updated_at_millis', 'form_response', ['form_id', 'updated_at_millis']),
+    ('ix_form_response_point_of_sale_id', 'form_response', ['point_of_sale_id']),
+    ('ix_form_response_product_id', 'form_response', ['product_id']),
+    ('ix_form_response_survey_id', 'form_response', ['survey_id']),
+    ('ix_form_response_updated_at_millis', 'form_response', ['updated_at_millis']),
+    ('ix_point_of_sale_updated_at_millis', 'point_of_sale', ['updated_at_millis']),
+    ('ix_product_updated_at_millis', 'product', ['updated_at_millis']),
+    ('ix_sync_change_log_run_table', 'sync_change_log', ['run_id', 'table_name']),
+    ('ix_visit_employee_id', 'visit', ['employee_id']),
+    ('ix_visit_point_of_sale_id', 'visit', ['point_of_sale_id']),
+    ('ix_visit_updated_at_millis', 'visit', ['updated_at_millis']),
+]
+
+SYNC_TABLES = ('sync_state', 'sync_change_log')
+
+
+def is_type_different(live_column : Dict[str, Any], column : sa.Column) -> bool:
+    """Whether the type of a reflected column differs from the model, with the comparison `manage_schema.py check` uses."""
+
+    return op.get_context().impl.compare_type(sa.Column(live_column['name'], live_column['type']), column)
+
+
+def alter_column_types(inspector : Any, table_name : str, altered : List[Any]) -> None:
+    """
+    Alters the columns of an existing table to the model types, altered holds (model column, reflected column) pairs.
+
+    The indexes on the altered columns are dropped before and recreated after, SQL Server refuses to alter an indexed
+    column. On SQLite the batch mode recreates the table, which has no ALTER COLUMN.
+    """
+
+    names = {column.name for column, _ in altered}
+    indexes = [i for i in inspector.get_indexes(table_name) if names.intersection(i['column_names'])]
+
+    for index in indexes:
+        op.drop_index(index['name'], table_name=table_name)
+
+    with op.batch_alter_table(table_name) as batch_op:
+        for column, live_column in altered:
+            batch_op.alter_column(column.name, type_=column.type, existing_type=live_column['type'], existing_nullable=live_column['nullable'])
+
+    for index in indexes:
+        op.create_index(index['name'], table_name, index['column_names'], unique=bool(index['unique']))
+
+
+def upgrade() -> None:
+
+    inspector = sa.inspect(op.get_bind())
+    existing_tables = set(inspector.get_table_names())
+
+    for table_name, items in get_tables().items():
+
+        if table_name not in existing_tables:
+            op.create_table(table_name, *items)
+            continue
+
+        existing_columns = {c['name'] : c for c in inspector.get_columns(table_name)}
+        for column in items:
+            if isinstance(column, sa.Column) and column.name not in existing_columns:
+                column.nullable = True
+                op.add_column(table_name, column)
+
+        altered = [
+            (column, existing_columns[column.name]) for column in items
+            if isinstance(column, sa.Column) and column.name in existing_columns and is_type_different(existing_columns[column.name], column)
+        ]
+        if altered:
+            alter_column_types(inspector, table_name, altered)
+
+    inspector = sa.inspect(op.get_bind())
+
+    for index_name, table_name, columns in INDEXES:
+        if index_name not in {i['name'] for i in inspector.get_indexes(table_name)}:
+            op.create_index(index_name, table_name, columns, unique=False)
+
+
+def downgrade() -> None:
+    """Drops the indexes and the sync bookkeeping tables, the data tables and their rows are kept."""
+
+    inspector = sa.inspect(op.get_bind())
+    existing_tables = set(inspector.get_table_names())
+
+    for index_name, table_name, _ in reversed(INDEXES):
+        if table_name in existing_tables and index_name in {i['name'] for i in inspector.get_indexes(table_name)}:
+            op.drop_index(index_name, table_name=table_name)
+
+    for table_name in SYNC_TABLES:
+        if table_name in existing_tables:
+            op.drop_table(table_name)
@@ -1,87 +1,418 @@
 from sqlalchemy.orm import DeclarativeBaseNoMeta, Mapped, mapped_column, Session
-from sqlalchemy import func, insert, update
-from sqlalchemy.types import Integer, BigInteger
-from typing import List,Dict,Any, Union
+from sqlalchemy import func, insert, update, text, table, column, Index
+from sqlalchemy.types import Integer, BigInteger, String, DateTime
+from typing import List,Dict,Any, Union, Iterator, Iterable, ClassVar, Tuple, Type, Optional
 from abc import abstractmethod, ABC
+from datetime import datetime
+import hashlib
+import orjson
 from involves_api.client import InvolvesAPIClient
-from .exceptions import InsertOperationError, UpdateOperationError
+from involves_api.checkpoint import PageCheckpoint
+from involves_api.fields import Field, PageMapper, compile_page_mapper
+from utils.iterables import chunked
+from utils.metrics import timed_page_func
+from .exceptions import InsertOperationError, UpdateOperationError, UpsertOperationError
+
+
+_page_mappers : Dict[type, PageMapper] = {}
 
 
 class Base(DeclarativeBaseNoMeta, ABC):
 
     __abstract__ = True
+    __depends_on__ : ClassVar[Tuple[str,...]] = ()
+    __fan_out__ : ClassVar[Tuple[str,...]] = ()
+
+    __hash_excluded__ : ClassVar[Tuple[str,...]] = ('id', 'updated_at_millis', 'synced_at_millis', 'row_hash')
+
+    __fields__ : ClassVar[Dict[str, Union[str, Field]]] = {}
+    __explode__ : ClassVar[Optional[str]] = None
+    __partition_column__ : ClassVar[Optional[str]] = None
 
     id : Mapped[int] = mapped_column(Integer,primary_key=True,autoincrement=False)
-    updated_at_millis : Mapped[int] = mapped_column(BigInteger)
+    updated_at_millis : Mapped[int] = mapped_column(BigInteger, index=True)
+    row_hash : Mapped[Optional[str]] = mapped_column(String(32), nullable=True)
+    synced_at_millis : Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+
+
+    @classmethod
+    def get_hashed_columns(cls) -> List[str]:
+        """Returns the columns that make up the row content hash, the key and sync bookkeeping columns listed on __hash_excluded__ are left out."""
+
+        return [c for c in cls.__table__.columns.keys() if c not in cls.__hash_excluded__]
+
+    @classmethod
+    def compute_row_hash(cls, record : Dict[str,Any], columns : Optional[List[str]] = None) -> str:
+        """Returns a 128 bit hex digest of the values of the hashed columns of the record, missing keys hash as NULL."""
+
+        values = [record.get(c) for c in (columns or cls.get_hashed_columns())]
+
+        return hashlib.blake2b(orjson.dumps(values, default=str), digest_size=16).hexdigest()
+
+    @classmethod
+    def add_row_hashes(cls, records : List[Dict[str,Any]]) -> None:
+        """Stores the row content hash of each record on its row_hash key."""
+
+        columns = cls.get_hashed_columns()
+        for rec in records:
+            rec['row_hash'] = cls.compute_row_hash(rec, columns)
     
     
     @classmethod
-    def insert_records(cls, records : List[Dict[str,str]], db : Session) -> None:
+    def insert_records(cls, records : List[Dict[str,str]], db : Session, batch_size : Optional[int] = None) -> None:
+        """Inserts the records with one executemany per batch of batch_size records, all at once when batch_size is not provided."""
 
         if records:
             try:
-                db.execute(
-                    insert(cls).execution_options(render_nulls=True),
-                    records
-                    )
+                for batch in chunked(records, batch_size or len(records)):
+                    db.execute(
+                        insert(cls).execution_options(render_nulls=True),
+                        batch
+                        )
             except Exception as e:
                 raise InsertOperationError(f'Ocurrio un error al intentar realizar la operacion de insercion en la tabla {cls.__tablename__}: \n {e}')
 
 
     @classmethod
-    def update_records(cls, records : List[Dict[str,str]], db : Session) -> None:
+    def update_records(cls, records : List[Dict[str,str]], db : Session, batch_size : Optional[int] = None) -> None:
+        """Updates the records by primary key with one executemany per batch of batch_size records, all at once when batch_size is not provided."""
 
         if records:
 
             try:
-                db.execute(
-                    update(cls),
-                    records
-                )
+                for batch in chunked(records, batch_size or len(records)):
+                    db.execute(
+                        update(cls),
+                        batch
+                    )
             except Exception as e:
                 raise UpdateOperationError(f'Ocurrio un error al intentar realizar la operacion de actualizacion en la tabla {cls.__tablename__}: \n {e}')
             
+    @classmethod
+    def upsert_records(cls, records : List[Dict[str,str]], db : Session, batch_size : Optional[int] = None, use_merge : bool = True, order_by : Optional[str] = None, table_lock : bool = True) -> Dict[str, List[int]]:
+        """
+        Inserts or updates the records with set-based statements, without classifying them first.
+
+        The records are bulk loaded into a session temp table with the same columns as the table, in executemany batches of
+        batch_size records, and applied with one T-SQL MERGE. Only the columns present in the records are written, when several records share an id the last one wins.
+        Existing rows whose row_hash matches the record hash are left untouched. With use_merge False they are applied with
+        an UPDATE joined to the staging table and an INSERT of the staged rows missing from the table instead, which keeps
+        the bulk insert path of columnstore tables (see bulk_insert_records, order_by and table_lock are only used on this path).
+
+        Returns:
+            Dict[str, List[int]]: The ids of the rows that were inserted, updated and left unchanged.
+        """
+
+        result = {'inserted' : [], 'updated' : [], 'unchanged' : []}
+
+        if not records:
+            return result
+
+        records = list({rec['id'] : rec for rec in records}.values())
+        cls.add_row_hashes(records)
+        columns = [c for c in cls.__table__.columns.keys() if c in records[0]]
+
+        preparer = db.get_bind().dialect.identifier_preparer
+        target = preparer.format_table(cls.__table__)
+        quoted = {c : preparer.quote(c) for c in columns}
+        non_key_columns = [c for c in columns if c != 'id']
+        changed = f'(tgt.{quoted["row_hash"]} IS NULL OR tgt.{quoted["row_hash"]} <> src.{quoted["row_hash"]})'
+
+        try:
+            staging_name = cls._stage_records(records, db, columns, batch_size)
+
+            if use_merge:
+                merge = (
+                    f'MERGE {target} WITH (HOLDLOCK) AS tgt '
+                    f'USING {staging_name} AS src ON tgt.{quoted["id"]} = src.{quoted["id"]} '
+                    + f'WHEN MATCHED AND {changed} '
+                    + f'THEN UPDATE SET {", ".join(f"tgt.{quoted[c]} = src.{quoted[c]}" for c in non_key_columns)} ' 
+                    + f'WHEN NOT MATCHED BY TARGET THEN INSERT ({", ".join(quoted.values())}) VALUES ({", ".join(f"src.{quoted[c]}" for c in columns)}) '
+                    f'OUTPUT $action, inserted.{quoted["id"]};'
+                )
+                for action, record_id in db.execute(text(merge)):
+                    result['inserted' if action == 'INSERT' else 'updated'].append(record_id)
+
+            else:
+                missing = f'NOT EXISTS (SELECT 1 FROM {target} AS tgt WHERE tgt.{quoted["id"]} = src.{quoted["id"]})'
+                result['inserted'] = list(db.scalars(text(f'SELECT src.{quoted["id"]} FROM {staging_name} AS src WHERE {missing}')))
+                result['updated'] = list(db.scalars(text(
+                    f'UPDATE tgt SET {", ".join(f"{quoted[c]} = src.{quoted[c]}" for c in non_key_columns)} OUTPUT inserted.{quoted["id"]} '
+                    f'FROM {target} AS tgt INNER JOIN {staging_name} AS src ON tgt.{quoted["id"]} = src.{quoted["id"]} WHERE {changed}'
+                )))
+                db.execute(text(
+                    f'INSERT INTO {target}{" WITH (TABLOCK)" if table_lock else ""} ({", ".join(quoted.values())}) SELECT {", ".join(f"src.{quoted[c]}" for c in columns)} FROM {staging_name} AS src WHERE {missing}'
+                    + (f' ORDER BY src.{preparer.quote(order_by)}' if order_by else '')
+                ))
+
+            db.execute(text(f'DROP TABLE {staging_name}'))
+
+            written_ids = set(result['inserted']) | set(result['updated'])
+            result['unchanged'] = [rec['id'] for rec in records if rec['id'] not in written_ids]
+
+        except Exception as e:
+            raise UpsertOperationError(f'Ocurrio un error al intentar realizar la operacion de merge en la tabla {cls.__tablename__}: \n {e}')
+
+        return result
+
+    @classmethod
+    def bulk_insert_records(cls, records : List[Dict[str,str]], db : Session, batch_size : Optional[int] = None, order_by : Optional[str] = None, table_lock : bool = True) -> None:
+        """
+        Inserts new records with a single INSERT ... SELECT from a session temp table.
+
+        Used for columnstore and partitioned tables: a statement of at least 102400 rows is compressed straight into
+        rowgroups instead of going through the delta store. With table_lock the insert takes WITH (TABLOCK), which allows
+        a minimally logged, parallel insert but holds an exclusive lock on the table until the transaction commits, so it
+        should only be used when no other session writes the table. The rows are inserted ordered by order_by, the
+        partition column, so each partition and rowgroup receives a contiguous range of it.
+        """
+
+        if not records:
+            return
+
+        columns = [c for c in cls.__table__.columns.keys() if c in records[0]]
+        preparer = db.get_bind().dialect.identifier_preparer
+        target = preparer.format_table(cls.__table__)
+        column_list = ', '.join(preparer.quote(c) for c in columns)
+
+        try:
+            staging_name = cls._stage_records(records, db, columns, batch_size)
+            db.execute(text(
+                f'INSERT INTO {target}{" WITH (TABLOCK)" if table_lock else ""} ({column_list}) SELECT {column_list} FROM {staging_name}'
+                + (f' ORDER BY {preparer.quote(order_by)}' if order_by else '')
+            ))
+            db.execute(text(f'DROP TABLE {staging_name}'))
+        except Exception as e:
+            raise InsertOperationError(f'Ocurrio un error al intentar realizar la operacion de insercion en la tabla {cls.__tablename__}: \n {e}')
+
+    @classmethod
+    def bulk_update_records(cls, records : List[Dict[str,str]], db : Session, batch_size : Optional[int] = None) -> None:
+        """Updates the records with a single UPDATE joined to a session temp table instead of one statement per record."""
+
+        if not records:
+            return
+
+        columns = [c for c in cls.__table__.columns.keys() if c in records[0]]
+        preparer = db.get_bind().dialect.identifier_preparer
+        target = preparer.format_table(cls.__table__)
+        quoted = {c : preparer.quote(c) for c in columns}
+
+        try:
+            staging_name = cls._stage_records(records, db, columns, batch_size)
+            db.execute(text(
+                f'UPDATE tgt SET {", ".join(f"{quoted[c]} = src.{quoted[c]}" for c in columns if c != "id")} '
+                f'FROM {target} AS tgt INNER JOIN {staging_name} AS src ON tgt.{quoted["id"]} = src.{quoted["id"]}'
+            ))
+            db.execute(text(f'DROP TABLE {staging_name}'))
+        except Exception as e:
+            raise UpdateOperationError(f'Ocurrio un error al intentar realizar la operacion de actualizacion en la tabla {cls.__tablename__}: \n {e}')
+
+    @classmethod
+    def _stage_records(cls, records : List[Dict[str,Any]], db : Session, columns : List[str], batch_size : Optional[int] = None) -> str:
+        """Bulk loads the columns of the records into an empty session temp table shaped like the table, returns its name."""
+
+        preparer = db.get_bind().dialect.identifier_preparer
+        staging_name = f'#stg_{cls.__tablename__}'
+        staging = table(staging_name, *[column(c, cls.__table__.c[c].type) for c in columns])
+
+        db.execute(text(f"IF OBJECT_ID('tempdb..{staging_name}') IS NOT NULL DROP TABLE {staging_name}"))
+        db.execute(text(f'SELECT TOP 0 {", ".join(preparer.quote(c) for c in columns)} INTO {staging_name} FROM {preparer.format_table(cls.__table__)}'))
+        for batch in chunked(records, batch_size or len(records)):
+            db.execute(insert(staging), [{c : rec.get(c) for c in columns} for rec in batch])
+
+        return staging_name
+
     @classmethod        
     def classify_records(cls, records: List[Dict[str, str]], db: Session, batch_size: int = 1000) -> Dict[str, List[Dict[str, str]]]:
+        """
+        Splits the records into new records, existing records whose content changed and existing records without changes.
+
+        The row content hash of each record is stored on its row_hash key and compared against the row_hash of the table,
+        rows written before the hash column existed (NULL hash) are always considered modified.
+        """
         new_records = []
         modified_records = []
+        unchanged_records = []
 
         primary_key = 'id'
         ids = [rec[primary_key] for rec in records]
 
-        existing_records_ids = set()
+        existing_hashes = {}
         
         for i in range(0, len(ids), batch_size):
             batch_ids = ids[i:i + batch_size]
-            existing_records = db.query(cls.id).filter(cls.id.in_(batch_ids)).all()
-            existing_records_ids.update({r.id for r in existing_records})
+            existing_records = db.query(cls.id, cls.row_hash).filter(cls.id.in_(batch_ids)).all()
+            existing_hashes.update({r.id : r.row_hash for r in existing_records})
+
+        cls.add_row_hashes(records)
 
         for rec in records:
-            if rec[primary_key] in existing_records_ids:
-                modified_records.append(rec)
-            else:
+            if rec[primary_key] not in existing_hashes:
                 new_records.append(rec)
+            elif existing_hashes[rec[primary_key]] == rec['row_hash']:
+                unchanged_records.append(rec)
+            else:
+                modified_records.append(rec)
 
         return {
             'to_insert': new_records,
-            'to_update': modified_records
+            'to_update': modified_records,
+            'unchanged': unchanged_records
         }
             
             
     @classmethod
-    @abstractmethod
-    def get_last_sync_time(cls, db : Session)-> Union[str,int]:
+    def get_watermark(cls, db : Session) -> int:
+        """
+        Returns the watermark saved on the sync_state table, falling back to a MAX(updated_at_millis) scan for tables without sync state.
+
+        The scan is skipped for tables with partial syncs (sync keys prefixed by the table name, e.g. the responses of a
+        single form), as the rows they wrote may be newer than rows the table never got, which the MAX would skip. Those
+        tables start from 0 until their first full sync saves a watermark.
+        """
+
+        state = SyncState.get(db, cls.__tablename__)
+        if state is not None and state.watermark is not None:
+            return state.watermark
+
+        if SyncState.has_prefix(db, f'{cls.__tablename__}:'):
+            return 0
 
         last_sync = db.query(func.max(cls.updated_at_millis)).scalar()
         
         return last_sync if last_sync else 0
+
+    @classmethod
+    def get_checkpoint(cls, db : Session, sync_key : Optional[str] = None) -> PageCheckpoint:
+        """Returns a pagination checkpoint starting at the cursor of the last unfinished extraction of the table, or of sync_key when given, if any."""
+
+        state = SyncState.get(db, sync_key or cls.__tablename__)
+
+        return PageCheckpoint(state.cursor if state is not None else None)
+
+    @classmethod
+    def save_sync_state(cls, db : Session, watermark : Optional[int], cursor : Optional[int] = None, sync_key : Optional[str] = None) -> None:
+        """
+        Stores the watermark and pagination cursor of the table on the current transaction, so they are committed along with the rows.
+
+        sync_key stores them under a partial sync of the table instead, e.g. the responses of a single form.
+        """
+
+        SyncState.save(db, sync_key or cls.__tablename__, watermark, cursor)
+
+    @classmethod
+    @abstractmethod
+    def get_last_sync_time(cls, db : Session)-> Union[str,int]:
+
+        return cls.get_watermark(db)
     
 
     @classmethod
     @abstractmethod
-    def get_records_to_sync(cls, api_client : InvolvesAPIClient, db: Session) -> List[Dict[str,Any]]:
-        pass     
+    def get_records_to_sync(cls, api_client : InvolvesAPIClient, db: Session, stream : bool = False, checkpoint : Optional[PageCheckpoint] = None) -> Union[List[Dict[str,Any]],Iterator[Dict[str,Any]]]:
+        pass
 
-            
 
+    @classmethod
+    def get_page_mapper(cls) -> PageMapper:
+        """
+        Returns the function mapping a page of API items into rows of the table, compiled once from __fields__ and __explode__.
+
+        Inside a tracked table sync the function is timed on the mapping phase of its metrics.
+        """
+
+        if cls not in _page_mappers:
+            unknown = [c for c in cls.__fields__ if c not in cls.__table__.columns]
+            if unknown:
+                raise ValueError(f'__fields__ de {cls.__name__} contiene columnas que no existen en la tabla {cls.__tablename__}: {unknown}')
+            _page_mappers[cls] = compile_page_mapper(cls.__fields__, explode=cls.__explode__, name=f'map_{cls.__tablename__}')
+
+        return timed_page_func(_page_mappers[cls])
+
+
+    @classmethod
+    def get_fan_out_models(cls) -> List[Type['Base']]:
+        """Returns the models of the tables listed on __fan_out__, which are filled from the same extraction as this model."""
+
+        models = {mapper.class_.__tablename__ : mapper.class_ for mapper in cls.registry.mappers}
+
+        return [models[table] for table in cls.__fan_out__]
+
+    @classmethod
+    def get_tagged_records_to_sync(cls, api_client : InvolvesAPIClient, db : Session, stream : bool = False, checkpoint : Optional[PageCheckpoint] = None) -> Iterable[Tuple[str,Dict[str,Any]]]:
+        """
+        Returns the records to sync as (table name, record) pairs.
+
+        Models with __fan_out__ override this method to extract the records of all their tables in a single pass,
+        by default every record belongs to the model table.
+        """
+
+        return ((cls.__tablename__, record) for record in cls.get_records_to_sync(api_client, db, stream=stream, checkpoint=checkpoint))
+
+
+@Base.registry.mapped
+class SyncState:
+    """
+    Sync progress of each table.
+
+    watermark is the updated_at_millis the next extraction starts from, it only advances once an extraction finished.
+    cursor is the pagination cursor (timestampLastItem or page number) of the last committed page of an unfinished
+    extraction, which the next run resumes from.
+    """
+
+    __tablename__ = 'sync_state'
+
+    sync_key : Mapped[str] = mapped_column(String(100), primary_key=True)
+    watermark : Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+    cursor : Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+    updated_at : Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+
+    @classmethod
+    def get(cls, db : Session, sync_key : str) -> Optional['SyncState']:
+        return db.get(cls, sync_key)
+
+    @classmethod
+    def has_prefix(cls, db : Session, prefix : str) -> bool:
+        """Returns whether any sync key starts with prefix."""
+
+        return db.query(cls.sync_key).filter(cls.sync_key.startswith(prefix, autoescape=True)).first() is not None
+
+    @classmethod
+    def save(cls, db : Session, sync_key : str, watermark : Optional[int], cursor : Optional[int] = None) -> None:
+
+        state = db.get(cls, sync_key)
+        if state is None:
+            state = cls(sync_key=sync_key)
+            db.add(state)
+
+        state.watermark = watermark
+        state.cursor = cursor
+        state.updated_at = datetime.now()
+
+
+@Base.registry.mapped
+class SyncChangeLog:
+    """
+    Rows written by the syncs, one entry per inserted or updated record.
+
+    run_id is the flow run that wrote the row and row_hash the content hash it was written with, so the changes of a run
+    can be audited or joined back to the tables without storing the records again.
+    """
+
+    __tablename__ = 'sync_change_log'
+    __table_args__ = (Index('ix_sync_change_log_run_table', 'run_id', 'table_name'),)
+
+    log_id : Mapped[int] = mapped_column(BigInteger().with_variant(Integer, 'sqlite'), primary_key=True, autoincrement=True)
+    run_id : Mapped[str] = mapped_column(String(64))
+    table_name : Mapped[str] = mapped_column(String(100))
+    record_id : Mapped[int] = mapped_column(BigInteger)
+    operation : Mapped[str] = mapped_column(String(10))
+    row_hash : Mapped[Optional[str]] = mapped_column(String(32), nullable=True)
+    synced_at_millis : Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+
+    @classmethod
+    def write(cls, db : Session, entries : List[Dict[str,Any]], batch_size : Optional[int] = None) -> None:
+        """Inserts the entries with one executemany per batch of batch_size entries, all at once when batch_size is not provided."""
 
+        for batch in chunked(entries, batch_size or len(entries) or 1):
+            db.execute(insert(cls), batch)
@@ -0,0 +1,86 @@
+from sqlalchemy.orm import Session
+from typing import Dict, Any, List, Optional, Type
+import logging
+import uuid
+import orjson
+from prefect.artifacts import create_table_artifact
+from prefect.runtime import flow_run
+from .base import Base, SyncChangeLog
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SAMPLE_SIZE = 20
+OPERATIONS = ('insert', 'update')
+
+
+def get_run_id() -> str:
+    """Returns the id of the current flow run, a random id outside a flow run."""
+
+    return str(flow_run.id or uuid.uuid4())
+
+
+class ChangeLog:
+    """
+    Changes written by a table sync.
+
+    record() stores an entry per written record on sync_change_log, in the transaction of the chunk, and keeps the
+    counts and the first sample_size records of each table and operation. create_artifacts() publishes those samples
+    as a table artifact per table instead of every changed record, the full list of the run stays on sync_change_log.
+    The artifact keys carry the environment of the changes when given, so the environments synced by the same flow run
+    do not overwrite each other's artifacts.
+    """
+
+    def __init__(self, run_id : Optional[str] = None, sample_size : int = DEFAULT_SAMPLE_SIZE, batch_size : Optional[int] = None, environment : str = ''):
+
+        self.run_id = run_id or get_run_id()
+        self.environment = environment
+        self.sample_size = sample_size
+        self.batch_size = batch_size
+        self.counts : Dict[str, Dict[str,int]] = {}
+        self.samples : Dict[str, Dict[str, List[Dict[str,Any]]]] = {}
+
+    def record(self, model : Type[Base], db : Session, operation : str, records : List[Dict[str,Any]]) -> None:
+        """Writes the change log entries of records, which were written to the model table with operation ('insert' or 'update')."""
+
+        if not records:
+            return
+
+        table_name = model.__tablename__
+        entries = [
+            {
+                'run_id' : self.run_id,
+                'table_name' : table_name,
+                'record_id' : rec['id'],
+                'operation' : operation,
+                'row_hash' : rec.get('row_hash'),
+                'synced_at_millis' : rec.get('synced_at_millis')
+            }
+            for rec in records
+        ]
+        SyncChangeLog.write(db, entries, self.batch_size)
+
+        counts = self.counts.setdefault(table_name, dict.fromkeys(OPERATIONS, 0))
+        counts[operation] += len(records)
+
+        sample = self.samples.setdefault(table_name, {op : [] for op in OPERATIONS})[operation]
+        if len(sample) < self.sample_size:
+            sample.extend(records[:self.sample_size - len(sample)])
+
+    def get_summary(self) -> Dict[str, Dict[str,int]]:
+        return {table : dict(counts) for table, counts in self.counts.items()}
+
+    def create_artifacts(self) -> None:
+        """Creates a table artifact per changed table with the sampled records of each operation, nothing when sample_size is 0."""
+
+        if not self.sample_size:
+            return
+
+        for table_name, samples in self.samples.items():
+            counts = self.counts[table_name]
+            rows = [{'operacion' : operation, **rec} for operation in OPERATIONS for rec in samples[operation]]
+            description = (
+                f'tabla {table_name} : {counts["insert"]} registros insertados, {counts["update"]} registros actualizados. '
+                f'Muestra de hasta {self.sample_size} registros por operacion, el detalle de la ejecucion {self.run_id} esta en la tabla {SyncChangeLog.__tablename__}.'
+            )
+            key = f'cambios-{self.environment}-{table_name}' if self.environment else f'cambios-{table_name}'
+            create_table_artifact(orjson.loads(orjson.dumps(rows)), key=key.replace('_', '-'), description=description)
@@ -4,8 +4,14 @@ class InsertOperationError(Exception):
 class UpdateOperationError(Exception):
     pass
 
+class UpsertOperationError(Exception):
+    pass
+
 class SQLEngineError(Exception):
     pass
 
 class SyncError(Exception):
     pass
+
+class FilterNotSupportedError(Exception):
+    pass
@@ -0,0 +1,237 @@
+from sqlalchemy import select, func, or_
+from sqlalchemy.orm import Session
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Type, Iterable
+import hashlib
+import json
+import logging
+import os
+from .base import Base
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN_HASH = 0
+SNAPSHOT_VERSION = 1
+
+
+def hash_key(row_hash : Optional[str]) -> int:
+    """Reduces a row_hash hex digest to the signed 64 bit integer stored on the index, NULL hashes map to UNKNOWN_HASH."""
+
+    if not row_hash:
+        return UNKNOWN_HASH
+
+    key = int(row_hash[:16], 16)
+    key = key - (1 << 64) if key >= (1 << 63) else key
+
+    return key or 1
+
+
+class TableIndex:
+    """
+    Compact in-memory index of the ids and row hashes of a table, used to classify records without querying the database.
+
+    The ids are kept on a sorted array('q') with a parallel array of 64 bit hash prefixes, so the index costs 16 bytes
+    per row. Rows written during the run go to a small overlay dict that is merged into the arrays by compact().
+    The index can be saved to a snapshot file and reloaded on the next run, refreshing only the rows updated after the
+    watermark of the snapshot.
+    """
+
+    def __init__(self, table_name : str, ids : Optional[array] = None, hashes : Optional[array] = None, watermark : int = 0):
+
+        self.table_name = table_name
+        self.ids = ids if ids is not None else array('q')
+        self.hashes = hashes if hashes is not None else array('q')
+        self.watermark = watermark
+        self.overlay : Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.ids) + sum(1 for record_id in self.overlay if self._find(record_id) is None)
+
+    def __contains__(self, record_id : int) -> bool:
+        return record_id in self.overlay or self._find(record_id) is not None
+
+    def _find(self, record_id : int) -> Optional[int]:
+
+        position = bisect_left(self.ids, record_id)
+
+        if position < len(self.ids) and self.ids[position] == record_id:
+            return position
+
+        return None
+
+    def get_hash(self, record_id : int) -> Optional[int]:
+        """Returns the hash key stored for record_id, None when the id is not on the table."""
+
+        if record_id in self.overlay:
+            return self.overlay[record_id]
+
+        position = self._find(record_id)
+
+        return self.hashes[position] if position is not None else None
+
+    def update(self, records : Iterable[Dict[str,Any]]) -> None:
+        """Registers records written to the table, keeping the index consistent with the rows of the current transaction."""
+
+        for rec in records:
+            self.overlay[rec['id']] = hash_key(rec.get('row_hash'))
+            updated_at_millis = rec.get('updated_at_millis')
+            if isinstance(updated_at_millis, int) and updated_at_millis > self.watermark:
+                self.watermark = updated_at_millis
+
+        if len(self.overlay) > max(100000, len(self.ids) // 4):
+            self.compact()
+
+    def compact(self) -> None:
+        """
+        Merges the overlay into the sorted arrays.
+
+        The hashes of the ids already on the arrays are replaced in place and the new ids are merged in a single linear
+        pass over the arrays, copying the runs between them, so only the new arrays are allocated.
+        """
+
+        if not self.overlay:
+            return
+
+        new_ids = []
+        for record_id, hash_value in self.overlay.items():
+            position = self._find(record_id)
+            if position is None:
+                new_ids.append(record_id)
+            else:
+                self.hashes[position] = hash_value
+
+        if new_ids:
+
+            new_ids.sort()
+            ids = array('q')
+            hashes = array('q')
+            start = 0
+
+            for record_id in new_ids:
+                position = bisect_left(self.ids, record_id, start)
+                ids.extend(self.ids[start:position])
+                hashes.extend(self.hashes[start:position])
+                ids.append(record_id)
+                hashes.append(self.overlay[record_id])
+                start = position
+
+            ids.extend(self.ids[start:])
+            hashes.extend(self.hashes[start:])
+            self.ids = ids
+            self.hashes = hashes
+
+        self.overlay = {}
+
+    @classmethod
+    def load(cls, model : Type[Base], db : Session, snapshot_dir : Optional[str] = None, batch_size : int = 50000) -> 'TableIndex':
+        """
+        Builds the index of a model table.
+
+        When a snapshot of the table exists on snapshot_dir only the rows updated after its watermark, or without an update
+        timestamp, are read, and the snapshot is kept if its size matches the table row count. Otherwise the ids and
+        hashes of the whole table are read with a single streaming scan ordered by id.
+        """
+
+        table_name = model.__tablename__
+        index = cls.load_snapshot(cls.get_snapshot_path(snapshot_dir, model, db)) if snapshot_dir else None
+
+        if index is not None:
+            statement = select(model.id, model.row_hash, model.updated_at_millis).where(or_(model.updated_at_millis >= index.watermark, model.updated_at_millis.is_(None)))
+            rows = db.execute(statement.execution_options(yield_per=batch_size))
+            index.update({'id' : r.id, 'row_hash' : r.row_hash, 'updated_at_millis' : r.updated_at_millis} for r in rows)
+            index.compact()
+            if db.scalar(select(func.count(model.id))) == len(index.ids):
+                logger.info(f'index of table {table_name} loaded from snapshot with {len(index)} ids.')
+                return index
+            logger.warning(f'index snapshot of table {table_name} does not match the table row count and will be rebuilt.')
+
+        ids = array('q')
+        hashes = array('q')
+        watermark = 0
+
+        statement = select(model.id, model.row_hash, model.updated_at_millis).order_by(model.id)
+        for r in db.execute(statement.execution_options(yield_per=batch_size)):
+            ids.append(r.id)
+            hashes.append(hash_key(r.row_hash))
+            if r.updated_at_millis and r.updated_at_millis > watermark:
+                watermark = r.updated_at_millis
+
+        logger.info(f'index of table {table_name} built with {len(ids)} ids.')
+
+        return cls(table_name, ids, hashes, watermark)
+
+    @staticmethod
+    def get_snapshot_path(snapshot_dir : str, model : Type[Base], db : Session) -> Path:
+        """Returns the snapshot file of the table, named after the database and a digest of its URL so databases of the same name on other servers do not share it."""
+
+        url = db.get_bind().url
+        database = Path(url.database or 'default').name
+        digest = hashlib.sha1(url.render_as_string(hide_password=True).encode()).hexdigest()[:12]
+
+        return Path(snapshot_dir) / f'{database}.{digest}.{model.__tablename__}.idx'
+
+    def save(self, path : Path) -> None:
+        """Writes the index to path atomically, as a JSON header line followed by the raw id and hash arrays."""
+
+        self.compact()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_suffix('.tmp')
+
+        header = {'version' : SNAPSHOT_VERSION, 'table' : self.table_name, 'count' : len(self.ids), 'watermark' : self.watermark}
+
+        with open(temp_path, 'wb') as f:
+            f.write(json.dumps(header).encode() + b'\n')
+            self.ids.tofile(f)
+            self.hashes.tofile(f)
+
+        os.replace(temp_path, path)
+        logger.info(f'index snapshot of table {self.table_name} saved at {path}.')
+
+    @classmethod
+    def load_snapshot(cls, path : Path) -> Optional['TableIndex']:
+        """Reads a snapshot written by save, returns None when the file does not exist or cannot be read."""
+
+        if not path.exists():
+            return None
+
+        try:
+            with open(path, 'rb') as f:
+                header = json.loads(f.readline())
+                if header.get('version') != SNAPSHOT_VERSION:
+                    return None
+                ids = array('q')
+                hashes = array('q')
+                ids.fromfile(f, header['count'])
+                hashes.fromfile(f, header['count'])
+        except Exception as e:
+            logger.warning(f'index snapshot {path} could not be read and will be rebuilt : {e}')
+            return None
+
+        return cls(header['table'], ids, hashes, header['watermark'])
+
+
+def classify_with_index(model : Type[Base], records : List[Dict[str,Any]], index : TableIndex) -> Dict[str, List[Dict[str,Any]]]:
+    """Same classification as Base.classify_records, resolved with lookups on the table index instead of database queries."""
+
+    new_records = []
+    modified_records = []
+    unchanged_records = []
+
+    model.add_row_hashes(records)
+
+    for rec in records:
+        stored_hash = index.get_hash(rec['id'])
+        if stored_hash is None:
+            new_records.append(rec)
+        elif stored_hash != UNKNOWN_HASH and stored_hash == hash_key(rec['row_hash']):
+            unchanged_records.append(rec)
+        else:
+            modified_records.append(rec)
+
+    return {
+        'to_insert': new_records,
+        'to_update': modified_records,
+        'unchanged': unchanged_records
+    }
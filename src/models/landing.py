@@ -0,0 +1,179 @@
+from sqlalchemy.types import Date, DateTime
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Type, Iterable, Iterator, Tuple, Callable
+import gzip
+import itertools
+import logging
+import os
+import uuid
+import orjson
+from involves_api.fields import to_date, to_datetime
+from .base import Base
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = '_manifest.json'
+DEFAULT_ROWS_PER_FILE = 100000
+
+
+class LandingWriter:
+    """Writes the records of a table to the gzip NDJSON part files of a partition, the manifest is written on close so unfinished partitions are never loaded."""
+
+    def __init__(self, partition : Path, rows_per_file : int = DEFAULT_ROWS_PER_FILE):
+
+        self.partition = partition
+        self.rows_per_file = rows_per_file
+        self.rows = 0
+        self.files : List[str] = []
+        self._file = None
+        self._file_rows = 0
+
+        partition.mkdir(parents=True, exist_ok=True)
+        (partition / MANIFEST_NAME).unlink(missing_ok=True)
+
+    def write(self, records : Iterable[Dict[str,Any]]) -> None:
+
+        for record in records:
+            if self._file is None or self._file_rows >= self.rows_per_file:
+                self._rotate()
+            self._file.write(orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE))
+            self._file_rows += 1
+            self.rows += 1
+
+    def _rotate(self) -> None:
+
+        self._close_file()
+        name = f'part-{len(self.files):05d}.ndjson.gz'
+        self._file = gzip.open(self.partition / f'{name}.tmp', 'wb', compresslevel=1)
+        self._file_rows = 0
+        self.files.append(name)
+
+    def _close_file(self) -> None:
+
+        if self._file is not None:
+            self._file.close()
+            name = self.files[-1]
+            os.replace(self.partition / f'{name}.tmp', self.partition / name)
+            self._file = None
+
+    def close(self) -> None:
+
+        self._close_file()
+        manifest = {'rows' : self.rows, 'files' : self.files, 'written_at' : datetime.now().isoformat()}
+        (self.partition / MANIFEST_NAME).write_bytes(orjson.dumps(manifest))
+
+    def abort(self) -> None:
+        """Closes the open file without writing the manifest, the partition is ignored by the readers."""
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class LandingZone:
+    """
+    Local landing stage of the extracted records, stored as gzip compressed NDJSON files.
+
+    Each run spools the mapped records of every table to {directory}/{table}/run={run_id}/wm={watermark}/, where
+    watermark is the table watermark the extraction started from, and the database load then reads them back from
+    the files. A partition is complete once its manifest is written. Replaying a run (replay=True) loads the files of
+    that run again without requesting the API, e.g. after a failed load, a schema change or on a new database.
+    """
+
+    def __init__(self, directory : str, run_id : Optional[str] = None, replay : bool = False, rows_per_file : int = DEFAULT_ROWS_PER_FILE):
+
+        self.directory = Path(directory)
+        self.run_id = run_id or self.new_run_id()
+        self.replay = replay
+        self.rows_per_file = rows_per_file
+
+    @classmethod
+    def for_replay(cls, directory : str, run_id : str) -> 'LandingZone':
+        """Returns the landing zone of a previous run, run_id 'latest' selects the last run stored on directory."""
+
+        if run_id == 'latest':
+            runs = cls.list_runs(directory)
+            if not runs:
+                raise FileNotFoundError(f'no landed runs found at {directory}')
+            run_id = runs[-1]
+
+        logger.info(f'replaying landed run {run_id} from {directory}.')
+
+        return cls(directory, run_id, replay=True)
+
+    @staticmethod
+    def new_run_id() -> str:
+        return f'{datetime.now():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}'
+
+    @staticmethod
+    def list_runs(directory : str) -> List[str]:
+        """Returns the ids of the runs stored on directory, oldest first."""
+
+        return sorted({path.name.split('=', 1)[1] for path in Path(directory).glob('*/run=*')})
+
+    def get_partition(self, table_name : str, watermark : int) -> Path:
+        return self.directory / table_name / f'run={self.run_id}' / f'wm={watermark}'
+
+    def get_partitions(self, table_name : str) -> List[Path]:
+        """Returns the complete partitions of the table on this run, ordered by watermark."""
+
+        partitions = [path.parent for path in (self.directory / table_name / f'run={self.run_id}').glob(f'wm=*/{MANIFEST_NAME}')]
+
+        return sorted(partitions, key=lambda path: int(path.name.split('=', 1)[1]))
+
+    def spool(self, records : Iterable[Tuple[str,Dict[str,Any]]], watermarks : Dict[str,int]) -> Dict[str,int]:
+        """Writes the tagged records to a partition of each table, returns the number of records landed by table."""
+
+        writers = {table : LandingWriter(self.get_partition(table, watermark), self.rows_per_file) for table, watermark in watermarks.items()}
+
+        try:
+            for table, record in records:
+                writers[table].write((record,))
+        except BaseException:
+            for writer in writers.values():
+                writer.abort()
+            raise
+
+        for writer in writers.values():
+            writer.close()
+
+        landed = {table : writer.rows for table, writer in writers.items()}
+        logger.info(f'run {self.run_id} landed at {self.directory} : {landed}')
+
+        return landed
+
+    def iter_records(self, model : Type[Base]) -> Iterator[Dict[str,Any]]:
+        """Reads back the landed records of the model table, restoring the date and datetime values serialized as ISO strings."""
+
+        converters = get_converters(model)
+
+        for partition in self.get_partitions(model.__tablename__):
+            manifest = orjson.loads((partition / MANIFEST_NAME).read_bytes())
+            for name in manifest['files']:
+                with gzip.open(partition / name, 'rb') as f:
+                    for line in f:
+                        record = orjson.loads(line)
+                        for column, convert in converters:
+                            if record.get(column) is not None:
+                                record[column] = convert(record[column])
+                        yield record
+
+    def iter_tagged_records(self, models : Dict[str, Type[Base]]) -> Iterator[Tuple[str,Dict[str,Any]]]:
+        """Reads back the landed records of several tables as (table name, record) pairs, one table after the other."""
+
+        return itertools.chain.from_iterable(
+            ((table, record) for record in self.iter_records(model)) for table, model in models.items()
+            )
+
+
+def get_converters(model : Type[Base]) -> List[Tuple[str, Callable[[Any],Any]]]:
+    """Returns the columns of the model whose values have to be parsed back from their JSON representation."""
+
+    converters = []
+    for column in model.__table__.columns:
+        if isinstance(column.type, DateTime):
+            converters.append((column.key, to_datetime))
+        elif isinstance(column.type, Date):
+            converters.append((column.key, to_date))
+    return converters
@@ -1,13 +1,18 @@
-from typing import Any, Dict, List, Union
-from .base import Base
+from typing import Any, Callable, Dict, List, Union, Iterator, Iterable, Tuple, Optional
+from .base import Base, SyncState
 from sqlalchemy.orm import Session
-from sqlalchemy import func
 import sqlalchemy.types as types
-from sqlalchemy import Column
+from sqlalchemy import Column, Index, or_, func
 from sqlalchemy.types import Integer,String,Boolean, Date,DateTime, Float, BigInteger
 from involves_api.client import InvolvesAPIClient
-from enum import Enum
+from involves_api.checkpoint import PageCheckpoint
+from involves_api.fields import Field
+from .exceptions import FilterNotSupportedError
 from datetime import datetime, timedelta
+from enum import Enum
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 class CustomString(types.TypeDecorator):
@@ -31,9 +36,10 @@ class CustomString(types.TypeDecorator):
 
 class Visit(Base):
     __tablename__ =  "visit"
+    __partition_column__ = 'visit_date'
 
-    employee_id = Column(Integer)
-    point_of_sale_id = Column(Integer)
+    employee_id = Column(Integer, index=True)
+    point_of_sale_id = Column(Integer, index=True)
     visit_date = Column(Date)
     visit_type = Column(String)
     visit_status = Column(String)
@@ -44,15 +50,32 @@ class Visit(Base):
     visit_duration_manual = Column(Integer)
     visit_duration_gps = Column(Integer)
     is_deleted = Column(Boolean)
-    updated_at_millis = Column(Integer)
+    updated_at_millis = Column(BigInteger, index=True)
+
+    __fields__ = {
+        'id' : 'id',
+        'employee_id' : 'employee.id',
+        'point_of_sale_id' : 'pointOfSale.id',
+        'visit_date' : Field('visitDate', 'date'),
+        'visit_type' : 'type',
+        'visit_status' : 'status',
+        'manual_entry_date' : Field('entryDateManualCheckin', 'datetime'),
+        'manual_exit_date' : Field('exitDateManualCheckin', 'datetime'),
+        'gps_entry_date' : Field('entryDateGPSCheckin', 'datetime'),
+        'gps_exit_date' : Field('exitDateGPSCheckin', 'datetime'),
+        'visit_duration_manual' : 'visitDurationCheckinManual',
+        'visit_duration_gps' : 'visitDurationCheckinGPS',
+        'updated_at_millis' : 'updatedAtMillis',
+        'is_deleted' : 'deleted'
+    }
 
     @classmethod
     def get_last_sync_time(cls, db: Session):
         return super().get_last_sync_time(db)
         
     @classmethod    
-    def get_records_to_sync(cls, api_client : InvolvesAPIClient, db: Session) -> List[Dict[str, Any]]:
-        return api_client.get_updated_visits(start_millis=cls.get_last_sync_time(db))
+    def get_records_to_sync(cls, api_client : InvolvesAPIClient, db: Session, stream : bool = False, checkpoint : Optional[PageCheckpoint] = None) -> Union[List[Dict[str, Any]],Iterator[Dict[str, Any]]]:
+        return api_client.get_updated_visits(start_millis=cls.get_last_sync_time(db), stream=stream, checkpoint=checkpoint, page_func=cls.get_page_mapper())
 
 
 class PointOfSale(Base):
@@ -73,15 +96,35 @@ class PointOfSale(Base):
     zip_code = Column(String)
     is_enabled = Column(Boolean)
     is_deleted = Column(Boolean)
-    updated_at_millis = Column(BigInteger)
+    updated_at_millis = Column(BigInteger, index=True)
+
+    __fields__ = {
+        'id' : 'id',
+        'point_of_sale_base_id' : 'pointOfSaleBaseId',
+        'point_of_sale_name' : 'name',
+        'chain' : 'chain.name',
+        'chain_group' : 'chain.chainGroup.name',
+        'channel' : 'pointOfSaleChannel.name',
+        'point_of_sale_code' : 'code',
+        'region' : 'region.name',
+        'macro_region' : 'region.macroRegion.name',
+        'point_of_sale_type' : 'pointOfSaleType.name',
+        'point_of_sale_profile' : 'pointOfSaleProfile.name',
+        'latitude' : 'address.latitude',
+        'longitude' : 'address.longitude',
+        'zip_code' : 'address.zipCode',
+        'is_enabled' : 'enabled',
+        'is_deleted' : 'deleted',
+        'updated_at_millis' : 'updatedAtMillis'
+    }
 
     @classmethod
     def get_last_sync_time(cls, db: Session) -> Union[str,int]:
         return super().get_last_sync_time(db)
     
     @classmethod
-    def get_records_to_sync(cls,api_client : InvolvesAPIClient, db: Session) -> List[Dict[str, Any]]:
-        return api_client.get_updated_points_of_sale(start_millis=cls.get_last_sync_time(db))
+    def get_records_to_sync(cls,api_client : InvolvesAPIClient, db: Session, stream : bool = False, checkpoint : Optional[PageCheckpoint] = None) -> Union[List[Dict[str, Any]],Iterator[Dict[str, Any]]]:
+        return api_client.get_updated_points_of_sale(start_millis=cls.get_last_sync_time(db), stream=stream, checkpoint=checkpoint, page_func=cls.get_page_mapper())
 
 class Employee(Base):
     __tablename__ = "employee"
@@ -92,15 +135,26 @@ class Employee(Base):
     user_group = Column(String)
     leader_name = Column(String)
     is_enabled = Column(String)
-    updated_at_millis = Column(BigInteger)
+    updated_at_millis = Column(BigInteger, index=True)
+
+    __fields__ = {
+        'id' : 'id',
+        'employee_name' : 'name',
+        'employee_code' : 'nationalIdCard2',
+        'is_field_team' : 'fieldTeam',
+        'user_group' : 'userGroup.name',
+        'leader_name' : 'employeeEnvironmentLeader.name',
+        'is_enabled' : 'enabled',
+        'updated_at_millis' : 'userUpdatedAtMillis'
+    }
 
     @classmethod
     def get_last_sync_time(cls, db: Session) -> Union[str,int]:
         return super().get_last_sync_time(db)
     
     @classmethod
-    def get_records_to_sync(cls, api_client : InvolvesAPIClient, db: Session) -> List[Dict[str, Any]]:
-        return api_client.get_updated_employees(millis=cls.get_last_sync_time(db))
+    def get_records_to_sync(cls, api_client : InvolvesAPIClient, db: Session, stream : bool = False, checkpoint : Optional[PageCheckpoint] = None) -> Union[List[Dict[str, Any]],Iterator[Dict[str, Any]]]:
+        return api_client.get_updated_employees(millis=cls.get_last_sync_time(db), stream=stream, checkpoint=checkpoint, page_func=cls.get_page_mapper())
 
 
 class Product(Base):
@@ -111,19 +165,30 @@ class Product(Base):
     product_line = Column(String)
     is_active = Column(Boolean)
     is_deleted = Column(Boolean)
-    updated_at_millis = Column(BigInteger)
+    updated_at_millis = Column(BigInteger, index=True)
+
+    __fields__ = {
+        'id' : 'id',
+        'product_name' : 'name',
+        'bar_code' : 'barCode',
+        'product_line' : 'productLine.name',
+        'is_active' : 'active',
+        'is_deleted' : 'deleted',
+        'updated_at_millis' : 'updatedAtMillis'
+    }
 
     @classmethod
     def get_last_sync_time(cls, db: Session) -> Union[str,int]:
         return super().get_last_sync_time(db)
     
     @classmethod
-    def get_records_to_sync(cls, api_client: InvolvesAPIClient, db: Session) -> List[Dict[str, Any]]:
-        return api_client.get_updated_products(start_millis=cls.get_last_sync_time(db))
+    def get_records_to_sync(cls, api_client: InvolvesAPIClient, db: Session, stream : bool = False, checkpoint : Optional[PageCheckpoint] = None) -> Union[List[Dict[str, Any]],Iterator[Dict[str, Any]]]:
+        return api_client.get_updated_products(start_millis=cls.get_last_sync_time(db), stream=stream, checkpoint=checkpoint, page_func=cls.get_page_mapper())
 
 
 class Form(Base):
     __tablename__ = "form"
+    __fan_out__ = ('form_field',)
 
     form_name = Column(String)
     is_active = Column(Boolean)
@@ -131,83 +196,248 @@ class Form(Base):
     form_purpose = Column(String)
     requires_check_in = Column(Boolean)
     requires_point_of_sale = Column(Boolean)
-    updated_at_millis = Column(BigInteger)
+    updated_at_millis = Column(BigInteger, index=True)
+
+    __fields__ = {
+        'id' : 'id',
+        'form_name' : 'name',
+        'is_active' : 'active',
+        'is_deleted' : 'deleted',
+        'form_purpose' : 'formPurpose',
+        'requires_check_in' : 'checkinRequired',
+        'requires_point_of_sale' : 'pointOfSaleRequired',
+        'updated_at_millis' : 'updatedAtMillis'
+    }
 
     @classmethod
     def get_last_sync_time(cls, db: Session) -> Union[str,int]:
         return super().get_last_sync_time(db)
     
     @classmethod
-    def get_records_to_sync(cls, api_client: InvolvesAPIClient, db: Session) -> List[Dict[str, Any]]:
-        return api_client.get_updated_forms(millis = cls.get_last_sync_time(db))
+    def get_records_to_sync(cls, api_client: InvolvesAPIClient, db: Session, stream : bool = False, checkpoint : Optional[PageCheckpoint] = None) -> Union[List[Dict[str, Any]],Iterator[Dict[str, Any]]]:
+        return api_client.get_updated_forms(millis = cls.get_last_sync_time(db), stream=stream, checkpoint=checkpoint, page_func=cls.get_page_mapper())
+
+    @classmethod
+    def get_tagged_records_to_sync(cls, api_client: InvolvesAPIClient, db: Session, stream : bool = False, checkpoint : Optional[PageCheckpoint] = None) -> Iterable[Tuple[str, Dict[str, Any]]]:
+        last_sync = min(cls.get_last_sync_time(db), FormField.get_last_sync_time(db))
+        return api_client.get_updated_forms_with_fields(millis = last_sync, stream=stream, checkpoint=checkpoint, page_funcs={cls.__tablename__ : cls.get_page_mapper(), FormField.__tablename__ : FormField.get_page_mapper()})
+
+    @classmethod
+    def get_active_ids(cls, db: Session) -> List[int]:
+        """Returns the ids of the active forms that are not deleted."""
+
+        return [row.id for row in db.query(cls.id).filter(cls.is_active.is_(True), or_(cls.is_deleted.is_(False), cls.is_deleted.is_(None))).order_by(cls.id)]
 
 
 class FormField(Base):
     __tablename__ = "form_field"
+    __depends_on__ = ('form',)
 
-    form_id = Column(Integer)
+    form_id = Column(Integer, index=True)
     field_name = Column(String)
     field_description = Column(String)
     field_order = Column(Integer)
     is_deleted = Column(Boolean)
     is_required = Column(Boolean)   
 
+    __explode__ = 'formFields'
+    __fields__ = {
+        'id' : 'id',
+        'form_id' : '^id',
+        'field_name' : 'information.label',
+        'field_description' : 'information.alternativeLabel',
+        'field_order' : 'order',
+        'is_deleted' : 'deleted',
+        'is_required' : 'required',
+        'updated_at_millis' : '^updatedAtMillis'
+    }
+
     @classmethod
     def get_last_sync_time(cls, db: Session) -> Union[str,int]:
         return super().get_last_sync_time(db)
     
     @classmethod
-    def get_records_to_sync(cls, api_client: InvolvesAPIClient, db: Session) -> List[Dict[str, Any]]:
-        return api_client.get_updated_form_fields(millis = cls.get_last_sync_time(db))
+    def get_records_to_sync(cls, api_client: InvolvesAPIClient, db: Session, stream : bool = False, checkpoint : Optional[PageCheckpoint] = None) -> Union[List[Dict[str, Any]],Iterator[Dict[str, Any]]]:
+        return api_client.get_updated_form_fields(millis = cls.get_last_sync_time(db), stream=stream, checkpoint=checkpoint, page_func=cls.get_page_mapper())
 
 
 
 class FormResponse(Base):
     __tablename__ = "form_response"
+    __depends_on__ = ('form',)
+    __table_args__ = (Index('ix_form_response_form_id_updated_at_millis', 'form_id', 'updated_at_millis'),)
+    __partition_column__ = 'replied_at'
 
-    survey_id = Column(Integer)
+    survey_id = Column(Integer, index=True)
     replied_at = Column(DateTime)
     time_spent = Column(BigInteger)
     form_id = Column(Integer)
-    form_field_id = Column(Integer)
-    employee_id = Column(Integer)
-    point_of_sale_id = Column(Integer)
-    product_id = Column(Integer)
+    form_field_id = Column(Integer, index=True)
+    employee_id = Column(Integer, index=True)
+    point_of_sale_id = Column(Integer, index=True)
+    product_id = Column(Integer, index=True)
     response_value = Column(CustomString)
     is_deleted = Column(Boolean)
-    updated_at_millis = Column(BigInteger)
+    updated_at_millis = Column(BigInteger, index=True)
+
+    __explode__ = 'surveyData'
+    __fields__ = {
+        'id' : 'id',
+        'survey_id' : '^id',
+        'replied_at' : Field('^repliedAt', 'datetime'),
+        'time_spent' : '^timeSpent',
+        'form_id' : '^form.id',
+        'form_field_id' : 'formField.id',
+        'employee_id' : '^assignedTo.id',
+        'point_of_sale_id' : '^pointOfSale.id',
+        'product_id' : 'sku.id',
+        'response_value' : Field('value', empty_as_null=True),
+        'is_deleted' : '^deleted',
+        'updated_at_millis' : '^updatedAtMillis'
+    }
 
     @classmethod
     def get_last_sync_time(cls, db: Session) -> Union[str,int]:
         return super().get_last_sync_time(db)
     
     @classmethod
-    def get_records_to_sync(cls, api_client: InvolvesAPIClient, db: Session) -> List[Dict[str, Any]]:
-        return api_client.get_updated_form_responses(start_millis = cls.get_last_sync_time(db))
+    def get_records_to_sync(cls, api_client: InvolvesAPIClient, db: Session, stream : bool = False, checkpoint : Optional[PageCheckpoint] = None) -> Union[List[Dict[str, Any]],Iterator[Dict[str, Any]]]:
+        return api_client.get_updated_form_responses(start_millis = cls.get_last_sync_time(db), stream=stream, checkpoint=checkpoint, page_func=cls.get_page_mapper())
+
+    @staticmethod
+    def get_form_sync_key(form_id : int) -> str:
+        """Returns the sync_state key of the responses of a form, which keep their own watermark apart from the table one."""
+
+        return f'{FormResponse.__tablename__}:form={form_id}'
+
+    @classmethod
+    def get_form_watermark(cls, db: Session, form_id : int) -> int:
+        """
+        Returns the watermark of the responses of a form.
+
+        A form never synced on its own starts from the watermark saved by the last full sync of the table, below which
+        every response is already stored, or from 0. The MAX(updated_at_millis) of the rows of the form is not used, as
+        the rows of a sharded or interrupted sync are not a prefix of the survey chain.
+        """
+
+        for sync_key in (cls.get_form_sync_key(form_id), cls.__tablename__):
+            state = SyncState.get(db, sync_key)
+            if state is not None and state.watermark is not None:
+                return state.watermark
+
+        return 0
+
+    @staticmethod
+    def get_form_page_checker(form_id : int, page_func : Callable[[List[Dict[str,Any]]], List[Dict[str,Any]]]) -> Callable[[List[Dict[str,Any]]], List[Dict[str,Any]]]:
+        """Wraps page_func to raise FilterNotSupportedError on a page with surveys of other forms, i.e. when the API ignored the formId filter."""
+
+        def map_form_page(items : List[Dict[str,Any]]) -> List[Dict[str,Any]]:
+            other_forms = {(item.get('form') or {}).get('id') for item in items} - {form_id}
+            if other_forms:
+                raise FilterNotSupportedError(f'the survey endpoint ignored the formId filter, the responses of form {form_id} came with surveys of the forms {sorted(other_forms, key=str)[:10]}')
+            return page_func(items)
+
+        return map_form_page
+
+    @classmethod
+    def is_form_filter_supported(cls, api_client: InvolvesAPIClient, form_id : int) -> bool:
+        """
+        Requests the first page of responses of form_id and checks that the API only returned surveys of that form.
+
+        The page is requested from 0, so it holds surveys whenever the environment has any and a server ignoring the
+        filter is detected on it. A form without responses is reported as supported.
+        """
+
+        records = api_client.get_updated_form_responses(start_millis=0, form_id=form_id, stream=True, page_func=cls.get_form_page_checker(form_id, lambda items: items))
+
+        try:
+            next(iter(records), None)
+        except FilterNotSupportedError:
+            return False
+        finally:
+            if hasattr(records, 'close'):
+                records.close()
+
+        return True
+
+    @classmethod
+    def get_form_records_to_sync(cls, api_client: InvolvesAPIClient, db: Session, form_id : int, stream : bool = False, checkpoint : Optional[PageCheckpoint] = None) -> Union[List[Dict[str, Any]],Iterator[Dict[str, Any]]]:
+        """Returns the responses of a form updated after the form watermark, failing with FilterNotSupportedError instead of walking the whole survey chain when the API ignores the form filter."""
+
+        return api_client.get_updated_form_responses(start_millis = cls.get_form_watermark(db, form_id), form_id=form_id, stream=stream, checkpoint=checkpoint, page_func=cls.get_form_page_checker(form_id, cls.get_page_mapper()))
 
 
 class EmployeeAbsence(Base):
     __tablename__ = "employee_absence"
 
-    employee_id = Column(Integer)
+    employee_id = Column(Integer, index=True)
     start_date = Column(Date)
     end_date = Column(Date)
     absence_reason = Column(String)
     absence_note = Column(String)
+    # nullable, the items of the employeeabsence endpoint may come without updatedAtMillis
+    updated_at_millis = Column(BigInteger, index=True)
+
+    __fields__ = {
+        'id' : 'id',
+        'employee_id' : 'employeeEnvironmentSuspended.id',
+        'start_date' : Field('absenceStartDate', 'date'),
+        'end_date' : Field('absenceEndDate', 'date'),
+        'absence_reason' : 'reasonNote',
+        'absence_note' : 'absenceNote',
+        'updated_at_millis' : 'updatedAtMillis'
+    }
+
+    # days before the last load synced again when the rows have no update timestamp, as before the watermark existed
+    WINDOW_DAYS = 30
 
     @classmethod
     def get_last_sync_time(cls, db: Session) -> Union[str,int]:
+        return super().get_last_sync_time(db)
+    
+    @classmethod
+    def get_window_start_date(cls, db: Session) -> Optional[str]:
+        """
+        Returns the start date of the fixed window synced when the table has rows but no update timestamp watermark, i.e.
+        when the employeeabsence endpoint did not return updatedAtMillis, WINDOW_DAYS before the last load. None when the
+        table is empty and a full extraction is needed anyway.
+        """
+
+        if db.query(cls.id).first() is None:
+            return None
 
-        millis = db.query(func.max(cls.updated_at_millis)).scalar()  
-        if millis:      
-            current_date = datetime.fromtimestamp(millis/1000)
-            sync_date = current_date - timedelta(days=30)
-            return sync_date.strftime('%Y-%m-%d')
+        synced_at_millis = db.query(func.max(cls.synced_at_millis)).scalar()
+        last_load = datetime.fromtimestamp(synced_at_millis/1000) if synced_at_millis else datetime.now()
+
+        return (last_load - timedelta(days=cls.WINDOW_DAYS)).strftime('%Y-%m-%d')
+
+    @staticmethod
+    def get_timestamp_checker(page_func : Callable[[List[Dict[str,Any]]], List[Dict[str,Any]]]) -> Callable[[List[Dict[str,Any]]], List[Dict[str,Any]]]:
+        """Wraps page_func to log a warning on the first page with items without updatedAtMillis, whose rows cannot advance the watermark."""
+
+        warned = False
+
+        def map_absence_page(items : List[Dict[str,Any]]) -> List[Dict[str,Any]]:
+            nonlocal warned
+            missing = sum(1 for item in items if item.get('updatedAtMillis') is None)
+            if missing and not warned:
+                warned = True
+                logger.warning(f'{missing} of {len(items)} items of the employeeabsence page came without updatedAtMillis, the next runs will sync a {EmployeeAbsence.WINDOW_DAYS} day window instead.')
+            return page_func(items)
+
+        return map_absence_page
 
-    
     @classmethod
-    def get_records_to_sync(cls, api_client: InvolvesAPIClient, db: Session) -> List[Dict[str, Any]]:
-        return api_client.get_employee_absences(start_date=cls.get_last_sync_time(db))
+    def get_records_to_sync(cls, api_client: InvolvesAPIClient, db: Session, stream : bool = False, checkpoint : Optional[PageCheckpoint] = None) -> Union[List[Dict[str, Any]],Iterator[Dict[str, Any]]]:
+        """Returns the absences updated after the table watermark, or valid from get_window_start_date when the stored rows have no update timestamp."""
+
+        millis = cls.get_last_sync_time(db)
+        start_date = cls.get_window_start_date(db) if not millis else None
+
+        if start_date:
+            logger.warning(f'table {cls.__tablename__} has rows but no updatedAtMillis watermark, syncing the absences from {start_date}.')
+
+        return api_client.get_employee_absences(millis=millis, start_date=start_date, stream=stream, checkpoint=checkpoint, page_func=cls.get_timestamp_checker(cls.get_page_mapper()))
 
 
 
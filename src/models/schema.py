@@ -0,0 +1,107 @@
+"""
+Schema of the sync database managed through the Alembic migrations on src/migrations.
+
+The flow never creates tables, the schema is created and upgraded with `python manage_schema.py upgrade` (or the
+alembic command from src) and `python manage_schema.py check` compares the live database with the models.
+"""
+
+from pathlib import Path
+from typing import List, Optional, Any
+import logging
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.config import Config as AlembicConfig
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import Engine
+from .base import Base
+from . import orm_model  # registers the tables of the models on Base.metadata
+
+logger = logging.getLogger(__name__)
+
+ALEMBIC_INI = Path(__file__).resolve().parent.parent / 'alembic.ini'
+
+
+def include_object(obj : Any, name : Optional[str], type_ : str, reflected : bool, compare_to : Any) -> bool:
+    """
+    Leaves the tables and indexes that only exist on the database out of the comparison with the models.
+
+    The sync tables share the database with other tables and with indexes created by hand, which are not dropped or
+    reported as differences.
+    """
+
+    if type_ in ('table', 'index') and reflected and compare_to is None:
+        return False
+
+    return True
+
+
+def get_alembic_config(engine : Optional[Engine] = None) -> AlembicConfig:
+    """Returns the Alembic configuration of src/alembic.ini, running the migrations on engine when given."""
+
+    config = AlembicConfig(str(ALEMBIC_INI))
+    if engine is not None:
+        config.attributes['engine'] = engine
+
+    return config
+
+
+def get_head_revision() -> Optional[str]:
+    return ScriptDirectory.from_config(get_alembic_config()).get_current_head()
+
+
+def get_current_revision(engine : Engine) -> Optional[str]:
+
+    with engine.connect() as connection:
+        return MigrationContext.configure(connection).get_current_revision()
+
+
+def upgrade_schema(engine : Engine, revision : str = 'head') -> None:
+    """Applies the migrations up to revision on the database of engine."""
+
+    logger.info(f'upgrading schema from revision {get_current_revision(engine)} to {revision}.')
+    command.upgrade(get_alembic_config(engine), revision)
+
+
+def get_schema_differences(engine : Engine) -> List[str]:
+    """
+    Returns the differences between the database of engine and the models, an empty list when they match.
+
+    A database behind the last migration is reported along with the tables, columns and indexes of the models it is
+    missing or that differ from them.
+    """
+
+    differences = []
+
+    head = get_head_revision()
+    current = get_current_revision(engine)
+    if current != head:
+        differences.append(f'revision {current} of the database is not the head revision {head}')
+
+    with engine.connect() as connection:
+        context = MigrationContext.configure(connection, opts={'include_object' : include_object, 'compare_type' : True})
+        for diff in compare_metadata(context, Base.metadata):
+            differences.append(_format_difference(diff))
+
+    return differences
+
+
+def _format_difference(diff : Any) -> str:
+    """Renders an entry of compare_metadata, column changes come as a list of tuples."""
+
+    if isinstance(diff, list):
+        return '; '.join(_format_difference(d) for d in diff)
+
+    operation, *args = diff
+
+    if operation in ('add_table', 'remove_table'):
+        return f'{operation} {args[0].name}'
+    if operation in ('add_index', 'remove_index'):
+        return f'{operation} {args[0].name} on {args[0].table.name} ({", ".join(c.name for c in args[0].columns)})'
+    if operation in ('add_column', 'remove_column'):
+        return f'{operation} {args[1]}.{args[2].name}'
+    if operation.startswith('modify_'):
+        _, table, column, _, existing, expected = args
+        return f'{operation} {table}.{column} : {existing} on the database, {expected} on the model'
+
+    return f'{operation} {args}'
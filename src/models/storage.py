@@ -0,0 +1,219 @@
+"""
+Storage profiles of the append-heavy fact tables on SQL Server.
+
+The models declaring a __partition_column__ (form_response by replied_at, visit by visit_date) can be stored with a
+profile other than the default rowstore clustered on id:
+    columnstore: a clustered columnstore index.
+    partitioned: a rowstore clustered on (partition column, id), partitioned by month of the partition column.
+    partitioned_columnstore: a clustered columnstore index partitioned by month of the partition column.
+In every profile the primary key on id is kept as a nonclustered index, so the id lookups of the classification and
+the joins of the writes stay index seeks.
+
+A profile is applied on demand with `python manage_schema.py storage --profile ...`, the migrations always create the
+rowstore tables. The load path reads the layout of each table from the catalog with get_storage_layout and writes
+columnstore and partitioned tables with set-based statements from a staging table (see Base.bulk_insert_records).
+Those inserts only take WITH (TABLOCK), minimally logged but exclusive until the commit, when a single task writes the
+table and the sync commits periodically (SYNC_COMMIT_ROWS or SYNC_COMMIT_SECONDS). The per-form form_response syncs
+insert without it so they can run concurrently, at the cost of fully logged inserts.
+Columnstore indexes with varchar(max) columns require SQL Server 2017 or later.
+"""
+
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, List, Optional, Tuple, Type
+import logging
+import threading
+from sqlalchemy import Connection, Engine, text
+from sqlalchemy.orm import Session
+from sqlalchemy.types import DateTime
+from .base import Base
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MONTHS_AHEAD = 3
+
+
+@dataclass(frozen=True)
+class StorageLayout:
+    """Physical layout of a table, partition_column is None when the table is not partitioned."""
+
+    columnstore : bool = False
+    partition_column : Optional[str] = None
+
+    @property
+    def is_bulk(self) -> bool:
+        """Whether the table is written with set-based statements from a staging table instead of executemany."""
+
+        return self.columnstore or self.partition_column is not None
+
+
+ROWSTORE = StorageLayout()
+
+PROFILES = ('rowstore', 'columnstore', 'partitioned', 'partitioned_columnstore')
+
+_layouts : Dict[Tuple[str,str], StorageLayout] = {}
+_layouts_lock = threading.Lock()
+
+
+def get_profile_layout(model : Type[Base], profile : str) -> StorageLayout:
+    """Returns the layout a profile gives to the table of model."""
+
+    if profile not in PROFILES:
+        raise ValueError(f'unknown storage profile {profile}, expected one of {PROFILES}')
+
+    return StorageLayout(
+        columnstore = profile.endswith('columnstore'),
+        partition_column = model.__partition_column__ if profile.startswith('partitioned') else None
+    )
+
+
+def get_storage_layout(model : Type[Base], db : Session) -> StorageLayout:
+    """Returns the layout of the table of model, read once per database from the catalog. Tables outside SQL Server are rowstore."""
+
+    bind = db.get_bind()
+    if bind.dialect.name != 'mssql' or model.__partition_column__ is None:
+        return ROWSTORE
+
+    key = (bind.url.render_as_string(hide_password=True), model.__tablename__)
+
+    with _layouts_lock:
+        layout = _layouts.get(key)
+
+    if layout is None:
+        layout = read_storage_layout(db.connection(), model.__tablename__)
+        with _layouts_lock:
+            _layouts[key] = layout
+        logger.info(f'storage layout of table {model.__tablename__} : {layout}')
+
+    return layout
+
+
+def read_storage_layout(connection : Connection, table_name : str) -> StorageLayout:
+    """Reads from the catalog whether the clustered index (or heap) of the table is a columnstore and its partition column."""
+
+    row = connection.execute(text(
+        'SELECT i.type AS index_type, c.name AS partition_column '
+        'FROM sys.indexes AS i '
+        'LEFT JOIN sys.index_columns AS ic ON ic.object_id = i.object_id AND ic.index_id = i.index_id AND ic.partition_ordinal = 1 '
+        'LEFT JOIN sys.columns AS c ON c.object_id = ic.object_id AND c.column_id = ic.column_id '
+        'WHERE i.object_id = OBJECT_ID(:table_name) AND i.index_id <= 1'
+    ), {'table_name' : table_name}).first()
+
+    if row is None:
+        return ROWSTORE
+
+    return StorageLayout(columnstore=row.index_type == 5, partition_column=row.partition_column)
+
+
+def get_month_boundaries(start : date, end : date) -> List[date]:
+    """Returns the first day of every month from the month of start to the month of end."""
+
+    boundaries = []
+    year, month = start.year, start.month
+
+    while (year, month) <= (end.year, end.month):
+        boundaries.append(date(year, month, 1))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+    return boundaries
+
+
+def get_partition_names(model : Type[Base]) -> Tuple[str,str]:
+    """Returns the names of the monthly partition function and scheme of the table of model."""
+
+    return f'pf_{model.__tablename__}_monthly', f'ps_{model.__tablename__}_monthly'
+
+
+def apply_storage_profile(engine : Engine, model : Type[Base], profile : str, months_ahead : int = DEFAULT_MONTHS_AHEAD) -> StorageLayout:
+    """
+    Rebuilds the table of model with the layout of profile, in a single transaction.
+
+    The monthly partitions cover from the month of the oldest row to months_ahead months after the current one, running
+    it again on a partitioned table only adds the missing future months, so it can be scheduled to keep the partitions
+    ahead of the data. The clustered index is only rebuilt when the layout of the table differs from the profile.
+    """
+
+    if engine.dialect.name != 'mssql':
+        raise ValueError(f'storage profiles require SQL Server, the database is {engine.dialect.name}')
+    if model.__partition_column__ is None:
+        raise ValueError(f'table {model.__tablename__} does not declare a __partition_column__')
+
+    target = get_profile_layout(model, profile)
+    preparer = engine.dialect.identifier_preparer
+    table_name = model.__tablename__
+    quoted_table = preparer.format_table(model.__table__)
+
+    with engine.begin() as connection:
+
+        if target.partition_column:
+            _create_or_extend_partitions(connection, model, months_ahead)
+
+        current = read_storage_layout(connection, table_name)
+
+        if current != target:
+
+            logger.info(f'rebuilding table {table_name} from {current} to {target}.')
+
+            clustered_index = connection.execute(text(
+                'SELECT name FROM sys.indexes WHERE object_id = OBJECT_ID(:table_name) AND index_id = 1 AND is_primary_key = 0'
+            ), {'table_name' : table_name}).scalar()
+            primary_key = connection.execute(text(
+                "SELECT name FROM sys.key_constraints WHERE parent_object_id = OBJECT_ID(:table_name) AND type = 'PK'"
+            ), {'table_name' : table_name}).scalar() or f'pk_{table_name}'
+
+            if clustered_index:
+                connection.execute(text(f'DROP INDEX {preparer.quote(clustered_index)} ON {quoted_table}'))
+            connection.execute(text(f"IF OBJECT_ID(:pk, 'PK') IS NOT NULL ALTER TABLE {quoted_table} DROP CONSTRAINT {preparer.quote(primary_key)}"), {'pk' : primary_key})
+
+            partition_scheme = f' ON {get_partition_names(model)[1]}({preparer.quote(target.partition_column)})' if target.partition_column else ''
+
+            if target.columnstore:
+                connection.execute(text(f'CREATE CLUSTERED COLUMNSTORE INDEX {preparer.quote(f"cci_{table_name}")} ON {quoted_table}{partition_scheme}'))
+            elif target.partition_column:
+                connection.execute(text(f'CREATE CLUSTERED INDEX {preparer.quote(f"cix_{table_name}")} ON {quoted_table} ({preparer.quote(target.partition_column)}, id){partition_scheme}'))
+
+            # the key is not partition aligned, a unique index on the partition scheme would have to include the partition column
+            clustering = 'NONCLUSTERED' if target.is_bulk else 'CLUSTERED'
+            filegroup = ' ON [PRIMARY]' if target.partition_column else ''
+            connection.execute(text(f'ALTER TABLE {quoted_table} ADD CONSTRAINT {preparer.quote(primary_key)} PRIMARY KEY {clustering} (id){filegroup}'))
+
+    with _layouts_lock:
+        _layouts.clear()
+
+    return target
+
+
+def _create_or_extend_partitions(connection : Connection, model : Type[Base], months_ahead : int) -> None:
+    """Creates the monthly partition function and scheme of the table, or splits the missing future months on the existing ones."""
+
+    function_name, scheme_name = get_partition_names(model)
+    partition_column = model.__table__.c[model.__partition_column__]
+    today = date.today()
+    month = today.month - 1 + months_ahead
+    last_boundary = date(today.year + month // 12, month % 12 + 1, 1)
+
+    current_last = connection.execute(text(
+        'SELECT MAX(CONVERT(date, rv.value)) FROM sys.partition_range_values AS rv '
+        'INNER JOIN sys.partition_functions AS pf ON pf.function_id = rv.function_id WHERE pf.name = :name'
+    ), {'name' : function_name}).scalar()
+
+    if current_last is None:
+        preparer = connection.dialect.identifier_preparer
+        oldest = connection.execute(text(f'SELECT MIN({preparer.quote(partition_column.name)}) FROM {preparer.format_table(model.__table__)}')).scalar()
+        boundaries = get_month_boundaries(oldest or today, last_boundary)
+        value_type = 'datetime' if isinstance(partition_column.type, DateTime) else 'date'
+        connection.execute(text(
+            f'CREATE PARTITION FUNCTION {function_name} ({value_type}) AS RANGE RIGHT FOR VALUES '
+            f'({", ".join(repr(b.isoformat()) for b in boundaries)})'
+        ))
+        connection.execute(text(f'CREATE PARTITION SCHEME {scheme_name} AS PARTITION {function_name} ALL TO ([PRIMARY])'))
+        logger.info(f'partition function {function_name} created with {len(boundaries)} monthly boundaries up to {last_boundary}.')
+        return
+
+    new_boundaries = [b for b in get_month_boundaries(current_last, last_boundary) if b > current_last]
+    for boundary in new_boundaries:
+        connection.execute(text(f'ALTER PARTITION SCHEME {scheme_name} NEXT USED [PRIMARY]'))
+        connection.execute(text(f"ALTER PARTITION FUNCTION {function_name}() SPLIT RANGE ('{boundary.isoformat()}')"))
+
+    if new_boundaries:
+        logger.info(f'partition function {function_name} extended up to {last_boundary}.')
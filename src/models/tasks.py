@@ -4,18 +4,30 @@ from .base import Base
 import logging
 import importlib 
 import inspect
+from typing import List, Type
 
 logger = logging.getLogger(__name__)
 
-def create_db_engine(server : str, database : str, username : str, password : str) -> Engine:
-    """Creates and test a connection to the specified database using sqlalchemy engine."""
+def get_connection_url(server : str, database : str, username : str, password : str) -> str:
+    """Returns the SQLAlchemy URL of the SQL Server database through the ODBC Driver 17."""
 
-    connection_url = f"mssql+pyodbc://{username}:{password}@{server}/{database}?driver=ODBC+Driver+17+for+SQL+Server"
-    engine = create_engine(connection_url)
+    return f"mssql+pyodbc://{username}:{password}@{server}/{database}?driver=ODBC+Driver+17+for+SQL+Server"
+
+
+def create_db_engine(server : str, database : str, username : str, password : str, pool_size : int = 5, fast_executemany : bool = False) -> Engine:
+    """
+    Creates and test a connection to the specified database using sqlalchemy engine.
+
+    pool_size should match the number of tables synced concurrently. fast_executemany enables the pyodbc bulk parameter
+    binding, which sends each executemany batch in a single round trip instead of one round trip per row.
+    """
+
+    connection_url = get_connection_url(server, database, username, password)
+    engine = create_engine(connection_url, pool_size=pool_size, max_overflow=pool_size, fast_executemany=fast_executemany)
     try:
         connection = engine.connect()
         connection.close()
-        logger.info(f'SQLAlchemy connection with context server : "{server}" database : "{database}" tested successfully.')
+        logger.info(f'SQLAlchemy connection with context server : "{server}" database : "{database}" fast_executemany : {fast_executemany} tested successfully.')
         return engine
     except Exception as e:
         raise SQLEngineError(f'Cannot create database engine with context:\n server : {server} \n database : {database}\n Error : {e}')
@@ -41,4 +53,56 @@ def get_models_to_sync(env : int):
     else:
         models_to_sync = models
 
-    return models_to_sync
\ No newline at end of file
+    fan_out_tables = {table for model in models_to_sync for table in model.__fan_out__}
+    models_to_sync = [c for c in models_to_sync if c.__tablename__ not in fan_out_tables]
+
+    return models_to_sync
+
+
+
+def get_scheduled_dependencies(model : Type[Base], models : List[Type[Base]]) -> List[str]:
+    """
+    Returns the tables of models that have to be synced before model.
+
+    A dependency on a table filled through the __fan_out__ of another model is resolved to that model,
+    dependencies on tables outside models are ignored.
+    """
+
+    owners = {model.__tablename__ : model.__tablename__ for model in models}
+    owners.update({table : m.__tablename__ for m in models for table in m.__fan_out__})
+
+    dependencies = {owners[table] for table in model.__depends_on__ if table in owners}
+    dependencies.discard(model.__tablename__)
+
+    return sorted(dependencies)
+
+
+def sort_models_by_dependencies(models : List[Type[Base]]) -> List[Type[Base]]:
+    """Orders the models so that every model comes after the models it depends on, see get_scheduled_dependencies."""
+
+    by_table = {model.__tablename__ : model for model in models}
+    ordered = []
+    visiting = set()
+    visited = set()
+
+    def visit(model : Type[Base]) -> None:
+
+        table_name = model.__tablename__
+
+        if table_name in visited:
+            return
+        if table_name in visiting:
+            raise ValueError(f'Circular dependency found between models at table : {table_name}')
+
+        visiting.add(table_name)
+        for dependency in get_scheduled_dependencies(model, models):
+            visit(by_table[dependency])
+        visiting.remove(table_name)
+
+        visited.add(table_name)
+        ordered.append(model)
+
+    for model in models:
+        visit(model)
+
+    return ordered
@@ -0,0 +1,19 @@
+from itertools import islice
+from typing import Iterable, Iterator, List, TypeVar
+
+T = TypeVar('T')
+
+
+def chunked(iterable : Iterable[T], size : int) -> Iterator[List[T]]:
+    """Splits an iterable into consecutive lists of at most size elements, consuming it lazily."""
+
+    if size < 1:
+        raise ValueError(f'chunk size must be a positive integer, got {size}')
+
+    iterator = iter(iterable)
+
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
@@ -0,0 +1,323 @@
+"""
+Timing and throughput metrics of the table syncs.
+
+Each sync_table run measures its table on a TableMetrics tracked on a context variable, so the API clients, the page
+mappers and the database engine record into the metrics of the table they are working for without passing them
+around. A phase is timed with `with metrics.phase(name)`. Phases opened inside another phase on the same thread are
+subtracted from it, so the extraction time excludes the mapping and writing done while records are pulled. The
+requests only add their latency and bytes: they may overlap on several threads, so their time is not a phase.
+
+RunMetrics gathers the tables of a flow run and renders them as a markdown artifact and as an OpenMetrics text file.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Callable, Iterator, Tuple, TypeVar
+import bisect
+import functools
+import os
+import threading
+import time
+from sqlalchemy import Engine, event
+
+T = TypeVar('T')
+
+LATENCY_BUCKETS : Tuple[float,...] = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRIC_PREFIX = 'involves_sync'
+
+_current_metrics : ContextVar[Optional['TableMetrics']] = ContextVar('involves_sync_metrics', default=None)
+
+
+class LatencyHistogram:
+    """Cumulative histogram of request latencies over fixed buckets, as exposed by an OpenMetrics histogram."""
+
+    def __init__(self, buckets : Tuple[float,...] = LATENCY_BUCKETS):
+
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value : float) -> None:
+
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def get_cumulative_counts(self) -> List[Tuple[str,int]]:
+        """Returns (upper bound, observations up to it) pairs, the last bound is +Inf."""
+
+        bounds = [f'{bucket:g}' for bucket in self.buckets] + ['+Inf']
+        total = 0
+        cumulative = []
+        for bound, count in zip(bounds, self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return cumulative
+
+    def get_quantile(self, quantile : float) -> Optional[float]:
+        """Returns the upper bound of the bucket holding the quantile, None when empty or past the last bucket."""
+
+        if not self.count:
+            return None
+
+        rank = quantile * self.count
+        for bucket, (_, total) in zip(self.buckets, self.get_cumulative_counts()):
+            if total >= rank:
+                return bucket
+        return None
+
+
+class TableMetrics:
+    """Thread-safe phase timers and request, download and statement counters of a table sync."""
+
+    def __init__(self, table : str):
+
+        self.table = table
+        self.phases : Dict[str, Dict[str,float]] = {}
+        self.latency = LatencyHistogram()
+        self.bytes_downloaded = 0
+        self.db_statements = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def phase(self, name : str) -> Iterator[Dict[str,int]]:
+        """
+        Times a phase, the block can add the rows it processed on the 'rows' key of the yielded dict.
+
+        The time of the phases nested inside it on the same thread is excluded from its time.
+        """
+
+        stack = self._local.__dict__.setdefault('stack', [])
+        counter = {'rows' : 0}
+        stack.append(0.0)
+        started_at = time.perf_counter()
+
+        try:
+            yield counter
+        finally:
+            elapsed = time.perf_counter() - started_at
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            self.add_phase(name, elapsed - nested, counter['rows'])
+
+    def add_phase(self, name : str, seconds : float, rows : int = 0) -> None:
+
+        with self._lock:
+            phase = self.phases.setdefault(name, {'seconds' : 0.0, 'rows' : 0, 'calls' : 0})
+            phase['seconds'] += seconds
+            phase['rows'] += rows
+            phase['calls'] += 1
+
+    def record_request(self, latency : float) -> None:
+
+        with self._lock:
+            self.latency.observe(latency)
+
+    def record_download(self, size : int) -> None:
+
+        with self._lock:
+            self.bytes_downloaded += size
+
+    def record_statement(self) -> None:
+
+        with self._lock:
+            self.db_statements += 1
+
+    def summary(self) -> Dict[str,Any]:
+        """Returns the seconds, rows and rows per second of each phase with the request and statement counters."""
+
+        with self._lock:
+            return {
+                'phases' : {
+                    name : {
+                        'seconds' : round(phase['seconds'], 3),
+                        'rows' : phase['rows'],
+                        'rows_per_sec' : round(phase['rows'] / phase['seconds'], 1) if phase['seconds'] > 0 else 0.0
+                    }
+                    for name, phase in self.phases.items()
+                },
+                'requests' : self.latency.count,
+                'avg_latency_seconds' : round(self.latency.sum / self.latency.count, 4) if self.latency.count else 0.0,
+                'bytes_downloaded' : self.bytes_downloaded,
+                'db_statements' : self.db_statements
+            }
+
+
+class RunMetrics:
+    """Metrics of the tables synced on a flow run."""
+
+    def __init__(self):
+
+        self.tables : Dict[str, TableMetrics] = {}
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    def get_table(self, table : str) -> TableMetrics:
+
+        with self._lock:
+            return self.tables.setdefault(table, TableMetrics(table))
+
+    def to_markdown(self) -> str:
+        """Renders the phases and the request counters of every table as two markdown tables."""
+
+        phase_lines = [
+            '| tabla | fase | segundos | registros | registros/s |',
+            '|---|---|---:|---:|---:|'
+        ]
+        request_lines = [
+            '| tabla | solicitudes | latencia media (s) | p95 (s) | MB descargados | sentencias SQL |',
+            '|---|---:|---:|---:|---:|---:|'
+        ]
+
+        for table, metrics in sorted(self.tables.items()):
+            summary = metrics.summary()
+            for name, phase in summary['phases'].items():
+                phase_lines.append(f"| {table} | {name} | {phase['seconds']:.2f} | {phase['rows']} | {phase['rows_per_sec']:.0f} |")
+            p95 = metrics.latency.get_quantile(0.95)
+            request_lines.append(
+                f"| {table} | {summary['requests']} | {summary['avg_latency_seconds']:.3f} | {_format_quantile(metrics.latency, p95)} "
+                f"| {summary['bytes_downloaded'] / 1024**2:.1f} | {summary['db_statements']} |"
+            )
+
+        return '\n'.join(['# Metricas de sincronizacion', '', *phase_lines, '', *request_lines])
+
+    def to_openmetrics(self) -> str:
+        """Renders the metrics in the OpenMetrics text exposition format."""
+
+        families = {
+            'phase_seconds' : ('gauge', 'seconds', 'Wall time spent on each phase of the table sync.', []),
+            'phase_rows' : ('gauge', None, 'Rows processed on each phase of the table sync.', []),
+            'phase_rows_per_second' : ('gauge', None, 'Rows processed per second on each phase of the table sync.', []),
+            'downloaded_bytes' : ('gauge', 'bytes', 'Bytes of the API responses of the table sync.', []),
+            'db_statements' : ('gauge', None, 'SQL statements executed by the table sync.', []),
+            'request_duration_seconds' : ('histogram', 'seconds', 'Latency of the API requests of the table sync.', []),
+            'run_timestamp_seconds' : ('gauge', 'seconds', 'Start time of the flow run.', [('', float(self.started_at))])
+        }
+
+        for table, metrics in sorted(self.tables.items()):
+            summary = metrics.summary()
+            for name, phase in summary['phases'].items():
+                labels = f'{{table="{table}",phase="{name}"}}'
+                families['phase_seconds'][3].append((labels, phase['seconds']))
+                families['phase_rows'][3].append((labels, phase['rows']))
+                families['phase_rows_per_second'][3].append((labels, phase['rows_per_sec']))
+            families['downloaded_bytes'][3].append((f'{{table="{table}"}}', summary['bytes_downloaded']))
+            families['db_statements'][3].append((f'{{table="{table}"}}', summary['db_statements']))
+            histogram = families['request_duration_seconds'][3]
+            for bound, count in metrics.latency.get_cumulative_counts():
+                histogram.append((f'_bucket{{table="{table}",le="{bound}"}}', count))
+            histogram.append((f'_count{{table="{table}"}}', metrics.latency.count))
+            histogram.append((f'_sum{{table="{table}"}}', round(metrics.latency.sum, 6)))
+
+        lines = []
+        for family, (metric_type, unit, help_text, samples) in families.items():
+            name = f'{METRIC_PREFIX}_{family}'
+            lines.append(f'# TYPE {name} {metric_type}')
+            if unit:
+                lines.append(f'# UNIT {name} {unit}')
+            lines.append(f'# HELP {name} {help_text}')
+            lines.extend(f'{name}{labels} {value}' for labels, value in samples)
+        lines.append('# EOF')
+
+        return '\n'.join(lines) + '\n'
+
+    def write_openmetrics(self, path : str) -> None:
+        """Writes the OpenMetrics file through a temporary file, so a scraper never reads a partial file."""
+
+        target = Path(path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_name(f'{target.name}.tmp')
+        tmp.write_text(self.to_openmetrics(), encoding='utf-8')
+        os.replace(tmp, target)
+
+
+def _format_quantile(histogram : LatencyHistogram, value : Optional[float]) -> str:
+
+    if not histogram.count:
+        return '-'
+    return f'<= {value:g}' if value is not None else f'> {histogram.buckets[-1]:g}'
+
+
+def get_current_metrics() -> Optional[TableMetrics]:
+    """Returns the metrics of the table synced on the current context, None outside a tracked sync."""
+
+    return _current_metrics.get()
+
+
+@contextmanager
+def track(metrics : TableMetrics) -> Iterator[TableMetrics]:
+    """Makes metrics the current metrics of the block and of the threads and tasks started from it with its context."""
+
+    token = _current_metrics.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current_metrics.reset(token)
+
+
+@contextmanager
+def phase(name : str) -> Iterator[Dict[str,int]]:
+    """Times a phase on the current metrics, outside a tracked sync the block runs untimed."""
+
+    metrics = _current_metrics.get()
+    if metrics is None:
+        yield {'rows' : 0}
+        return
+
+    with metrics.phase(name) as counter:
+        yield counter
+
+
+def timed_page_func(page_func : Callable[[List[Any]], List[T]]) -> Callable[[List[Any]], List[T]]:
+    """
+    Wraps a page mapper to time it on the 'mapping' phase of the current metrics.
+
+    The metrics are taken when the wrapper is created, since the async client maps the pages on its event loop thread.
+    """
+
+    metrics = get_current_metrics()
+    if metrics is None:
+        return page_func
+
+    @functools.wraps(page_func)
+    def wrapper(items : List[Any]) -> List[T]:
+        with metrics.phase('mapping') as counter:
+            rows = page_func(items)
+            counter['rows'] = len(rows)
+        return rows
+
+    return wrapper
+
+
+def record_request(latency : float) -> None:
+
+    metrics = _current_metrics.get()
+    if metrics is not None:
+        metrics.record_request(latency)
+
+
+def record_download(size : int) -> None:
+
+    metrics = _current_metrics.get()
+    if metrics is not None:
+        metrics.record_download(size)
+
+
+def _count_statement(*args) -> None:
+
+    metrics = _current_metrics.get()
+    if metrics is not None:
+        metrics.record_statement()
+
+
+def instrument_engine(engine : Engine) -> Engine:
+    """Counts the statements executed by the engine on the metrics of the table synced by the calling thread."""
+
+    if not event.contains(engine, 'before_cursor_execute', _count_statement):
+        event.listen(engine, 'before_cursor_execute', _count_statement)
+
+    return engine
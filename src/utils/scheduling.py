@@ -0,0 +1,73 @@
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class Job:
+    """
+    A task run scheduled by run_bounded.
+
+    key: unique key of the job, returned by run_bounded when the job fails or is skipped.
+    group: the jobs of a group share the concurrency limit of the group.
+    depends_on: keys of the jobs that have to complete before this one is submitted.
+    """
+
+    key : Hashable
+    group : Hashable = None
+    depends_on : Tuple[Hashable,...] = ()
+
+
+def run_bounded(jobs : List[Job], submit : Callable[[Job], Any], limits : Dict[Hashable,int], poll_seconds : float = 0.5, on_skipped : Optional[Callable[[Job, List[Hashable]], None]] = None) -> List[Hashable]:
+    """
+    Submits the jobs in order keeping at most limits[group] jobs of each group running, returns the keys of the jobs that failed or were skipped.
+
+    A job is submitted once all of its dependencies completed, a job depending on a failed or skipped job is skipped and
+    passed to on_skipped with those dependencies. submit returns a future whose wait(timeout) returns None while the
+    job runs and its final state afterwards, a failure when the state is not is_completed() (the Prefect future API).
+    Each pass over the running futures waits poll_seconds in total, so a finished job frees its slot within poll_seconds
+    whatever the number of running jobs.
+    """
+
+    pending = list(jobs)
+    running : Dict[Hashable, Tuple[Job, Any]] = {}
+    running_by_group = {job.group : 0 for job in jobs}
+    completed = set()
+    failed = []
+
+    while pending or running:
+
+        for job in list(pending):
+
+            failed_dependencies = [key for key in job.depends_on if key in failed]
+
+            if failed_dependencies:
+                pending.remove(job)
+                failed.append(job.key)
+                if on_skipped is not None:
+                    on_skipped(job, failed_dependencies)
+
+            elif running_by_group[job.group] < limits[job.group] and all(key in completed for key in job.depends_on):
+                pending.remove(job)
+                running[job.key] = (job, submit(job))
+                running_by_group[job.group] += 1
+
+        if not running:
+            if pending:
+                raise ValueError(f'the jobs {[job.key for job in pending]} depend on jobs that are not scheduled')
+            break
+
+        timeout = poll_seconds / len(running)
+
+        for key, (job, future) in list(running.items()):
+
+            state = future.wait(timeout=timeout)
+
+            if state is not None:
+                del running[key]
+                running_by_group[job.group] -= 1
+                if state.is_completed():
+                    completed.add(key)
+                else:
+                    failed.append(key)
+
+    return failed
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the modules are imported from src, as when the flow runs from that directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
@@ -0,0 +1,77 @@
+import logging
+from datetime import datetime
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+import pytest
+from models.base import Base, SyncState
+from models.orm_model import EmployeeAbsence
+
+
+class RecordingClient:
+    """Stands in for the API client, returns no absences and keeps the arguments of the request."""
+
+    def get_employee_absences(self, **kwargs):
+        self.kwargs = kwargs
+        return []
+
+
+def make_absence(absence_id : int, updated_at_millis, synced_at_millis):
+    return {'id' : absence_id, 'employee_id' : 1, 'start_date' : None, 'end_date' : None, 'absence_reason' : None, 'absence_note' : None, 'updated_at_millis' : updated_at_millis, 'synced_at_millis' : synced_at_millis}
+
+
+@pytest.fixture
+def db():
+
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine, tables=[EmployeeAbsence.__table__, SyncState.__table__])
+
+    with Session(engine) as session:
+        yield session
+
+    engine.dispose()
+
+
+def test_empty_table_is_fully_extracted(db):
+
+    client = RecordingClient()
+    EmployeeAbsence.get_records_to_sync(client, db)
+
+    assert client.kwargs['millis'] == 0 and client.kwargs['start_date'] is None
+
+
+def test_rows_with_timestamps_sync_from_the_watermark(db):
+
+    EmployeeAbsence.insert_records([make_absence(1, 1700000000000, 1700000005000)], db)
+    client = RecordingClient()
+    EmployeeAbsence.get_records_to_sync(client, db)
+
+    assert client.kwargs['millis'] == 1700000000000 and client.kwargs['start_date'] is None
+
+
+def test_rows_without_timestamps_fall_back_to_the_date_window(db, caplog):
+
+    synced_at_millis = round(datetime(2024, 3, 31, 12).timestamp() * 1000)
+    EmployeeAbsence.insert_records([make_absence(1, None, synced_at_millis), make_absence(2, None, synced_at_millis - 1000)], db)
+    EmployeeAbsence.save_sync_state(db, watermark=0)
+    client = RecordingClient()
+
+    with caplog.at_level(logging.WARNING, logger='models.orm_model'):
+        EmployeeAbsence.get_records_to_sync(client, db)
+
+    assert client.kwargs['millis'] == 0
+    assert client.kwargs['start_date'] == '2024-03-01'
+    assert 'no updatedAtMillis watermark' in caplog.text
+
+
+def test_pages_without_timestamps_are_warned_once(caplog):
+
+    page_func = EmployeeAbsence.get_timestamp_checker(lambda items: items)
+
+    with caplog.at_level(logging.WARNING, logger='models.orm_model'):
+        assert page_func([{'id' : 1, 'updatedAtMillis' : 5}]) == [{'id' : 1, 'updatedAtMillis' : 5}]
+        assert not caplog.records
+        page_func([{'id' : 2}, {'id' : 3, 'updatedAtMillis' : 6}])
+        page_func([{'id' : 4}])
+
+    assert len(caplog.records) == 1
+    assert '1 of 2 items' in caplog.text
@@ -0,0 +1,59 @@
+from sqlalchemy import create_engine, update
+from sqlalchemy.orm import Session
+import pytest
+from models.base import Base
+from models.orm_model import Product
+from models.index import TableIndex, classify_with_index
+
+
+def make_product(product_id : int, name : str):
+    return {'id' : product_id, 'product_name' : name, 'bar_code' : '779', 'product_line' : 'Bebidas', 'is_active' : True, 'is_deleted' : False, 'updated_at_millis' : 1000 + product_id}
+
+
+@pytest.fixture
+def db():
+
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine, tables=[Product.__table__])
+
+    with Session(engine) as session:
+        records = [make_product(i, f'producto {i}') for i in range(1, 7)]
+        Product.add_row_hashes(records)
+        Product.insert_records(records, session)
+        # rows written before the row_hash column existed
+        session.execute(update(Product).where(Product.id == 6).values(row_hash=None))
+        session.commit()
+        yield session
+
+    engine.dispose()
+
+
+def get_incoming():
+    """Records 1-3 unchanged, 4 renamed, 5 with a new timestamp only, 6 stored without hash, 7-8 new."""
+
+    records = [make_product(i, f'producto {i}') for i in range(1, 9)]
+    records[3]['product_name'] = 'producto renombrado'
+    records[4]['updated_at_millis'] = 9999
+    records[4]['synced_at_millis'] = 9999
+
+    return records
+
+
+def get_ids(classified):
+    return {key : [rec['id'] for rec in records] for key, records in classified.items()}
+
+
+@pytest.mark.parametrize('batch_size', [1, 3, 1000])
+def test_classify_records_compares_row_hashes(db, batch_size):
+
+    classified = Product.classify_records(get_incoming(), db, batch_size=batch_size)
+
+    assert get_ids(classified) == {'to_insert' : [7, 8], 'to_update' : [4, 6], 'unchanged' : [1, 2, 3, 5]}
+    assert all(rec['row_hash'] == Product.compute_row_hash(rec) for records in classified.values() for rec in records)
+
+
+def test_classify_with_index_matches_the_database_classification(db):
+
+    index = TableIndex.load(Product, db)
+
+    assert get_ids(classify_with_index(Product, get_incoming(), index)) == get_ids(Product.classify_records(get_incoming(), db))
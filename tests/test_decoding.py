@@ -0,0 +1,70 @@
+import orjson
+import pytest
+from involves_api.decoding import ItemsDecoder, MAX_ITEM_DEPTH
+
+
+def decode(body : bytes, chunk_size : int):
+    """Feeds body to an ItemsDecoder in chunks of chunk_size, returns the items of every call with the rest of the object."""
+
+    decoder = ItemsDecoder()
+    items = []
+    for start in range(0, len(body), chunk_size):
+        items.extend(decoder.feed(body[start:start + chunk_size]))
+    rest, data = decoder.close()
+
+    return items + rest, data
+
+
+PAGE = {
+    'page' : {'size' : 3, 'note' : 'a "quoted" [bracket] {brace}'},
+    'items' : [
+        {'id' : 1, 'name' : 'café \\ "x" ]}', 'tags' : [1, [2, {'a' : None}]]},
+        {'id' : 2, 'name' : '', 'nested' : {'items' : [{'id' : 99}]}},
+        [3, 'array item']
+    ],
+    'timestampLastItem' : 1700000000002
+}
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 7, 64, 1 << 20])
+def test_items_match_a_full_decode_for_any_chunking(chunk_size):
+
+    body = orjson.dumps(PAGE)
+    items, data = decode(body, chunk_size)
+
+    assert items == PAGE['items']
+    assert data == {'page' : PAGE['page'], 'timestampLastItem' : PAGE['timestampLastItem']}
+
+
+def test_items_are_returned_before_the_body_ends():
+
+    body = orjson.dumps({'items' : [{'id' : i} for i in range(10)], 'timestampLastItem' : 9})
+    decoder = ItemsDecoder()
+
+    items = decoder.feed(body[:len(body) // 2])
+
+    assert items and items == [{'id' : i} for i in range(len(items))]
+
+
+def test_pretty_printed_body_with_the_items_key_last():
+
+    body = b'{\n  "timestampLastItem" : 5,\n  "items" : [\n    {"id" : 1},\n    {"id" : 2}\n  ]\n}'
+
+    assert decode(body, 3) == ([{'id' : 1}, {'id' : 2}], {'timestampLastItem' : 5})
+
+
+def test_empty_and_missing_items():
+
+    assert decode(b'{"items" : [], "totalPages" : 0}', 4) == ([], {'totalPages' : 0})
+    assert decode(b'{"message" : "not found"}', 4) == ([], {'message' : 'not found'})
+    assert decode(b'[{"id" : 1}]', 4) == ([{'id' : 1}], {})
+
+
+def test_scalar_and_deeply_nested_items_fall_back_to_decoding_on_close():
+
+    deep = {'id' : 2}
+    for _ in range(MAX_ITEM_DEPTH + 1):
+        deep = {'child' : deep}
+    page = {'items' : [{'id' : 1}, 'scalar', deep, {'id' : 3}], 'timestampLastItem' : 3}
+
+    assert decode(orjson.dumps(page), 5) == (page['items'], {'timestampLastItem' : 3})
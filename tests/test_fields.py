@@ -0,0 +1,94 @@
+from datetime import date, datetime
+import pytest
+from involves_api.fields import Field, compile_page_mapper
+from involves_api.mappers import map_regions
+
+
+def test_maps_nested_paths_and_missing_steps_as_none():
+
+    mapper = compile_page_mapper({'id' : 'id', 'employee_id' : 'employee.id', 'region' : 'pointOfSale.region.name'})
+
+    rows = mapper([
+        {'id' : 1, 'employee' : {'id' : 10}, 'pointOfSale' : {'region' : {'name' : 'Norte'}}},
+        {'id' : 2, 'employee' : None, 'pointOfSale' : {'region' : 'not an object'}},
+        {'id' : 3}
+    ])
+
+    assert rows == [
+        {'id' : 1, 'employee_id' : 10, 'region' : 'Norte'},
+        {'id' : 2, 'employee_id' : None, 'region' : None},
+        {'id' : 3, 'employee_id' : None, 'region' : None}
+    ]
+
+
+def test_applies_coercions_null_rules_and_defaults():
+
+    mapper = compile_page_mapper({
+        'visit_date' : Field('visitDate', 'date'),
+        'entry_date' : Field('entry', 'datetime'),
+        'duration' : Field('duration', 'int'),
+        'comment' : Field('comment', empty_as_null=True, default='sin comentario')
+    })
+
+    rows = mapper([
+        {'visitDate' : '2024-03-01T10:00:00', 'entry' : '2024-03-01T10:00:00-03:00', 'duration' : '15', 'comment' : '  '},
+        {'visitDate' : '', 'entry' : None, 'duration' : 'n/a', 'comment' : 'ok'}
+    ])
+
+    assert rows == [
+        {'visit_date' : date(2024, 3, 1), 'entry_date' : datetime(2024, 3, 1, 10), 'duration' : 15, 'comment' : 'sin comentario'},
+        {'visit_date' : None, 'entry_date' : None, 'duration' : None, 'comment' : 'ok'}
+    ]
+
+
+def test_unparseable_dates_raise_naming_the_column():
+
+    mapper = compile_page_mapper({'visit_date' : Field('visitDate', 'date')})
+
+    with pytest.raises(ValueError, match='visit_date'):
+        mapper([{'visitDate' : '01/03/2024'}])
+
+
+def test_unhashable_values_are_converted_row_by_row():
+
+    mapper = compile_page_mapper({'tags' : Field('tags', 'str')})
+
+    assert mapper([{'tags' : ['a']}, {'tags' : 'b'}]) == [{'tags' : "['a']"}, {'tags' : 'b'}]
+
+
+def test_explodes_child_lists_reading_parent_fields_once_per_item():
+
+    mapper = compile_page_mapper({
+        'id' : 'id',
+        'survey_id' : '^id',
+        'form_id' : '^form.id',
+        'answered_at' : Field('^responseDate', 'date'),
+        'value' : 'value'
+    }, explode='answers')
+
+    rows = mapper([
+        {'id' : 1, 'form' : {'id' : 7}, 'responseDate' : '2024-01-02', 'answers' : [{'id' : 11, 'value' : 'SI'}, {'id' : 12, 'value' : 'NO'}]},
+        {'id' : 2, 'form' : {'id' : 7}, 'responseDate' : '2024-01-03', 'answers' : None}
+    ])
+
+    assert rows == [
+        {'id' : 11, 'survey_id' : 1, 'form_id' : 7, 'answered_at' : date(2024, 1, 2), 'value' : 'SI'},
+        {'id' : 12, 'survey_id' : 1, 'form_id' : 7, 'answered_at' : date(2024, 1, 2), 'value' : 'NO'}
+    ]
+
+
+def test_rejects_invalid_mappings():
+
+    with pytest.raises(ValueError, match='unknown coercion'):
+        compile_page_mapper({'id' : Field('id', 'decimal')})
+
+    with pytest.raises(ValueError, match='parent item'):
+        compile_page_mapper({'id' : '^id'})
+
+
+def test_regions_mapping():
+
+    assert map_regions([{'id' : 1, 'name' : 'Norte', 'macroregional' : {'id' : 3}}, {'id' : 2, 'name' : 'Sur', 'macroregional' : None}]) == [
+        {'id' : 1, 'regional_name' : 'Norte', 'macroregional_id' : 3},
+        {'id' : 2, 'regional_name' : 'Sur', 'macroregional_id' : None}
+    ]
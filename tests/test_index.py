@@ -0,0 +1,123 @@
+from array import array
+from sqlalchemy import create_engine, update, delete
+from sqlalchemy.orm import Session
+import pytest
+from models.base import Base
+from models.orm_model import Product
+from models.index import TableIndex, hash_key, UNKNOWN_HASH
+
+
+def make_product(product_id : int, name : str, millis : int):
+    return {'id' : product_id, 'product_name' : name, 'bar_code' : None, 'product_line' : None, 'is_active' : True, 'is_deleted' : False, 'updated_at_millis' : millis}
+
+
+@pytest.fixture
+def db(tmp_path):
+
+    engine = create_engine(f'sqlite:///{tmp_path / "sync.db"}')
+    Base.metadata.create_all(engine, tables=[Product.__table__])
+
+    with Session(engine) as session:
+        records = [make_product(i, f'producto {i}', 1000 + i) for i in range(1, 11)]
+        Product.add_row_hashes(records)
+        Product.insert_records(records, session)
+        session.commit()
+        yield session
+
+    engine.dispose()
+
+
+def test_hash_key_is_a_signed_64_bit_prefix():
+
+    assert hash_key(None) == UNKNOWN_HASH
+    assert hash_key('0' * 32) == 1
+    assert hash_key('7fffffffffffffff' + '0' * 16) == (1 << 63) - 1
+    assert hash_key('ffffffffffffffff' + '0' * 16) == -1
+
+
+def test_overlay_lookups_and_compact_merge():
+
+    index = TableIndex('product', array('q', [2, 4, 6, 8]), array('q', [20, 40, 60, 80]), watermark=5)
+    index.update([
+        {'id' : 4, 'row_hash' : None, 'updated_at_millis' : 3},
+        {'id' : 9, 'row_hash' : '0' * 15 + '9', 'updated_at_millis' : 7},
+        {'id' : 1, 'row_hash' : '0' * 15 + '1'},
+        {'id' : 5, 'row_hash' : '0' * 15 + '5'}
+    ])
+
+    assert len(index) == 7
+    assert 9 in index and 3 not in index
+    assert index.get_hash(4) == UNKNOWN_HASH
+    assert index.get_hash(6) == 60
+    assert index.watermark == 7
+
+    index.compact()
+
+    assert index.overlay == {}
+    assert list(index.ids) == [1, 2, 4, 5, 6, 8, 9]
+    assert list(index.hashes) == [1, 20, UNKNOWN_HASH, 5, 60, 80, 9]
+    assert isinstance(index.ids, array) and isinstance(index.hashes, array)
+
+
+def test_load_scans_the_table(db):
+
+    index = TableIndex.load(Product, db)
+    stored = {r.id : r.row_hash for r in db.query(Product.id, Product.row_hash)}
+
+    assert list(index.ids) == list(range(1, 11))
+    assert all(index.get_hash(product_id) == hash_key(row_hash) for product_id, row_hash in stored.items())
+    assert index.watermark == 1010
+
+
+def test_snapshot_refreshes_rows_updated_after_its_watermark(db, tmp_path):
+
+    snapshot_dir = str(tmp_path / 'indexes')
+    TableIndex.load(Product, db).save(TableIndex.get_snapshot_path(snapshot_dir, Product, db))
+
+    changed = make_product(3, 'producto renombrado', 2000)
+    added = make_product(11, 'producto nuevo', 2001)
+    Product.add_row_hashes([changed, added])
+    db.execute(update(Product).where(Product.id == 3).values(product_name=changed['product_name'], row_hash=changed['row_hash'], updated_at_millis=2000))
+    Product.insert_records([added], db)
+
+    index = TableIndex.load(Product, db, snapshot_dir=snapshot_dir)
+
+    assert list(index.ids) == list(range(1, 12))
+    assert index.get_hash(3) == hash_key(changed['row_hash'])
+    assert index.get_hash(11) == hash_key(added['row_hash'])
+    assert index.watermark == 2001
+
+
+def test_snapshot_is_rebuilt_when_rows_were_deleted(db, tmp_path):
+
+    snapshot_dir = str(tmp_path / 'indexes')
+    TableIndex.load(Product, db).save(TableIndex.get_snapshot_path(snapshot_dir, Product, db))
+    db.execute(delete(Product).where(Product.id == 5))
+
+    index = TableIndex.load(Product, db, snapshot_dir=snapshot_dir)
+
+    assert 5 not in index
+    assert len(index) == 9
+
+
+def test_unreadable_snapshot_is_ignored(tmp_path):
+
+    path = tmp_path / 'broken.idx'
+    path.write_bytes(b'{"version" : 1, "table" : "product", "count" : 10, "watermark" : 0}\n' + b'\0' * 8)
+
+    assert TableIndex.load_snapshot(path) is None
+    assert TableIndex.load_snapshot(tmp_path / 'missing.idx') is None
+
+
+def test_snapshot_path_depends_on_the_database_location(tmp_path):
+
+    paths = []
+    for server in ('server-a', 'server-b'):
+        (tmp_path / server).mkdir()
+        engine = create_engine(f'sqlite:///{tmp_path / server / "involves.db"}')
+        with Session(engine) as session:
+            paths.append(TableIndex.get_snapshot_path(str(tmp_path), Product, session))
+        engine.dispose()
+
+    assert paths[0] != paths[1]
+    assert all(path.name.startswith('involves.db.') and path.name.endswith('.product.idx') for path in paths)
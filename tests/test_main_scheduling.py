@@ -0,0 +1,79 @@
+import threading
+import time
+import pytest
+from prefect import flow, task
+from prefect.task_runners import ConcurrentTaskRunner
+import main
+from config.settings import SyncConfig
+from models.exceptions import SyncError
+from models.orm_model import Employee, Form, FormResponse, Product
+
+
+class Recorder:
+
+    def __init__(self, failing=(), seconds=0.5):
+        self.failing = set(failing)
+        self.seconds = seconds
+        self.lock = threading.Lock()
+        self.started = []
+        self.running = 0
+        self.max_running = 0
+
+    def run(self, key):
+        with self.lock:
+            self.started.append(key)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.seconds)
+        with self.lock:
+            self.running -= 1
+        if key in self.failing:
+            raise RuntimeError(f'{key} failed')
+
+
+def test_environment_syncs_skip_the_dependents_of_failed_tables(monkeypatch):
+
+    recorder = Recorder(failing={'a/form'})
+
+    @task
+    def sync_table(api_client, model, session_factory, sync_config, landing=None, run_metrics=None, environment=''):
+        recorder.run(f'{environment}/{model.__tablename__}')
+
+    monkeypatch.setattr(main, 'sync_table', sync_table)
+
+    environments = [
+        main.SyncEnvironment(name, None, [FormResponse, Form, Employee, Product], None, SyncConfig(max_concurrent_tables=1))
+        for name in ('a', 'b')
+    ]
+
+    @flow(task_runner=ConcurrentTaskRunner(), validate_parameters=False)
+    def run():
+        return main.run_environment_syncs(environments)
+
+    failed = run()
+
+    assert failed == ['a/form', 'a/form_response']
+    assert 'a/form_response' not in recorder.started
+    assert recorder.started.index('b/form') < recorder.started.index('b/form_response')
+    assert recorder.max_running == 2
+
+
+def test_form_response_syncs_report_failed_forms(monkeypatch):
+
+    recorder = Recorder(failing={3})
+
+    @task
+    def sync_form_responses_by_form_id(form_id, api_client, session_factory, sync_config, run_metrics=None):
+        recorder.run(form_id)
+
+    monkeypatch.setattr(main, 'sync_form_responses_by_form_id', sync_form_responses_by_form_id)
+
+    @flow(task_runner=ConcurrentTaskRunner(), validate_parameters=False)
+    def run():
+        main.run_form_response_syncs(None, list(range(1, 9)), None, SyncConfig(max_concurrent_tables=3))
+
+    with pytest.raises(SyncError, match=r'\[3\]'):
+        run()
+
+    assert sorted(recorder.started) == list(range(1, 9))
+    assert recorder.max_running == 3
@@ -0,0 +1,117 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+import threading
+import time
+import pytest
+from utils.scheduling import Job, run_bounded
+
+
+class State:
+
+    def __init__(self, completed : bool):
+        self.completed = completed
+
+    def is_completed(self) -> bool:
+        return self.completed
+
+
+class ThreadFuture:
+    """Future with the wait(timeout) of the Prefect futures, returning None while the job runs."""
+
+    def __init__(self, future):
+        self.future = future
+
+    def wait(self, timeout=None):
+        done, _ = wait([self.future], timeout=timeout)
+        if not done:
+            return None
+        return State(self.future.exception() is None)
+
+
+class Runner:
+    """Runs the jobs on threads, recording the order and the concurrency of each group."""
+
+    def __init__(self, seconds=0.02, failing=()):
+
+        self.seconds = seconds
+        self.failing = set(failing)
+        self.executor = ThreadPoolExecutor(max_workers=20)
+        self.lock = threading.Lock()
+        self.running = {}
+        self.max_running = {}
+        self.started = []
+        self.finished = []
+
+    def run(self, job):
+
+        with self.lock:
+            self.started.append(job.key)
+            self.running[job.group] = self.running.get(job.group, 0) + 1
+            self.max_running[job.group] = max(self.max_running.get(job.group, 0), self.running[job.group])
+
+        time.sleep(self.seconds(job) if callable(self.seconds) else self.seconds)
+
+        with self.lock:
+            self.running[job.group] -= 1
+            self.finished.append(job.key)
+
+        if job.key in self.failing:
+            raise RuntimeError(f'job {job.key} failed')
+
+    def submit(self, job):
+        return ThreadFuture(self.executor.submit(self.run, job))
+
+
+def test_each_group_keeps_its_concurrency_limit():
+
+    runner = Runner()
+    jobs = [Job(('a', i), 'a') for i in range(8)] + [Job(('b', i), 'b') for i in range(8)]
+
+    failed = run_bounded(jobs, runner.submit, {'a' : 2, 'b' : 3}, poll_seconds=0.01)
+
+    assert failed == []
+    assert runner.max_running == {'a' : 2, 'b' : 3}
+    assert sorted(runner.finished) == sorted(job.key for job in jobs)
+
+
+def test_jobs_start_after_their_dependencies():
+
+    runner = Runner()
+    jobs = [Job('form'), Job('form_response', depends_on=('form',)), Job('employee'), Job('visit', depends_on=('employee', 'form'))]
+
+    assert run_bounded(jobs, runner.submit, {None : 4}, poll_seconds=0.01) == []
+
+    for job in jobs:
+        for dependency in job.depends_on:
+            assert runner.finished.index(dependency) < runner.started.index(job.key)
+
+
+def test_failures_skip_the_dependent_jobs():
+
+    runner = Runner(failing={'form'})
+    skipped = []
+    jobs = [Job('form'), Job('form_response', depends_on=('form',)), Job('answers', depends_on=('form_response',)), Job('employee')]
+
+    failed = run_bounded(jobs, runner.submit, {None : 2}, poll_seconds=0.01, on_skipped=lambda job, dependencies: skipped.append((job.key, dependencies)))
+
+    assert failed == ['form', 'form_response', 'answers']
+    assert skipped == [('form_response', ['form']), ('answers', ['form_response'])]
+    assert sorted(runner.started) == ['employee', 'form']
+
+
+def test_a_finished_job_frees_its_slot_while_others_run():
+
+    # one slow job and ten quick ones on two slots, the quick ones run one after the other on the free slot
+    runner = Runner(seconds=lambda job: 1.0 if job.key == 'slow' else 0.01)
+    jobs = [Job('slow')] + [Job(i) for i in range(10)]
+
+    started = time.monotonic()
+    run_bounded(jobs, runner.submit, {None : 2}, poll_seconds=0.2)
+
+    assert runner.finished.index(9) < runner.finished.index('slow')
+    assert time.monotonic() - started < 1.5
+
+
+def test_unscheduled_dependencies_are_rejected():
+
+    with pytest.raises(ValueError, match='not scheduled'):
+        run_bounded([Job('visit', depends_on=('employee',))], Runner().submit, {None : 1})
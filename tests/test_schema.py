@@ -0,0 +1,30 @@
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.types import BigInteger
+from models.schema import upgrade_schema, get_schema_differences
+
+
+def test_upgrade_alters_the_columns_whose_type_differs_from_the_model(tmp_path):
+
+    engine = create_engine(f'sqlite:///{tmp_path / "legacy.db"}')
+
+    with engine.begin() as connection:
+        connection.execute(text(
+            'CREATE TABLE visit (id INTEGER NOT NULL PRIMARY KEY, employee_id INTEGER, point_of_sale_id INTEGER, visit_date DATE, '
+            'visit_status VARCHAR, updated_at_millis INTEGER)'
+        ))
+        connection.execute(text('CREATE INDEX ix_visit_updated_at_millis ON visit (updated_at_millis)'))
+        connection.execute(text("INSERT INTO visit (id, employee_id, visit_status, updated_at_millis) VALUES (1, 7, 'done', 1700000000000)"))
+
+    assert any('visit' in diff and 'updated_at_millis' in diff for diff in get_schema_differences(engine))
+
+    upgrade_schema(engine)
+
+    columns = {column['name'] : column for column in inspect(engine).get_columns('visit')}
+    assert isinstance(columns['updated_at_millis']['type'], BigInteger)
+    assert 'ix_visit_updated_at_millis' in {index['name'] for index in inspect(engine).get_indexes('visit')}
+    assert get_schema_differences(engine) == []
+
+    with engine.connect() as connection:
+        assert connection.execute(text('SELECT id, employee_id, visit_status, updated_at_millis FROM visit')).all() == [(1, 7, 'done', 1700000000000)]
+
+    engine.dispose()
@@ -0,0 +1,43 @@
+import pytest
+from config.settings import APIConfig, SyncConfig
+
+TUNING_VARIABLES = (
+    'API_MAX_IN_FLIGHT', 'API_TIMESTAMP_SHARDS', 'API_HTTP_CLIENT', 'API_RATE_LIMIT', 'API_MAX_RETRIES', 'API_CACHE_MODE',
+    'API_CACHE_DIR', 'API_CACHE_TTL', 'API_CACHE_MAX_MB', 'API_STREAM_ITEMS', 'API_BASE_URL', 'API_CONNECT_TIMEOUT', 'API_READ_TIMEOUT'
+)
+
+
+@pytest.fixture(autouse=True)
+def clean_environment(monkeypatch):
+    for name in TUNING_VARIABLES + ('SYNC_MAX_CONCURRENT_TABLES',):
+        monkeypatch.delenv(name, raising=False)
+
+
+def test_api_config_keeps_the_defaults_without_variables():
+
+    assert APIConfig.load_from_env(1, 'domain', 'user', 'password') == APIConfig(1, 'domain', 'user', 'password')
+
+
+def test_api_config_reads_the_tuning_variables(monkeypatch):
+
+    monkeypatch.setenv('API_MAX_IN_FLIGHT', '4')
+    monkeypatch.setenv('API_HTTP_CLIENT', 'httpx')
+    monkeypatch.setenv('API_STREAM_ITEMS', 'si')
+    monkeypatch.setenv('API_BASE_URL', 'http://127.0.0.1:8080')
+    monkeypatch.setenv('API_READ_TIMEOUT', '90')
+
+    config = APIConfig.load_from_env(1, 'domain', 'user', 'password')
+
+    assert (config.max_in_flight, config.http_client, config.stream_items, config.base_url, config.read_timeout) == (4, 'httpx', True, 'http://127.0.0.1:8080', 90.0)
+    assert config.timestamp_shards == 1 and config.app_user == 'user'
+
+
+def test_invalid_settings_are_rejected_at_load_time(monkeypatch):
+
+    monkeypatch.setenv('API_TIMESTAMP_SHARDS', '0')
+    with pytest.raises(ValueError, match='timestamp_shards'):
+        APIConfig.load_from_env(1, 'domain', 'user', 'password')
+
+    monkeypatch.setenv('SYNC_MAX_CONCURRENT_TABLES', '0')
+    with pytest.raises(ValueError, match='max_concurrent_tables'):
+        SyncConfig.load_from_env()
@@ -0,0 +1,167 @@
+import logging
+import threading
+import time
+import pytest
+from benchmarks.fake_server import FakeDataset, FakeInvolvesServer, START_MILLIS
+from involves_api.client import InvolvesAPIClient
+from involves_api.async_client import SyncInvolvesAPIClient
+from involves_api.sharding import WindowMerger, get_windows
+
+RECORDS = 300
+
+
+@pytest.fixture(scope='module')
+def server():
+
+    for name in ('involves_api.client', 'involves_api.async_client'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    with FakeInvolvesServer(FakeDataset(RECORDS, children=1), page_size=20) as server:
+        yield server
+
+
+def get_expected_ids(server, start_millis, end_millis=None):
+
+    items = server.dataset.items['visit']
+
+    return sorted(item['id'] for item in items if item['updatedAtMillis'] > start_millis and (end_millis is None or item['updatedAtMillis'] <= end_millis))
+
+
+@pytest.mark.parametrize('client_cls', [InvolvesAPIClient, SyncInvolvesAPIClient])
+@pytest.mark.parametrize('shards', [2, 3, 7])
+@pytest.mark.parametrize('end_offset', [None, 250])
+def test_sharded_extraction_returns_each_item_of_the_range_once(server, client_cls, shards, end_offset):
+
+    start_millis = START_MILLIS + 30
+    end_millis = START_MILLIS + end_offset if end_offset is not None else None
+
+    with client_cls(1, 'test', 'user', 'password', timestamp_shards=shards, base_url=server.url) as client:
+        ids = [record['id'] for record in client.get_updated_visits(start_millis=start_millis, end_millis=end_millis, stream=True)]
+
+    assert sorted(ids) == get_expected_ids(server, start_millis, end_millis)
+
+
+@pytest.mark.parametrize('client_cls', [InvolvesAPIClient, SyncInvolvesAPIClient])
+def test_sharded_extraction_matches_the_sequential_one(server, client_cls):
+
+    start_millis = START_MILLIS + 10
+
+    with client_cls(1, 'test', 'user', 'password', base_url=server.url) as client:
+        sequential = client.get_updated_visits(start_millis=start_millis, page_func=lambda items: [item['id'] for item in items])
+    with client_cls(1, 'test', 'user', 'password', timestamp_shards=4, base_url=server.url) as client:
+        sharded = client.get_updated_visits(start_millis=start_millis, page_func=lambda items: [item['id'] for item in items])
+
+    assert sequential == get_expected_ids(server, start_millis)
+    assert sorted(sharded) == sequential
+
+
+def test_ranges_narrower_than_the_shards_use_fewer_windows(server):
+
+    start_millis = START_MILLIS + 100
+
+    with InvolvesAPIClient(1, 'test', 'user', 'password', timestamp_shards=7, base_url=server.url) as client:
+        records = client.get_updated_visits(start_millis=start_millis, end_millis=start_millis + 2)
+
+    assert sorted(record['id'] for record in records) == get_expected_ids(server, start_millis, start_millis + 2)
+
+
+def test_errors_of_a_window_are_raised_to_the_caller(server):
+
+    with InvolvesAPIClient(1, 'test', 'user', 'password', max_retries=0, base_url=server.url) as client:
+        records = client._iter_sharded_request_with_timestamp(f'{server.url}/v1/1/unknown/sync/timestamp/', START_MILLIS, START_MILLIS + 100, shards=3)
+        with pytest.raises(Exception):
+            list(records)
+
+
+def test_get_windows_splits_the_range():
+
+    assert get_windows(0, 10, 10, 3) == [(0, 4), (4, 8), (8, 10)]
+    assert get_windows(0, 10, None, 2) == [(0, 5), (5, None)]
+    assert get_windows(0, 2, 2, 7) == [(0, 1), (1, 2)]
+
+
+def test_merger_yields_a_newer_version_from_a_later_window():
+
+    merger = WindowMerger(2)
+
+    assert merger.merge(0, [{'id' : 1, 'updatedAtMillis' : 5}]) == [{'id' : 1, 'updatedAtMillis' : 5}]
+    assert merger.merge(1, [{'id' : 1, 'updatedAtMillis' : 15}]) == [{'id' : 1, 'updatedAtMillis' : 15}]
+
+
+def test_merger_drops_an_older_version_arriving_after_the_newer_one():
+
+    merger = WindowMerger(3)
+
+    assert merger.merge(2, [{'id' : 1, 'updatedAtMillis' : 25}, {'id' : 2, 'updatedAtMillis' : 26}]) == [{'id' : 1, 'updatedAtMillis' : 25}, {'id' : 2, 'updatedAtMillis' : 26}]
+    assert merger.merge(0, [{'id' : 1, 'updatedAtMillis' : 5}, {'id' : 3, 'updatedAtMillis' : 6}]) == [{'id' : 3, 'updatedAtMillis' : 6}]
+    assert merger.merge(1, [{'id' : 2, 'updatedAtMillis' : 15}]) == []
+
+
+def test_merger_yields_items_without_timestamp_once():
+
+    merger = WindowMerger(2)
+
+    assert merger.merge(0, [{'id' : 1}, {'name' : 'without id'}]) == [{'id' : 1}, {'name' : 'without id'}]
+    assert merger.merge(1, [{'id' : 1}, {'name' : 'without id'}]) == [{'name' : 'without id'}]
+
+
+def test_merger_forgets_ids_once_the_earlier_windows_finished():
+
+    merger = WindowMerger(3)
+    merger.merge(0, [{'id' : 1, 'updatedAtMillis' : 5}])
+    merger.merge(1, [{'id' : 2, 'updatedAtMillis' : 15}])
+    merger.merge(2, [{'id' : 3, 'updatedAtMillis' : 25}])
+
+    assert merger.yielded == {0 : {}, 1 : {2 : 15}, 2 : {3 : 25}}
+
+    merger.finish(0)
+    assert merger.yielded == {2 : {3 : 25}}
+
+    merger.finish(2)
+    assert merger.yielded == {2 : {3 : 25}}
+
+    merger.finish(1)
+    assert merger.yielded == {} and not merger.pending
+
+
+class ChangingServer(FakeInvolvesServer):
+    """Updates a record of the first window once that window returned it and before the second window is walked."""
+
+    def __init__(self, dataset, changed_id, second_window_start, **kwargs):
+
+        super().__init__(dataset, **kwargs)
+        self.changed_id = changed_id
+        self.second_window_start = second_window_start
+        self.returned = threading.Event()
+        self.changed_millis = None
+
+    def answer(self, path, query):
+
+        if path.rstrip('/').endswith(f'/{self.second_window_start}') and self.changed_millis is None:
+            self.returned.wait(5)
+            # lets the page of the first window reach the client before the record changes
+            time.sleep(0.2)
+            self.changed_millis = self.dataset.update_items('visit', [self.changed_id])[0]
+
+        status, data = super().answer(path, query)
+        if any(item['id'] == self.changed_id for item in data.get('items', ())):
+            self.returned.set()
+
+        return status, data
+
+
+@pytest.mark.parametrize('client_cls', [InvolvesAPIClient, SyncInvolvesAPIClient])
+def test_record_updated_between_windows_keeps_its_newer_version(client_cls):
+
+    start_millis = START_MILLIS
+    end_millis = START_MILLIS + RECORDS + 50
+    windows = get_windows(start_millis, end_millis, end_millis, 2)
+
+    with ChangingServer(FakeDataset(RECORDS, children=1), 10, windows[1][0], page_size=20) as server:
+        with client_cls(1, 'test', 'user', 'password', timestamp_shards=2, base_url=server.url) as client:
+            records = list(client.get_updated_visits(start_millis=start_millis, end_millis=end_millis, stream=True))
+
+    versions = [record['updatedAtMillis'] for record in records if record['id'] == 10]
+
+    assert versions == [START_MILLIS + 9, server.changed_millis]
+    assert sorted({record['id'] for record in records}) == list(range(2, RECORDS + 1))